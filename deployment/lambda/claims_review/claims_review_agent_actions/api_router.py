@@ -0,0 +1,173 @@
+"""
+Purpose
+
+Routes Bedrock Agents action group events to their handlers. The routes and the parameter binders are
+compiled once, at cold start, from the OpenAPI schema of the action group, so every operation of the
+schema is dispatched by a dictionary lookup on (apiPath, httpMethod) and handlers are registered by
+operationId. The binder reads the parameters and request body properties of an event in a single pass,
+converts them to the types declared in the schema and checks that the required ones are present.
+"""
+
+import json
+from dataclasses import dataclass, field
+
+HTTP_METHODS = {"get", "put", "post", "delete", "patch", "head", "options"}
+
+
+class ParameterError(Exception):
+    """Base exception for parameter-related errors"""
+    pass
+
+class MissingParametersError(ParameterError):
+    """Raised when the parameters dict is empty or missing"""
+    pass
+
+class ParameterNotFoundError(ParameterError):
+    """Raised when a specific parameter is not found"""
+    pass
+
+class InvalidParameterError(ParameterError):
+    """Raised when a parameter value is not valid"""
+    pass
+
+
+class RouteNotFoundError(Exception):
+    """Raised when the apiPath and httpMethod of an event are not in the API schema"""
+    pass
+
+class OperationNotImplementedError(Exception):
+    """Raised when an operation of the API schema has no registered handler"""
+    pass
+
+
+def resolve_reference(openapi_schema: dict, schema: dict) -> dict:
+    """Resolves a local $ref such as #/components/schemas/ClaimStatusUpdate"""
+    while "$ref" in schema:
+        target = openapi_schema
+        for part in schema["$ref"].lstrip("#/").split("/"):
+            target = target[part]
+        schema = target
+    return schema
+
+
+def convert(name: str, value, value_type: str):
+    """Converts a parameter value, sent by the agent as a string, to the type declared in the schema"""
+    try:
+        match value_type:
+            case "string":
+                return str(value)
+            case "integer":
+                return int(value)
+            case "number":
+                return float(value)
+            case "boolean":
+                if isinstance(value, bool):
+                    return value
+                if str(value).lower() not in ("true", "false"):
+                    raise ValueError(value)
+                return str(value).lower() == "true"
+            case "array" | "object":
+                value = json.loads(value) if isinstance(value, str) else value
+                if not isinstance(value, list if value_type == "array" else dict):
+                    raise ValueError(value)
+                return value
+            case _:
+                return value
+    except (TypeError, ValueError):
+        raise InvalidParameterError(f"Invalid value for parameter {name}, expected {value_type}: {value}")
+
+
+@dataclass
+class Operation:
+    operation_id: str
+    parameter_types: dict = field(default_factory=dict)
+    required_parameters: set = field(default_factory=set)
+    body_property_types: dict = field(default_factory=dict)
+    required_body_properties: set = field(default_factory=set)
+    body_required: bool = False
+    handler: callable = None
+
+
+@dataclass
+class ActionRequest:
+    """The bound parameters (path and query) and request body properties of an action group event"""
+    event: dict
+    parameters: dict
+    body: dict
+
+    @property
+    def session_id(self):
+        return self.event.get("sessionId")
+
+
+class ApiRouter:
+
+    def __init__(self, openapi_schema: dict):
+        self.routes = {}
+        self.operations = {}
+        for api_path, path_item in openapi_schema.get("paths", {}).items():
+            for http_method, definition in path_item.items():
+                if http_method not in HTTP_METHODS:
+                    continue
+                operation = self.compile_operation(openapi_schema, definition)
+                self.routes[(api_path, http_method.upper())] = operation
+                self.operations[operation.operation_id] = operation
+
+    @staticmethod
+    def compile_operation(openapi_schema: dict, definition: dict) -> Operation:
+        operation = Operation(operation_id=definition["operationId"])
+        for parameter in definition.get("parameters", []):
+            parameter = resolve_reference(openapi_schema, parameter)
+            operation.parameter_types[parameter["name"]] = parameter.get("schema", {}).get("type", "string")
+            if parameter.get("required"):
+                operation.required_parameters.add(parameter["name"])
+        request_body = definition.get("requestBody")
+        if request_body:
+            operation.body_required = request_body.get("required", False)
+            body_schema = resolve_reference(
+                openapi_schema,
+                request_body.get("content", {}).get("application/json", {}).get("schema", {})
+            )
+            for name, property_schema in body_schema.get("properties", {}).items():
+                operation.body_property_types[name] = resolve_reference(openapi_schema, property_schema).get("type")
+            operation.required_body_properties = set(body_schema.get("required", []))
+        return operation
+
+    def operation(self, operation_id: str):
+        """Decorator registering the handler of an operation of the schema"""
+        if operation_id not in self.operations:
+            raise ValueError(f"Operation {operation_id} is not defined in the API schema")
+
+        def register(handler):
+            self.operations[operation_id].handler = handler
+            return handler
+        return register
+
+    def bind(self, operation: Operation, event: dict) -> ActionRequest:
+        parameters = {}
+        for parameter in event.get("parameters") or []:
+            name = parameter["name"]
+            parameters[name] = convert(name, parameter["value"], operation.parameter_types.get(name, parameter.get("type")))
+        missing = operation.required_parameters.difference(parameters)
+        if missing:
+            raise ParameterNotFoundError(f"Missing parameter: {', '.join(sorted(missing))}")
+
+        body = {}
+        request_body = event.get("requestBody") or {}
+        for body_property in request_body.get("content", {}).get("application/json", {}).get("properties", []):
+            name = body_property["name"]
+            body[name] = convert(name, body_property["value"], operation.body_property_types.get(name, body_property.get("type")))
+        if operation.body_required and not body:
+            raise MissingParametersError("No request body provided")
+        missing = operation.required_body_properties.difference(body)
+        if body and missing:
+            raise ParameterNotFoundError(f"Missing parameter: {', '.join(sorted(missing))}")
+        return ActionRequest(event=event, parameters=parameters, body=body)
+
+    def dispatch(self, event: dict):
+        operation = self.routes.get((event["apiPath"], event["httpMethod"].upper()))
+        if operation is None:
+            raise RouteNotFoundError(f"{event['actionGroup']}::{event['apiPath']} is not a valid API, try another one.")
+        if operation.handler is None:
+            raise OperationNotImplementedError(f"{operation.operation_id} is not implemented")
+        return operation.handler(self.bind(operation, event))
@@ -0,0 +1,92 @@
+"""
+SQL statements of the claims review agent actions, with Data API style :name placeholders
+"""
+
+MEMBER_DETAILS_QUERY = """
+    SELECT insured_id,insured_name,insured_group_number,insured_plan_name,insured_birth_date,insured_policy_number,phone_number
+,address FROM Insured_Person WHERE insured_policy_number=:insured_policy_number;
+"""
+
+PATIENT_DETAILS_QUERY = """
+    SELECT p.patient_id,i.insured_id,p.patient_firstname,p.patient_lastname,p.patient_birth_date,p.relationship_to_insured,p.phone_number,p.sex,p.address 
+    FROM Patient p, Insured_Person i WHERE i.insured_id = p.insured_id AND i.insured_policy_number = :insured_policy_number 
+    AND patient_lastname=:patient_lastname AND patient_birth_date=TO_DATE(:patient_birth_date,'YYYY-MM-DD');
+"""
+
+MEMBER_AND_PATIENT_DETAILS_QUERY = """
+    SELECT 
+    i.insured_id,i.insured_name,i.insured_group_number,i.insured_plan_name,i.insured_birth_date,i.insured_policy_number,i.address insured_address,i.phone_number insured_phone_number,
+    p.patient_id,p.patient_firstname,p.patient_lastname,p.patient_birth_date,p.relationship_to_insured,p.phone_number patient_phone_number,p.sex patient_sex,p.address patient_address
+    FROM Patient p, Insured_Person i WHERE i.insured_id = p.insured_id AND i.insured_policy_number = :insured_policy_number 
+    AND patient_lastname=:patient_lastname AND patient_birth_date=TO_DATE(:patient_birth_date,'YYYY-MM-DD');
+"""
+
+# Claims are upserted on their claim reference id and claim date, the unique key of the partitioned table,
+# a retried createClaim returns the claim it created before. The status of an existing claim is left as is.
+CREATE_CLAIM_QUERY = """
+    INSERT INTO Claim (claim_reference_id,patient_id,claim_date,diagnosis_1,diagnosis_2,diagnosis_3,diagnosis_4,total_charges,balanceDue, amountPaid,claim_status) VALUES 
+    (:claim_reference_id, :patient_id, TO_DATE(:claim_date, 'YYYY-MM-DD'), :diagnosis_1, :diagnosis_2, :diagnosis_3, :diagnosis_4, :total_charges,:balanceDue, :amountPaid, :claim_status)
+    ON CONFLICT (claim_reference_id, claim_date) DO UPDATE SET
+    patient_id=EXCLUDED.patient_id, diagnosis_1=EXCLUDED.diagnosis_1, diagnosis_2=EXCLUDED.diagnosis_2,
+    diagnosis_3=EXCLUDED.diagnosis_3, diagnosis_4=EXCLUDED.diagnosis_4, total_charges=EXCLUDED.total_charges,
+    balanceDue=EXCLUDED.balanceDue, amountPaid=EXCLUDED.amountPaid
+    RETURNING claim_id, TO_CHAR(claim_date, 'YYYY-MM-DD') AS claim_date
+"""
+# A retry with a corrected claim date replaces the claim created with the earlier date, with its service lines
+DELETE_CLAIM_WITH_OTHER_DATE_QUERY = """
+    WITH replaced AS (
+        DELETE FROM Claim WHERE claim_reference_id=:claim_reference_id AND claim_date <> TO_DATE(:claim_date, 'YYYY-MM-DD')
+        RETURNING claim_id, claim_date
+    )
+    DELETE FROM SERVICE s USING replaced r WHERE s.claim_id=r.claim_id AND s.claim_date=r.claim_date
+"""
+# Service lines are upserted on claim id, claim date and line number. Statements on the service lines of a
+# claim include its claim date, so they only touch the partition of the claim's month.
+CREATE_SERVICE_QUERY = """
+    INSERT INTO SERVICE (claim_id, claim_date, line_number, date_of_service, place_of_service,type_of_service,procedure_code,charge_amount) VALUES 
+    (:claim_id, TO_DATE(:claim_date, 'YYYY-MM-DD'), :line_number, TO_DATE(:date_of_service, 'YYYY-MM-DD'), :place_of_service, :type_of_service, :procedure_code, :charge_amount)
+    ON CONFLICT (claim_id, claim_date, line_number) DO UPDATE SET
+    date_of_service=EXCLUDED.date_of_service, place_of_service=EXCLUDED.place_of_service, type_of_service=EXCLUDED.type_of_service,
+    procedure_code=EXCLUDED.procedure_code, charge_amount=EXCLUDED.charge_amount
+"""
+# Lines left over from an earlier attempt that sent more service lines
+DELETE_EXTRA_SERVICES_QUERY = """
+    DELETE FROM SERVICE WHERE claim_id=:claim_id AND claim_date=TO_DATE(:claim_date, 'YYYY-MM-DD') AND line_number > :line_count
+"""
+NEXT_SERVICE_LINE_NUMBER_QUERY = """
+    SELECT COALESCE(MAX(line_number), 0) + 1 AS line_number FROM SERVICE WHERE claim_id=:claim_id AND claim_date=TO_DATE(:claim_date, 'YYYY-MM-DD')
+"""
+# Claim date of a claim id, probes the primary key index of every partition
+CLAIM_DATE_QUERY = """
+    SELECT TO_CHAR(claim_date, 'YYYY-MM-DD') AS claim_date FROM Claim WHERE claim_id=:claim_id
+"""
+# Status of the claim at the end of the review, in the partition of its claim date
+UPDATE_CLAIM_STATUS_QUERY = """
+    UPDATE Claim SET claim_status=:claim_status WHERE claim_id=:claim_id AND claim_date=TO_DATE(:claim_date, 'YYYY-MM-DD')
+    RETURNING claim_id, claim_status
+"""
+
+# Claims of the patients of a policy in the last months, newest first. The claim date bound prunes the
+# partitions of older months.
+CLAIM_HISTORY_QUERY = """
+    SELECT c.claim_id,c.claim_reference_id,TO_CHAR(c.claim_date, 'YYYY-MM-DD') AS claim_date,c.patient_id,p.patient_firstname,p.patient_lastname,
+    c.total_charges,c.amountPaid,c.balanceDue,c.claim_status
+    FROM Insured_Person i JOIN Patient p ON p.insured_id = i.insured_id JOIN Claim c ON c.patient_id = p.patient_id
+    WHERE i.insured_policy_number = :insured_policy_number
+    AND c.claim_date >= CAST(date_trunc('month', CURRENT_DATE) - make_interval(months => CAST(:months AS INT)) AS DATE)
+    ORDER BY c.claim_date DESC, c.claim_id DESC
+    LIMIT :max_results
+"""
+
+# Patients of the policy whose last name is similar to the given one (pg_trgm, GIN index on the lower case
+# last name) or whose birth date matches, best candidates first
+PATIENT_SEARCH_QUERY = """
+    SELECT p.patient_id,i.insured_id,p.patient_firstname,p.patient_lastname,p.patient_birth_date,p.relationship_to_insured,
+    ROUND(similarity(lower(p.patient_lastname), lower(:patient_lastname))::numeric, 3) AS similarity,
+    COALESCE(p.patient_birth_date = CAST(NULLIF(:patient_birth_date, '') AS DATE), FALSE) AS birth_date_match
+    FROM Patient p JOIN Insured_Person i ON i.insured_id = p.insured_id
+    WHERE i.insured_policy_number = :insured_policy_number
+    AND (lower(p.patient_lastname) % lower(:patient_lastname) OR p.patient_birth_date = CAST(NULLIF(:patient_birth_date, '') AS DATE))
+    ORDER BY birth_date_match DESC, similarity DESC, p.patient_id
+    LIMIT :top_k
+"""
@@ -0,0 +1,242 @@
+"""
+Purpose
+
+Semantic cache of the coverage searches of the EOC knowledge base. Reviews of claims of the same plan ask
+near-identical coverage questions, so a search is answered from an earlier retrieval when its normalized query
+matches exactly, or when the embedding of the query is at least similarity_threshold cosine-similar to a cached
+query of the same plan and knowledge base version. Only a miss pays for the vector search.
+
+The knowledge base version is the latest completed ingestion job of the data source. A completed ingestion
+starts a new cache generation, so passages of changed documents are never served from the cache, and the
+entries of earlier generations expire with the DynamoDB TTL. Entries are shared by all containers; the query
+embeddings of a plan are also kept per container to match queries without reading the table.
+
+Every search logs its outcome in CloudWatch embedded metric format. The average of the CacheHit metric is
+the hit rate.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from array import array
+
+from boto3.dynamodb.conditions import Key
+from ingestion_version import latest_ingestion_job_id
+
+METRICS_NAMESPACE = "ClaimsReview/CoverageCache"
+
+
+def normalize_query(query: str) -> str:
+    """Lower case words without punctuation, questions that differ only in case or punctuation share an entry"""
+    return " ".join(re.findall(r"\w+", query.lower()))
+
+
+def normalize_plan_name(plan_name: str) -> str:
+    """Plan names are stored lower case with single spaces in the plan metadata of the EOC documents"""
+    return " ".join(plan_name.lower().split())
+
+
+def pack_vector(vector: list) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def unpack_vector(data: bytes) -> array:
+    vector = array("f")
+    vector.frombytes(bytes(data))
+    return vector
+
+
+def dot(left, right) -> float:
+    return sum(a * b for a, b in zip(left, right))
+
+
+class CoverageCache:
+    """
+    Coverage search of a knowledge base through the cache. Without a table every search is retrieved from
+    the knowledge base, and the metrics still report the searches as misses.
+    """
+
+    def __init__(self, bedrock_agent_client, bedrock_agent_runtime_client, bedrock_runtime_client,
+                 knowledge_base_id: str, data_source_id: str, table=None, plan_filter_field: str = None,
+                 embedding_model_id: str = "amazon.titan-embed-text-v2:0", embedding_dimensions: int = 256,
+                 similarity_threshold: float = 0.95, ttl_seconds: float = 24 * 3600,
+                 max_entries_per_plan: int = 1000, version_refresh_seconds: float = 60,
+                 entries_refresh_seconds: float = 60):
+        self.bedrock_agent_client = bedrock_agent_client
+        self.bedrock_agent_runtime_client = bedrock_agent_runtime_client
+        self.bedrock_runtime_client = bedrock_runtime_client
+        self.knowledge_base_id = knowledge_base_id
+        self.data_source_id = data_source_id
+        self.table = table
+        self.plan_filter_field = plan_filter_field
+        self.embedding_model_id = embedding_model_id
+        self.embedding_dimensions = embedding_dimensions
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_plan = max_entries_per_plan
+        self.version_refresh_seconds = version_refresh_seconds
+        self.entries_refresh_seconds = entries_refresh_seconds
+        self.version = None
+        self.version_checked_at = 0
+        # {scope: {"loaded_at": monotonic time, "entries": [(query_hash, top_k, vector)]}}
+        self.scopes = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def knowledge_base_version(self) -> str:
+        """The id of the latest completed ingestion job, checked at most every version_refresh_seconds"""
+        if self.version is not None and time.monotonic() - self.version_checked_at < self.version_refresh_seconds:
+            return self.version
+        version = latest_ingestion_job_id(self.bedrock_agent_client, self.knowledge_base_id, self.data_source_id)
+        with self.lock:
+            if version != self.version:
+                print(f"Knowledge base {self.knowledge_base_id} is at version {version}")
+                self.scopes.clear()
+            self.version = version
+            self.version_checked_at = time.monotonic()
+        return version
+
+    def embed(self, text: str) -> list:
+        response = self.bedrock_runtime_client.invoke_model(modelId=self.embedding_model_id, body=json.dumps({
+            "inputText": text,
+            "dimensions": self.embedding_dimensions,
+            "normalize": True
+        }))
+        return json.loads(response["body"].read())["embedding"]
+
+    def retrieve(self, query: str, plan_name: str, top_k: int) -> list:
+        vector_search_configuration = {"numberOfResults": top_k}
+        if self.plan_filter_field:
+            vector_search_configuration["filter"] = {"equals": {"key": self.plan_filter_field, "value": plan_name}}
+        response = self.bedrock_agent_runtime_client.retrieve(
+            knowledgeBaseId=self.knowledge_base_id,
+            retrievalQuery={"text": query},
+            retrievalConfiguration={"vectorSearchConfiguration": vector_search_configuration}
+        )
+        return [
+            {
+                "text": result["content"]["text"],
+                "source": result.get("location", {}).get("s3Location", {}).get("uri"),
+                "score": result.get("score")
+            }
+            for result in response["retrievalResults"]
+        ]
+
+    def scope_entries(self, scope: str) -> list:
+        """The query embeddings cached for the plan and version, read from the table every entries_refresh_seconds"""
+        with self.lock:
+            cached = self.scopes.get(scope)
+            if cached is not None and time.monotonic() - cached["loaded_at"] < self.entries_refresh_seconds:
+                return cached["entries"]
+        entries = []
+        query = {
+            "KeyConditionExpression": Key("scope").eq(scope),
+            "ProjectionExpression": "query_hash, top_k, embedding"
+        }
+        while len(entries) < self.max_entries_per_plan:
+            response = self.table.query(**query)
+            entries += [(item["query_hash"], int(item["top_k"]), unpack_vector(item["embedding"].value))
+                        for item in response["Items"]]
+            if "LastEvaluatedKey" not in response:
+                break
+            query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        entries = entries[:self.max_entries_per_plan]
+        with self.lock:
+            self.scopes[scope] = {"loaded_at": time.monotonic(), "entries": entries}
+        return entries
+
+    def get_entry(self, scope: str, query_hash: str):
+        item = self.table.get_item(Key={"scope": scope, "query_hash": query_hash}).get("Item")
+        # expired items are deleted by the TTL within a few days, not at their expiry
+        if item is None or item["expires_at"] < time.time():
+            return None
+        return item
+
+    def put_entry(self, scope: str, query_hash: str, normalized_query: str, top_k: int, vector: list,
+                  passages: list):
+        self.table.put_item(Item={
+            "scope": scope,
+            "query_hash": query_hash,
+            "query": normalized_query,
+            "top_k": top_k,
+            "embedding": pack_vector(vector),
+            "passages": json.dumps(passages),
+            "expires_at": int(time.time() + self.ttl_seconds)
+        })
+        with self.lock:
+            cached = self.scopes.get(scope)
+            if cached is not None and len(cached["entries"]) < self.max_entries_per_plan:
+                cached["entries"].append((query_hash, top_k, unpack_vector(pack_vector(vector))))
+
+    def search(self, query: str, plan_name: str, top_k: int) -> dict:
+        """
+        The top_k passages of the plan's documents for the query, with the cache outcome: exact, semantic
+        or miss, and the similarity of the cached query for semantic hits
+        """
+        started_at = time.perf_counter()
+        normalized_query = normalize_query(query)
+        plan_name = normalize_plan_name(plan_name)
+        if not normalized_query or not plan_name:
+            raise ValueError("query and plan_name must not be empty")
+        version = self.knowledge_base_version()
+        outcome, similarity, passages = "miss", None, None
+
+        if self.table is not None:
+            scope = f"{self.knowledge_base_id}#{version}#{plan_name}"
+            query_hash = hashlib.sha256(f"{top_k}|{normalized_query}".encode("utf-8")).hexdigest()
+            item = self.get_entry(scope, query_hash)
+            if item is not None:
+                outcome, passages = "exact", json.loads(item["passages"])
+            else:
+                vector = self.embed(normalized_query)
+                best_hash, best_similarity = None, -1.0
+                for entry_hash, entry_top_k, entry_vector in self.scope_entries(scope):
+                    if entry_top_k == top_k:
+                        entry_similarity = dot(vector, entry_vector)
+                        if entry_similarity > best_similarity:
+                            best_hash, best_similarity = entry_hash, entry_similarity
+                if best_similarity >= self.similarity_threshold:
+                    item = self.get_entry(scope, best_hash)
+                    if item is not None:
+                        outcome, similarity, passages = "semantic", best_similarity, json.loads(item["passages"])
+                if passages is None:
+                    passages = self.retrieve(query, plan_name, top_k)
+                    self.put_entry(scope, query_hash, normalized_query, top_k, vector, passages)
+        else:
+            passages = self.retrieve(query, plan_name, top_k)
+
+        with self.lock:
+            if outcome == "miss":
+                self.misses += 1
+            else:
+                self.hits += 1
+        self.emit_metrics(outcome, (time.perf_counter() - started_at) * 1000, plan_name, similarity)
+        return {"passages": passages, "cache": outcome, "similarity": similarity, "version": version}
+
+    def emit_metrics(self, outcome: str, milliseconds: float, plan_name: str, similarity):
+        print(json.dumps({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["KnowledgeBaseId"]],
+                    "Metrics": [
+                        {"Name": "CacheHit", "Unit": "Count"},
+                        {"Name": "SemanticHit", "Unit": "Count"},
+                        {"Name": "CacheMiss", "Unit": "Count"},
+                        {"Name": "SearchMilliseconds", "Unit": "Milliseconds"}
+                    ]
+                }]
+            },
+            "KnowledgeBaseId": self.knowledge_base_id,
+            "CacheHit": int(outcome != "miss"),
+            "SemanticHit": int(outcome == "semantic"),
+            "CacheMiss": int(outcome == "miss"),
+            "SearchMilliseconds": round(milliseconds, 1),
+            "Outcome": outcome,
+            "PlanName": plan_name,
+            "Similarity": similarity
+        }))
@@ -0,0 +1,107 @@
+"""
+Purpose
+
+Routes the claims database statements of the agent actions between the writer and an optional Aurora
+reader. Writes always go to the writer. Reads go to the reader while its replica lag stays within
+max_staleness_seconds; reads of a session that wrote less than max_staleness_seconds ago go to the
+writer, so a session always reads its own writes. The time of the last write is kept in the agent
+session attributes, which Bedrock Agents passes to every action call of the session.
+"""
+
+import time
+
+LAST_WRITE_SESSION_ATTRIBUTE = "claims_db_last_write_at"
+
+# replica_lag_in_msec is a real, cast so both backends return it as a longValue
+REPLICA_LAG_QUERY = """
+    SELECT CAST(replica_lag_in_msec AS BIGINT) replica_lag_in_msec FROM aurora_replica_status()
+    WHERE server_id = aurora_db_instance_identifier()
+"""
+
+
+class DatabaseRouter:
+
+    def __init__(self, writer, reader=None, max_staleness_seconds: float = 1, lag_check_interval_seconds: float = 5):
+        self.writer = writer
+        self.reader = reader
+        self.max_staleness_seconds = max_staleness_seconds
+        self.lag_check_interval_seconds = lag_check_interval_seconds
+        self.replica_lag_seconds = None
+        self.lag_checked_at = None
+        self.session_attributes = {}
+        # reads served by each instance in this container, logged with every routing decision
+        self.reads = {"reader": 0, "writer": 0}
+
+    def begin(self, session_attributes: dict):
+        """Starts an invocation, writes are recorded in the given session attributes"""
+        self.session_attributes = session_attributes if session_attributes is not None else {}
+
+    def record_write(self):
+        self.session_attributes[LAST_WRITE_SESSION_ATTRIBUTE] = str(time.time())
+
+    def wrote_recently(self) -> bool:
+        last_write_at = self.session_attributes.get(LAST_WRITE_SESSION_ATTRIBUTE)
+        try:
+            return last_write_at is not None and time.time() - float(last_write_at) < self.max_staleness_seconds
+        except ValueError:
+            return True
+
+    def reader_within_staleness(self) -> bool:
+        now = time.monotonic()
+        if self.lag_checked_at is None or now - self.lag_checked_at >= self.lag_check_interval_seconds:
+            self.lag_checked_at = now
+            try:
+                result = self.reader.execute_statement(REPLICA_LAG_QUERY)
+                lag = result["records"][0][0] if result["records"] else {"isNull": True}
+                lag_in_msec = lag.get("longValue", lag.get("doubleValue"))
+                self.replica_lag_seconds = None if lag.get("isNull") or lag_in_msec is None else lag_in_msec / 1000
+            except Exception as e:
+                print(f"Unable to get the replica lag of the reader: {e}")
+                self.replica_lag_seconds = None
+        return self.replica_lag_seconds is not None and self.replica_lag_seconds <= self.max_staleness_seconds
+
+    def routing_reason(self):
+        """Why a read goes to the writer, None when it can go to the reader"""
+        if self.reader is None:
+            return "no reader"
+        if self.wrote_recently():
+            return "session wrote recently"
+        if not self.reader_within_staleness():
+            if self.replica_lag_seconds is None:
+                return "replica lag unknown"
+            return f"replica lag {self.replica_lag_seconds} seconds"
+        return None
+
+    def log_read(self, instance: str, reason: str):
+        self.reads[instance] += 1
+        print(f"Read routed to the {instance} ({reason}), {self.reads['reader']} reader and "
+              f"{self.reads['writer']} writer reads in this container")
+
+    def read(self, sql: str, parameters: list = None):
+        reason = self.routing_reason()
+        if reason is None:
+            try:
+                result = self.reader.execute_statement(sql, parameters=parameters)
+                self.log_read("reader", f"replica lag {self.replica_lag_seconds} seconds")
+                return result
+            except Exception as e:
+                print(f"Read from the reader failed, reading from the writer: {e}")
+                reason = "reader failed"
+        result = self.writer.execute_statement(sql, parameters=parameters)
+        self.log_read("writer", reason)
+        return result
+
+    def write(self, sql: str, parameters: list = None, transaction_id: str = None):
+        result = self.writer.execute_statement(sql, parameters=parameters, transaction_id=transaction_id)
+        self.record_write()
+        return result
+
+    def batch_write(self, sql: str, parameter_sets: list, transaction_id: str = None):
+        result = self.writer.batch_execute_statement(sql, parameter_sets, transaction_id=transaction_id)
+        self.record_write()
+        return result
+
+    def run_in_transaction(self, work):
+        result = self.writer.run_in_transaction(work)
+        self.record_write()
+        return result
@@ -1,137 +1,201 @@
-from time import time
+from time import perf_counter
 import json
 import boto3
 import os
+from claims_form_compaction import (
+    compact_claims_form,
+    project_fields,
+    estimate_tokens,
+    InvalidJsonPathError,
+    SERVICE_LINES_FIELD,
+)
+from s3_json_cache import S3JsonCache, parse_s3_uri
+from data_api_client import DataApiClient
+from postgres_client import PostgresClient
+from database_router import DatabaseRouter
+from member_directory import MemberDirectory
+from coverage_cache import CoverageCache
+from code_index import CODE_INDEX_KEY, CodeIndex
+from claims_queries import (
+    MEMBER_DETAILS_QUERY,
+    MEMBER_AND_PATIENT_DETAILS_QUERY,
+    CREATE_CLAIM_QUERY,
+    DELETE_CLAIM_WITH_OTHER_DATE_QUERY,
+    CREATE_SERVICE_QUERY,
+    DELETE_EXTRA_SERVICES_QUERY,
+    NEXT_SERVICE_LINE_NUMBER_QUERY,
+    CLAIM_DATE_QUERY,
+    UPDATE_CLAIM_STATUS_QUERY,
+    CLAIM_HISTORY_QUERY,
+    PATIENT_SEARCH_QUERY,
+)
+from api_router import (
+    ApiRouter,
+    ActionRequest,
+    ParameterError,
+    ParameterNotFoundError,
+    InvalidParameterError,
+    RouteNotFoundError,
+    OperationNotImplementedError,
+)
 
 s3 = boto3.client("s3")
 
-session = boto3.Session()  
-rds_data = session.client(
-    service_name='rds-data'
-)
-
 CLAIMS_DB_CLUSTER_ARN = os.environ['CLAIMS_DB_CLUSTER_ARN']
 CLAIMS_DB_DATABASE_NAME = os.environ['CLAIMS_DB_DATABASE_NAME']
 CLAIMS_DB_CREDENTIALS_SECRET_ARN = os.environ['CLAIMS_DB_CREDENTIALS_SECRET_ARN']
 
+# DATA_API runs statements through the RDS Data API, POSTGRES over a pg8000 connection held across
+# warm invocations to CLAIMS_DB_WRITER_HOST, the cluster endpoint or an RDS Proxy endpoint
+CLAIMS_DB_BACKEND = os.environ.get('CLAIMS_DB_BACKEND', 'DATA_API')
+CLAIMS_DB_WRITER_HOST = os.environ.get('CLAIMS_DB_WRITER_HOST', None)
+# Aurora reader endpoint for lookups, set when the cluster has a reader instance
+CLAIMS_DB_READER_HOST = os.environ.get('CLAIMS_DB_READER_HOST', None)
+
+def create_postgres_client(host):
+    return PostgresClient(
+        host=host,
+        port=int(os.environ.get('CLAIMS_DB_PORT', '5432')),
+        database=CLAIMS_DB_DATABASE_NAME,
+        secret_arn=CLAIMS_DB_CREDENTIALS_SECRET_ARN,
+        ca_bundle=os.environ.get('CLAIMS_DB_CA_BUNDLE', None),
+        verify_certificate=os.environ.get('CLAIMS_DB_TLS_VERIFY', 'true').lower() == 'true'
+    )
 
-MEMBER_DETAILS_QUERY = """
-    SELECT insured_id,insured_name,insured_group_number,insured_plan_name,insured_birth_date,insured_policy_number,phone_number
-,address FROM Insured_Person WHERE insured_policy_number=:insured_policy_number;
-"""
-
-PATIENT_DETAILS_QUERY = """
-    SELECT p.patient_id,i.insured_id,p.patient_firstname,p.patient_lastname,p.patient_birth_date,p.relationship_to_insured,p.phone_number,p.sex,p.address 
-    FROM Patient p, Insured_Person i WHERE i.insured_id = p.insured_id AND i.insured_policy_number = :insured_policy_number 
-    AND patient_lastname=:patient_lastname AND patient_birth_date=TO_DATE(:patient_birth_date,'YYYY-MM-DD');
-"""
-
-MEMBER_AND_PATIENT_DETAILS_QUERY = """
-    SELECT 
-    i.insured_id,i.insured_name,i.insured_group_number,i.insured_plan_name,i.insured_birth_date,i.insured_policy_number,i.address insured_address,i.phone_number insured_phone_number,
-    p.patient_id,p.patient_firstname,p.patient_lastname,p.patient_birth_date,p.relationship_to_insured,p.phone_number patient_phone_number,p.sex patient_sex,p.address patient_address
-    FROM Patient p, Insured_Person i WHERE i.insured_id = p.insured_id AND i.insured_policy_number = :insured_policy_number 
-    AND patient_lastname=:patient_lastname AND patient_birth_date=TO_DATE(:patient_birth_date,'YYYY-MM-DD');
-"""
-
-CREATE_CLAIM_QUERY = """
-    INSERT INTO Claim (patient_id,claim_date,diagnosis_1,diagnosis_2,diagnosis_3,diagnosis_4,total_charges,balanceDue, amountPaid,claim_status) VALUES 
-    (:patient_id, TO_DATE(:claim_date, 'YYYY-MM-DD'), :diagnosis_1, :diagnosis_2, :diagnosis_3, :diagnosis_4, :total_charges,:balanceDue, :amountPaid, :claim_status)
-    RETURNING claim_id
-"""
-CREATE_SERVICE_QUERY = """
-    INSERT INTO SERVICE (claim_id, date_of_service, place_of_service,type_of_service,procedure_code,procedure_code) VALUES 
-    (:claim_id, TO_DATE(:date_of_service, 'YYYY-MM-DD'), :place_of_service, :type_of_service, :procedure_code, :procedure_code)
-    RETURNING service_id
-"""
-
-
-
-class ParameterError(Exception):
-    """Base exception for parameter-related errors"""
-    pass
+match CLAIMS_DB_BACKEND:
+    case 'DATA_API':
+        # Retries calls made while the Aurora Serverless cluster resumes or the Data API throttles
+        writer = DataApiClient(
+            CLAIMS_DB_CLUSTER_ARN,
+            CLAIMS_DB_CREDENTIALS_SECRET_ARN,
+            CLAIMS_DB_DATABASE_NAME,
+            max_retry_seconds=float(os.environ.get('DATA_API_MAX_RETRY_SECONDS', '60'))
+        )
+    case 'POSTGRES':
+        writer = create_postgres_client(CLAIMS_DB_WRITER_HOST)
+    case _:
+        raise ValueError(f"Invalid CLAIMS_DB_BACKEND: {CLAIMS_DB_BACKEND}")
+
+database = DatabaseRouter(
+    writer=writer,
+    reader=create_postgres_client(CLAIMS_DB_READER_HOST) if CLAIMS_DB_READER_HOST else None,
+    max_staleness_seconds=float(os.environ.get('CLAIMS_DB_READER_MAX_STALENESS_SECONDS', '1'))
+)
+# OpenAPI schema of the action group, the routes and parameter binders are compiled from it at cold start
+CLAIMS_REVIEW_API_SCHEMA_FILE = os.environ['CLAIMS_REVIEW_API_SCHEMA_FILE']
+# Maximum number of tokens of claim form data returned to the agent, 0 disables the budget
+CLAIMS_FORM_TOKEN_BUDGET = int(os.environ.get('CLAIMS_FORM_TOKEN_BUDGET', '0'))
+
+# Parsed claim artifacts read from S3 are kept for the lifetime of the container, claim form extractions and
+# the API schema asset do not change under their key and are revalidated by ETag after the maximum age only
+s3_json_cache = S3JsonCache(
+    s3,
+    max_bytes=int(os.environ.get('CLAIMS_S3_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+    max_age_seconds=float(os.environ.get('CLAIMS_S3_CACHE_MAX_AGE_SECONDS', '300'))
+)
 
-class MissingParametersError(ParameterError):
-    """Raised when the parameters dict is empty or missing"""
-    pass
+router = ApiRouter(s3_json_cache.get_json(CLAIMS_REVIEW_API_SCHEMA_FILE))
+
+# Upper bound of the candidates returned by searchPatients
+PATIENT_SEARCH_MAX_RESULTS = 20
+
+# Claim history of listClaimsForInsured, a bounded number of months keeps the query on recent partitions
+CLAIM_HISTORY_DEFAULT_MONTHS = 12
+CLAIM_HISTORY_MAX_MONTHS = 120
+CLAIM_HISTORY_MAX_RESULTS = 100
+
+# Statuses set by updateClaim at the end of the review, see STEP 6 of the agent instruction
+CLAIM_STATUSES = ("ELIGIBLE", "ADJUDICATOR_REVIEW")
+
+# Member and patient lookups are served from the exported member directory snapshot when one younger
+# than MEMBER_SNAPSHOT_MAX_AGE_SECONDS exists, and from the database otherwise
+CLAIMS_REVIEW_BUCKET_NAME = os.environ.get('CLAIMS_REVIEW_BUCKET_NAME', None)
+member_directory = MemberDirectory(
+    s3,
+    s3_json_cache,
+    bucket=CLAIMS_REVIEW_BUCKET_NAME,
+    max_age_seconds=float(os.environ['MEMBER_SNAPSHOT_MAX_AGE_SECONDS']),
+    refresh_seconds=float(os.environ.get('MEMBER_SNAPSHOT_REFRESH_SECONDS', '60'))
+) if CLAIMS_REVIEW_BUCKET_NAME and 'MEMBER_SNAPSHOT_MAX_AGE_SECONDS' in os.environ else None
+
+# Coverage searches of the EOC knowledge base, answered from the semantic cache in COVERAGE_CACHE_TABLE_NAME
+# when it is set, see coverage_cache in cdk.json
+COVERAGE_KNOWLEDGE_BASE_ID = os.environ.get('COVERAGE_KNOWLEDGE_BASE_ID', None)
+COVERAGE_CACHE_TABLE_NAME = os.environ.get('COVERAGE_CACHE_TABLE_NAME', None)
+COVERAGE_SEARCH_DEFAULT_RESULTS = 5
+COVERAGE_SEARCH_MAX_RESULTS = 20
+coverage_cache = CoverageCache(
+    bedrock_agent_client=boto3.client("bedrock-agent"),
+    bedrock_agent_runtime_client=boto3.client("bedrock-agent-runtime"),
+    bedrock_runtime_client=boto3.client("bedrock-runtime"),
+    knowledge_base_id=COVERAGE_KNOWLEDGE_BASE_ID,
+    data_source_id=os.environ['COVERAGE_DATA_SOURCE_ID'],
+    table=boto3.resource("dynamodb").Table(COVERAGE_CACHE_TABLE_NAME) if COVERAGE_CACHE_TABLE_NAME else None,
+    plan_filter_field=os.environ.get('COVERAGE_PLAN_FILTER_FIELD') or None,
+    embedding_model_id=os.environ.get('COVERAGE_EMBEDDING_MODEL_ID', 'amazon.titan-embed-text-v2:0'),
+    embedding_dimensions=int(os.environ.get('COVERAGE_EMBEDDING_DIMENSIONS', '256')),
+    similarity_threshold=float(os.environ.get('COVERAGE_CACHE_SIMILARITY_THRESHOLD', '0.95')),
+    ttl_seconds=float(os.environ.get('COVERAGE_CACHE_TTL_SECONDS', str(24 * 3600))),
+    max_entries_per_plan=int(os.environ.get('COVERAGE_CACHE_MAX_ENTRIES_PER_PLAN', '1000')),
+    version_refresh_seconds=float(os.environ.get('COVERAGE_VERSION_REFRESH_SECONDS', '60'))
+) if COVERAGE_KNOWLEDGE_BASE_ID else None
+
+# ICD-10-CM, CPT and HCPCS code index built by source/claims_review_app/build_code_index.py into the claims
+# review bucket, loaded on the first validation of the container and kept for its lifetime
+CODE_INDEX_ENABLED = os.environ.get('CODE_INDEX_ENABLED', 'false').lower() == 'true'
+DIAGNOSIS_FIELDS = ["diagnosis_1", "diagnosis_2", "diagnosis_3", "diagnosis_4"]
+code_index = None
+
+
+def run_query(sql_statement, parameters=None):
+    """Runs a read only statement, on the reader when it is within the staleness bound"""
+    print(f"SQL statement: {sql_statement}")
+    return database.read(sql_statement, parameters=parameters)
 
-class ParameterNotFoundError(ParameterError):
-    """Raised when a specific parameter is not found"""
-    pass
+def run_command(sql_statement, parameters=None, transaction_id=None):
+    print(f"SQL statement: {sql_statement}")
+    return database.write(sql_statement, parameters=parameters, transaction_id=transaction_id)
 
+def run_batch_command(sql_statement, parameter_sets, transaction_id=None):
+    """Runs the statement once per parameter set, in a single call with the Data API backend"""
+    print(f"SQL statement: {sql_statement} ({len(parameter_sets)} parameter sets)")
+    return database.batch_write(sql_statement, parameter_sets, transaction_id=transaction_id)
 
-def run_command(sql_statement, parameters=None):
-    print(f"SQL statement: {sql_statement}")
-    result = rds_data.execute_statement(
-        resourceArn=CLAIMS_DB_CLUSTER_ARN,
-        secretArn=CLAIMS_DB_CREDENTIALS_SECRET_ARN,
-        database=CLAIMS_DB_DATABASE_NAME,
-        sql=sql_statement,
-        includeResultMetadata=True,
-        parameters=parameters
-    )
-    return result
+def run_in_transaction(work):
+    """Calls work(transaction_id) in a transaction, committed if it returns and rolled back if it raises"""
+    return database.run_in_transaction(work)
 
-def getClaimsFormData(event) :
-    s3_uri = get_parameter(event, "s3URI")
-    response = s3.get_object(Bucket=s3_uri.split('/',3)[2], Key=s3_uri.split('/',3)[3])
-    content = response['Body'].read().decode('utf-8')
-    json_content = json.loads(content)
+@router.operation("getClaimsFormData")
+def getClaimsFormData(request: ActionRequest) :
+    s3_uri = request.parameters["s3URI"]
+    try:
+        parse_s3_uri(s3_uri)
+    except ValueError as e:
+        raise InvalidParameterError(str(e))
+    json_content = s3_json_cache.get_json(s3_uri)
+
+    fields = request.parameters.get("fields")
+    if fields:
+        # only the values selected by the JSONPath expressions
+        try:
+            projection = project_fields(json_content, fields.split(","))
+        except InvalidJsonPathError as e:
+            raise InvalidParameterError(str(e))
+        return {
+            "claims_form_data": projection
+        }
 
+    claims_form_data, omitted_fields = compact_claims_form(json_content, token_budget=CLAIMS_FORM_TOKEN_BUDGET)
+    print(f"Claim form data compacted from {estimate_tokens(json_content)} to {estimate_tokens(claims_form_data)} tokens")
     #create response json as a list of dictionaries
     response =  {
-            "claims_form_data": json_content
+            "claims_form_data": claims_form_data
     }
+    if omitted_fields:
+        response["omitted_fields"] = omitted_fields
     return response
 
 
-def getAllOpenClaims(event) :
-    
-    #create response json as a list of dictionaries
-    response = [
-        {
-            "claimId": "11111111",
-            "policyHolderId": "John Doe",
-            "claimStatus": "2021-01-01",
-        }
-    ]
-    return response
-
-def get_parameter(event, parameter_name):
-    params = event["parameters"]
-    if not params:
-        raise MissingParametersError("No parameters provided")
-    else:
-        param = [p for p in params if p["name"] == parameter_name]
-        if not param:
-            raise ParameterNotFoundError(f"Missing parameter: {parameter_name}")
-        else:
-            return param[0]["value"]
-
-def get_request_property(event, property_name, defaultValue=None):
-    request_body = event["requestBody"]
-    content = request_body["content"]
-    application_json = content["application/json"]
-    properties = application_json["properties"]
-    property = [p for p in properties if p["name"]==property_name]
-    if not property:
-        if not defaultValue:
-            raise ParameterNotFoundError(f"Missing parameter: {property_name}")
-        else:
-            return defaultValue
-    else:
-        value = None
-        match property[0]["type"]:
-            case 'string':
-                value = str(property[0]["value"])
-            case 'number':
-                value = float(property[0]["value"])
-            case 'integer':
-                value = int(property[0]["value"])
-            case _:
-                value = property[0]["value"]
-    return value
-
 def results_by_column_name(result):
     columns = [column["name"] for column in result["columnMetadata"]]
     records = result["records"]
@@ -160,11 +224,12 @@ def create_param(name, value):
     else:
         raise ValueError(f"Unsupported type for {name}: {type(value)}")
 
-def getMemberAndPatientDetails(event) :
+@router.operation("getMemberAndPatientDetails")
+def getMemberAndPatientDetails(request: ActionRequest) :
 
-    insured_policy_number = get_parameter(event, "insured_id_number")
-    patient_lastname = get_parameter(event, "patient_last_name")
-    patient_birth_date = get_parameter(event, "patient_birth_date")
+    insured_policy_number = request.parameters["insured_id_number"]
+    patient_lastname = request.parameters["patient_last_name"]
+    patient_birth_date = request.parameters["patient_birth_date"]
     parameters=[
         {
             'name':'insured_policy_number', 
@@ -180,9 +245,15 @@ def getMemberAndPatientDetails(event) :
         }
     ] 
 
-    result = run_command(MEMBER_AND_PATIENT_DETAILS_QUERY, parameters)
-    print(result)
-    data = results_by_column_name(result)
+    member = member_directory.lookup(insured_policy_number, patient_lastname, patient_birth_date) \
+        if member_directory else None
+    if member is not None:
+        data = [member]
+        print(f"Member found in snapshot {member_directory.version}")
+    else:
+        result = run_query(MEMBER_AND_PATIENT_DETAILS_QUERY, parameters)
+        print(result)
+        data = results_by_column_name(result)
     if not data:
         return f"""
             Unable to get Member and/or Patient details with 
@@ -214,9 +285,10 @@ def getMemberAndPatientDetails(event) :
 
     return response
 
-def getMemberDetails(event) :
+@router.operation("getMemberDetails")
+def getMemberDetails(request: ActionRequest) :
 
-    insured_policy_number = get_parameter(event, "insured_id_number")
+    insured_policy_number = request.parameters["insured_id_number"]
     parameters=[
         {
             'name':'insured_policy_number', 
@@ -224,7 +296,7 @@ def getMemberDetails(event) :
         }
     ] 
 
-    result = run_command(MEMBER_DETAILS_QUERY, parameters)
+    result = run_query(MEMBER_DETAILS_QUERY, parameters)
     print(result)
     data = results_by_column_name(result)
     if not data:
@@ -243,147 +315,281 @@ def getMemberDetails(event) :
 
     return response
 
-def listClaimsForInsured(event) :
+@router.operation("listClaimsForInsured")
+def listClaimsForInsured(request: ActionRequest) :
+    """Claims of the patients of the policy, newest first, since the start of the month the given months ago"""
+    months = request.parameters.get("months", CLAIM_HISTORY_DEFAULT_MONTHS)
+    if not 0 <= months <= CLAIM_HISTORY_MAX_MONTHS:
+        raise InvalidParameterError(f"months must be between 0 and {CLAIM_HISTORY_MAX_MONTHS}")
+    parameters = [
+        create_param("insured_policy_number", request.parameters["insuredId"]),
+        create_param("months", months),
+        create_param("max_results", CLAIM_HISTORY_MAX_RESULTS)
+    ]
+    result = run_query(CLAIM_HISTORY_QUERY, parameters)
     response = [
         {
-            "claimId": "XXXXXXXX",
-            "policyHolderId": "John Doe",
-            "claimStatus": "2021-01-01",
+            "claimId": claim['claim_id'],
+            "claimReferenceId": claim['claim_reference_id'],
+            "claimDate": claim['claim_date'],
+            "patientId": claim['patient_id'],
+            "patientFirstName": claim['patient_firstname'],
+            "patientLastName": claim['patient_lastname'],
+            "totalCharges": claim['total_charges'],
+            "amountPaid": claim['amountpaid'],
+            "balanceDue": claim['balancedue'],
+            "claimStatus": claim['claim_status']
         }
+        for claim in results_by_column_name(result)
     ]
     return response
 
-def getClaim(event):
-    response = {"claimId": "XXXXXXXX",
-                "claim_description": "Not Implement"
-    }
-
-    return response
-
-def create_claim(event) :
+def service_parameters(claim_id: int, claim_date: str, line_number: int, service: dict) -> list:
+    try:
+        return [
+            create_param("claim_id", claim_id),
+            create_param("claim_date", claim_date),
+            create_param("line_number", line_number),
+            create_param("date_of_service", str(service["date_of_service"])),
+            create_param("place_of_service", str(service.get("place_of_service", ''))),
+            create_param("type_of_service", str(service.get("type_of_service", ''))),
+            create_param("procedure_code", str(service["procedure_code"])),
+            create_param("charge_amount", float(service["charge_amount"]))
+        ]
+    except KeyError as e:
+        raise ParameterNotFoundError(f"Missing service line property: {e.args[0]}")
+    except (TypeError, ValueError) as e:
+        raise InvalidParameterError(f"Invalid service line {line_number}: {e}")
+
+@router.operation("createClaim")
+def create_claim(request: ActionRequest) :
+    """
+    Creates the claim and all of its service lines in one transaction. The claim reference id, which the
+    review uses as agent session id, is the idempotency key: retrying the call updates the same records.
+    """
+    claim = request.body
+    claim_reference_id = claim.get("claim_reference_id") or request.session_id
+    if not claim_reference_id:
+        raise ParameterNotFoundError("Missing parameter: claim_reference_id")
+    services = claim.get("services", [])
+    if not all(isinstance(service, dict) for service in services):
+        raise InvalidParameterError("services must be a list of service line objects")
     parameters = [
-        create_param("patient_id", get_request_property (event, "patient_id")),
-        create_param("claim_date", get_request_property(event,"claim_date")),
-        create_param("diagnosis_1", get_request_property(event,"diagnosis_1")),
-        create_param("diagnosis_2", get_request_property(event,"diagnosis_2",'')),
-        create_param("diagnosis_3", get_request_property(event,"diagnosis_3",'')),
-        create_param("diagnosis_4", get_request_property(event,"diagnosis_4",'')),
-        create_param("total_charges", get_request_property(event,"total_charges")),
-        create_param("amountPaid", get_request_property(event,"amount_paid")),
-        create_param("balanceDue", get_request_property(event,"balance")),
-        create_param("claim_status", get_request_property(event,"claim_status","NEW"))
+        create_param("claim_reference_id", claim_reference_id),
+        create_param("patient_id", claim["patient_id"]),
+        create_param("claim_date", claim["claim_date"]),
+        create_param("diagnosis_1", claim["diagnosis_1"]),
+        create_param("diagnosis_2", claim.get("diagnosis_2", '')),
+        create_param("diagnosis_3", claim.get("diagnosis_3", '')),
+        create_param("diagnosis_4", claim.get("diagnosis_4", '')),
+        create_param("total_charges", claim["total_charges"]),
+        create_param("amountPaid", claim["amount_paid"]),
+        create_param("balanceDue", claim["balance"]),
+        create_param("claim_status", claim.get("claim_status", "NEW"))
     ]
     print(parameters)
-    result = run_command(sql_statement=CREATE_CLAIM_QUERY, parameters=parameters)
-    
-    print(result)
-    data = results_by_column_name(result)
-    if not data:
-        raise ParameterNotFoundError(f"Missing return record after Insert")
+
+    def write_claim(transaction_id):
+        run_command(
+            sql_statement=DELETE_CLAIM_WITH_OTHER_DATE_QUERY,
+            parameters=[create_param("claim_reference_id", claim_reference_id), create_param("claim_date", claim["claim_date"])],
+            transaction_id=transaction_id
+        )
+        result = run_command(sql_statement=CREATE_CLAIM_QUERY, parameters=parameters, transaction_id=transaction_id)
+        print(result)
+        data = results_by_column_name(result)
+        if not data:
+            raise ParameterNotFoundError("Missing return record after Insert")
+        claim_id, claim_date = data[0]["claim_id"], data[0]["claim_date"]
+        if services:
+            run_batch_command(
+                sql_statement=CREATE_SERVICE_QUERY,
+                parameter_sets=[
+                    service_parameters(claim_id, claim_date, line_number, service)
+                    for line_number, service in enumerate(services, start=1)
+                ],
+                transaction_id=transaction_id
+            )
+        run_command(
+            sql_statement=DELETE_EXTRA_SERVICES_QUERY,
+            parameters=[
+                create_param("claim_id", claim_id),
+                create_param("claim_date", claim_date),
+                create_param("line_count", len(services))
+            ],
+            transaction_id=transaction_id
+        )
+        return claim_id, claim_date
+
+    claim_id, claim_date = run_in_transaction(write_claim)
     response = {
-        "claim_id": data[0]["claim_id"]
+        "claim_id": claim_id,
+        "claim_date": claim_date,
+        "service_lines": len(services)
     }
     return response
 
-def create_claim_service(event):
-    claim_id = get_parameter(event, "claim_id")
+@router.operation("createService")
+def create_claim_service(request: ActionRequest):
+    """Adds a service line to a claim, or replaces it when the line_number of an existing line is given"""
+    try:
+        claim_id = int(request.parameters["claim_id"])
+    except ValueError:
+        raise InvalidParameterError(f"Invalid claim id: {request.parameters['claim_id']}")
+    service = request.body
+    # the claim date locates the partition of the claim, it is looked up when not given
+    claim_date = request.parameters.get("claim_date")
+    if not claim_date:
+        data = results_by_column_name(run_query(CLAIM_DATE_QUERY, [create_param("claim_id", claim_id)]))
+        if not data:
+            raise InvalidParameterError(f"Claim not found: {claim_id}")
+        claim_date = data[0]["claim_date"]
+
+    def write_service(transaction_id):
+        line_number = service.get("line_number")
+        if line_number is None:
+            result = run_command(
+                sql_statement=NEXT_SERVICE_LINE_NUMBER_QUERY,
+                parameters=[create_param("claim_id", claim_id), create_param("claim_date", claim_date)],
+                transaction_id=transaction_id
+            )
+            line_number = results_by_column_name(result)[0]["line_number"]
+        run_command(
+            sql_statement=CREATE_SERVICE_QUERY,
+            parameters=service_parameters(claim_id, claim_date, line_number, service),
+            transaction_id=transaction_id
+        )
+        return line_number
+
+    line_number = run_in_transaction(write_service)
     response = {
-        "claimId": claim_id,
-        "claim_description": "Not Implemented"}
-    # services_text = get_request_property(event,"services")
-    # services = json.loads(services_text)
-    # print(services)
-    # for service in services: # type: ignore
-    #     parameters = [
-    #         create_param("date_of_service", get_request_property(event,"date_of_service")),
-    #         create_param("place_of_service", get_request_property(event,"place_of_service")),
-    #         create_param("type_of_service", get_request_property(event,"type_of_service")),
-    #         create_param("procedure_code", get_request_property(event,"procedure_code")),
-    #         create_param("amount", get_request_property(event,"charge_amount"))
-    #     ]
-    #     result = run_command(sql_statement=CREATE_SERVICE_QUERY, parameters=parameters)
-
+        "claim_id": claim_id,
+        "line_number": line_number
+    }
     return response
 
 
-def getPatient(event):
+@router.operation("updateClaim")
+def update_claim(request: ActionRequest):
+    """Sets the status of the claim at the end of the review"""
+    try:
+        claim_id = int(request.parameters["claim_id"])
+    except ValueError:
+        raise InvalidParameterError(f"Invalid claim id: {request.parameters['claim_id']}")
+    claim_status = request.body["status"]
+    if claim_status not in CLAIM_STATUSES:
+        raise InvalidParameterError(f"status must be one of {', '.join(CLAIM_STATUSES)}")
+    data = results_by_column_name(run_query(CLAIM_DATE_QUERY, [create_param("claim_id", claim_id)]))
+    if not data:
+        raise InvalidParameterError(f"Claim not found: {claim_id}")
+    result = run_command(
+        sql_statement=UPDATE_CLAIM_STATUS_QUERY,
+        parameters=[
+            create_param("claim_id", claim_id),
+            create_param("claim_date", data[0]["claim_date"]),
+            create_param("claim_status", claim_status)
+        ]
+    )
+    response = results_by_column_name(result)[0]
+    return response
 
-    patient_lastname = get_parameter(event, "patient_lastName")
-    patient_birth_date = get_parameter(event, "patient_birth_date")
-    insured_policy_number = get_parameter(event, "insured_id_number")
-    parameters=[
-        {
-            'name':'patient_lastname', 
-            'value':{'stringValue':patient_lastname}
-        },
-        {
-            'name':'insured_policy_number', 
-            'value':{'stringValue':insured_policy_number}
-        },
+@router.operation("searchPatients")
+def searchPatients(request: ActionRequest):
+    """Ranked fuzzy match of the patient last name within the policy, for names misread on the claim form"""
+    top_k = request.parameters.get("top_k", 5)
+    if not 1 <= top_k <= PATIENT_SEARCH_MAX_RESULTS:
+        raise InvalidParameterError(f"top_k must be between 1 and {PATIENT_SEARCH_MAX_RESULTS}")
+    parameters = [
+        create_param("insured_policy_number", request.parameters["insured_id_number"]),
+        create_param("patient_lastname", request.parameters["patient_last_name"]),
+        create_param("patient_birth_date", request.parameters.get("patient_birth_date", '')),
+        create_param("top_k", top_k)
+    ]
+    result = run_query(PATIENT_SEARCH_QUERY, parameters)
+    candidates = [
         {
-            'name':'patient_birth_date', 
-            'value':{'stringValue':patient_birth_date}
+            "patientId": patient['patient_id'],
+            "insuredId": patient['insured_id'],
+            "patientFirstName": patient['patient_firstname'],
+            "patientLastName": patient['patient_lastname'],
+            "patientDateOfBirth": patient['patient_birth_date'],
+            "patientRelationshipToInsured": patient['relationship_to_insured'],
+            "similarity": float(patient['similarity']),
+            "birthDateMatch": patient['birth_date_match']
         }
-    ] 
-
-    result = run_command(PATIENT_DETAILS_QUERY, parameters)
-    print(result)
-    data = results_by_column_name(result)
-    if not data:
-        return f"Patient with last name {patient_lastname} and birth data {patient_birth_date} not found associated with insured id number {insured_id_number}"
-    patient = data[0]
+        for patient in results_by_column_name(result)
+    ]
     response = {
-        "firstName": patient['patient_firstname'],
-        "lastName": patient['patient_lastname'],
-        "dateOfBirth": patient['patient_birth_date'],
-        "gender": patient['sex'],
-        "address": patient['address'],
-        "relationshipToInsured": patient['relationship_to_insured'],
-        "phoneNumber": patient['phone_number']
+        "candidates": candidates
     }
-
     return response
 
-def createPatient(event) :
-    CREATE_CLAIM_QUERY.format(claim_values=get_parameter(event, "claim_values"))
-    response = {"claimId": "XXXXXXXX"}
+@router.operation("searchCoverage")
+def searchCoverage(request: ActionRequest):
+    """Passages of the EOC documents of the plan that answer a coverage question, through the semantic cache"""
+    if coverage_cache is None:
+        raise OperationNotImplementedError("searchCoverage is not configured, no knowledge base is set")
+    top_k = request.parameters.get("top_k", COVERAGE_SEARCH_DEFAULT_RESULTS)
+    if not 1 <= top_k <= COVERAGE_SEARCH_MAX_RESULTS:
+        raise InvalidParameterError(f"top_k must be between 1 and {COVERAGE_SEARCH_MAX_RESULTS}")
+    try:
+        result = coverage_cache.search(request.parameters["query"], request.parameters["plan_name"], top_k)
+    except ValueError as e:
+        raise InvalidParameterError(str(e))
+    print(f"Coverage search {result['cache']}, {coverage_cache.hits} hits and {coverage_cache.misses} misses in this container")
+    response = {
+        "passages": result["passages"],
+        "cached": result["cache"] != "miss"
+    }
     return response
 
+def get_code_index() -> CodeIndex:
+    global code_index
+    if code_index is None:
+        if not CLAIMS_REVIEW_BUCKET_NAME or not CODE_INDEX_ENABLED:
+            raise OperationNotImplementedError("validateCodes is not configured, no code index is set")
+        try:
+            code_index = CodeIndex.load(s3, CLAIMS_REVIEW_BUCKET_NAME, CODE_INDEX_KEY)
+        except Exception as e:
+            raise OperationNotImplementedError(f"Code index s3://{CLAIMS_REVIEW_BUCKET_NAME}/{CODE_INDEX_KEY} could not be loaded: {str(e)}")
+    return code_index
+
+@router.operation("validateCodes")
+def validateCodes(request: ActionRequest):
+    """Validates the diagnoses and every service line of the claim form in one call"""
+    s3_uri = request.parameters["s3URI"]
+    try:
+        parse_s3_uri(s3_uri)
+    except ValueError as e:
+        raise InvalidParameterError(str(e))
+    claims_form_data = s3_json_cache.get_json(s3_uri)
+    service_lines = claims_form_data.get(SERVICE_LINES_FIELD) or []
+    if not isinstance(service_lines, list):
+        raise InvalidParameterError(f"{SERVICE_LINES_FIELD} of the claim form is not a list of service lines")
+
+    index = get_code_index()
+    started_at = perf_counter()
+    response = index.validate_claim(
+        diagnosis_codes=[claims_form_data.get(field) for field in DIAGNOSIS_FIELDS],
+        service_lines=[service_line for service_line in service_lines if isinstance(service_line, dict)]
+    )
+    print(f"Validated {len(response['diagnoses'])} diagnoses and {len(response['service_lines'])} service lines in {(perf_counter() - started_at) * 1e6:.0f} microseconds")
+    return response
 
 def lambda_handler(event, context):
     print(event)
-    action = event["actionGroup"]
-    api_path = event["apiPath"]
-    httpMethod = event["httpMethod"]
+    writer.set_context(context)
+    database.begin(event.get("sessionAttributes"))
     response_code = 200
     response = None
     try:
-        match api_path:
-            case '/member_and_patient':
-                response = getMemberAndPatientDetails(event)
-            case '/member/{insured_id_number}':
-                response = getMemberDetails(event)
-            case '/claims' :
-                if(httpMethod == "GET"):
-                    response = getAllOpenClaims(event)
-                elif(httpMethod == "POST"):
-                    response = create_claim(event)
-            case '/patient' :
-                if(httpMethod == "GET"):
-                    response = getPatient(event)
-                elif(httpMethod == "POST"):
-                    response = createPatient(event)
-            case '/get_claims_form_data':
-                response = getClaimsFormData(event)
-            case '/claims/{claim_id}':
-                response = getClaim(event)
-            case '/claims/insured/{insuredId}':
-                response = listClaimsForInsured(event)
-            case 'claims/{claim_id}/service':
-                response = create_claim_service(event)
-            case _:
-                response_code = 404
-                response = {"error": f"{action}::{api_path} is not a valid API, try another one."}
+        response = router.dispatch(event)
+    except RouteNotFoundError as e:
+        response_code = 404
+        response = {"error": str(e)}
+    except OperationNotImplementedError as e:
+        response_code = 501
+        response = {"error": str(e)}
     except ParameterError as pe:
         response_code = 400
         response = {"error": str(pe)}
@@ -403,7 +609,8 @@ def lambda_handler(event, context):
         "responseBody": response_body,
     }
 
-    session_attributes = event["sessionAttributes"]
+    # the session attributes of the event, with the time of the last database write of the session
+    session_attributes = database.session_attributes
     prompt_session_attributes = event["promptSessionAttributes"]
 
     api_response = {
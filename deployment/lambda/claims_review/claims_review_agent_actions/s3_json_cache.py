@@ -0,0 +1,90 @@
+"""
+Purpose
+
+Per-container cache of parsed JSON objects read from Amazon S3, such as the extracted claim form data the
+agent asks for several times during one review. Entries are bounded by the total size of the cached
+objects. The cached objects are written once per key, so entries are returned without a request to S3 for
+max_age_seconds and revalidated with conditional GET requests (If-None-Match on the cached ETag) after
+that, which skips the download and the JSON parsing of an unchanged object. Reads of objects that are
+replaced under the same key pass their own, shorter, age bound.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from botocore.exceptions import ClientError
+
+
+def parse_s3_uri(s3_uri: str):
+    """Returns the bucket and key of an s3://bucket/key URI"""
+    parsed_uri = urlparse(s3_uri)
+    if parsed_uri.scheme != "s3" or not parsed_uri.netloc or not parsed_uri.path.lstrip("/"):
+        raise ValueError(f"Invalid S3 URI: {s3_uri}")
+    return parsed_uri.netloc, parsed_uri.path.lstrip("/")
+
+
+class S3JsonCache:
+    """
+    LRU cache of parsed S3 JSON objects. The parsed objects are shared between callers and must not be
+    modified. Entries validated less than max_age_seconds ago are returned without a request to S3, a
+    max_age_seconds of 0 revalidates every read.
+    """
+
+    def __init__(self, s3_client, max_bytes: int, max_age_seconds: float = 300):
+        self.s3_client = s3_client
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.entries = OrderedDict()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_json(self, s3_uri: str, max_age_seconds: float = None):
+        """max_age_seconds overrides the age bound of the cache for objects that change under the same key"""
+        bucket, key = parse_s3_uri(s3_uri)
+        max_age_seconds = self.max_age_seconds if max_age_seconds is None else max_age_seconds
+        with self.lock:
+            entry = self.entries.get(s3_uri)
+            if entry is not None and time.monotonic() - entry["validated_at"] < max_age_seconds:
+                self.entries.move_to_end(s3_uri)
+                self.hits += 1
+                return entry["value"]
+
+        try:
+            response = self.s3_client.get_object(
+                Bucket=bucket,
+                Key=key,
+                **({'IfNoneMatch': entry["etag"]} if entry is not None else {})
+            )
+        except ClientError as e:
+            if entry is not None and e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304:
+                with self.lock:
+                    entry["validated_at"] = time.monotonic()
+                    if s3_uri in self.entries:
+                        self.entries.move_to_end(s3_uri)
+                    self.hits += 1
+                return entry["value"]
+            raise
+
+        content = response["Body"].read()
+        value = json.loads(content.decode("utf-8"))
+        self.put(s3_uri, response["ETag"], value, len(content))
+        return value
+
+    def put(self, s3_uri: str, etag: str, value, size: int):
+        with self.lock:
+            self.misses += 1
+            previous = self.entries.pop(s3_uri, None)
+            if previous is not None:
+                self.cached_bytes -= previous["size"]
+            if size > self.max_bytes:
+                return
+            self.entries[s3_uri] = {"etag": etag, "value": value, "size": size, "validated_at": time.monotonic()}
+            self.cached_bytes += size
+            while self.cached_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.cached_bytes -= evicted["size"]
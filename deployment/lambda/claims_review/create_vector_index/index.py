@@ -1,9 +1,29 @@
+import random
 import boto3
 from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
-from time import sleep
+from opensearchpy.exceptions import OpenSearchException
+from time import sleep, monotonic
+
+# Readiness checks of one is_complete invocation: attempts with exponential backoff and full jitter until
+# the index passes READY_CHECKS consecutive checks or the budget is spent. The provider then calls
+# is_complete again after its query interval.
+READY_CHECKS = 2
+CHECK_BUDGET_SECONDS = 60
+BASE_DELAY_SECONDS = 1
+MAX_DELAY_SECONDS = 16
+
+QUANTIZATIONS = ("none", "fp16", "binary")
+
+REBUILD_INDEX_HINT = ("Run source/claims_review_app/reindex_vector_index.py to rebuild the index behind the "
+                      "index_alias of vector_store_index_params before deploying, or set a new index_name to "
+                      "create an index with the new parameters.")
+
 class InvalidRequestTypeError(ValueError):
     pass
 
+class IndexNotReadyError(Exception):
+    pass
+
 
 def on_event(event, context):
     """
@@ -61,15 +81,64 @@ def on_delete(event):
 def is_complete(event, context):
     """
     This function checks if the resource is in a stable state based on the request type.
-    It returns a dictionary indicating whether the resource is complete or not.
+    After a create or update the index is ready when it exists, has the knn_vector mapping and answers a
+    kNN query, the knowledge base can be created on it then.
     """
     physical_id = event["PhysicalResourceId"]
     request_type = event["RequestType"]
+    if request_type == 'Delete':
+        return {'IsComplete': True}
 
-    # check if resource is stable based on request_type
-    # is_ready = ...
+    resource_properties = event['ResourceProperties']
+    aos_client = get_aoss_client(get_aoss_host(resource_properties))
+    index_name = get_current_index_name(resource_properties, aos_client)
+    started_at = monotonic()
+    attempt = 0
+    passed_checks = 0
+    while True:
+        try:
+            check_index_ready(index_name, aos_client)
+            passed_checks += 1
+            print(f"Index {index_name} passed readiness check {passed_checks} of {READY_CHECKS}")
+            if passed_checks == READY_CHECKS:
+                return {'IsComplete': True}
+            delay = BASE_DELAY_SECONDS
+        except (IndexNotReadyError, OpenSearchException) as e:
+            passed_checks = 0
+            delay = random.uniform(0, min(MAX_DELAY_SECONDS, BASE_DELAY_SECONDS * (2 ** attempt)))
+            attempt += 1
+            print(f"Index {index_name} of {physical_id} is not ready: {e}")
+        if monotonic() - started_at + delay > CHECK_BUDGET_SECONDS:
+            return {'IsComplete': False}
+        sleep(delay)
 
-    return {'IsComplete': True}
+def check_index_ready(index_name, aos_client):
+    """
+    Raises IndexNotReadyError unless the index exists, maps the vector field as knn_vector and a kNN query
+    on it succeeds.
+    """
+    if not aos_client.indices.exists(index=index_name):
+        raise IndexNotReadyError("the index does not exist yet")
+    mapping = aos_client.indices.get_mapping(index=index_name)
+    vector_field = mapping.get(index_name, {}).get("mappings", {}).get("properties", {}).get("vector", {})
+    if vector_field.get("type") != "knn_vector":
+        raise IndexNotReadyError(f"the vector field is not mapped as knn_vector yet: {vector_field}")
+    # binary vectors are queried with one signed byte per 8 dimensions
+    if vector_field.get("data_type") == "binary":
+        query_vector = [1] * (vector_field["dimension"] // 8)
+    else:
+        query_vector = [0.1] * vector_field["dimension"]
+    aos_client.search(index=index_name, body={
+        "size": 1,
+        "query": {
+            "knn": {
+                "vector": {
+                    "vector": query_vector,
+                    "k": 1
+                }
+            }
+        }
+    })
 
 def removeHttpsPrefix(endpoint):
     """
@@ -118,7 +187,87 @@ def get_aoss_index_name(resource_properties):
         raise ValueError("AOSSIndexName not provided from resource properties") 
     return resource_properties["AOSSIndexName"]
 
-def create_aoss_index(index_name, aos_client):
+def get_aoss_index_alias(resource_properties):
+    """
+    This function returns the alias the knowledge base uses for the index, or None when the knowledge base
+    uses the index name directly.
+    """
+    return resource_properties.get("AOSSIndexAlias")
+
+def get_alias_index_name(index_alias, aos_client):
+    """
+    This function returns the index the alias points to, or None when the alias does not exist yet.
+    """
+    if not aos_client.indices.exists_alias(name=index_alias):
+        return None
+    return next(iter(aos_client.indices.get_alias(name=index_alias)))
+
+def get_current_index_name(resource_properties, aos_client):
+    """
+    This function returns the index the knowledge base uses: the index the alias points to, which is a newer
+    version of the index once reindex_vector_index.py has rebuilt it, otherwise the configured index name.
+    """
+    index_alias = get_aoss_index_alias(resource_properties)
+    alias_index_name = get_alias_index_name(index_alias, aos_client) if index_alias else None
+    return alias_index_name or get_aoss_index_name(resource_properties)
+
+def get_vector_index_configuration(resource_properties):
+    """
+    This function reads the engine parameters of the vector field from the resource properties. CloudFormation
+    passes the numbers as strings, the defaults are the parameters of indexes created before they were
+    configurable.
+    """
+    quantization = resource_properties.get("Quantization", "none")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Quantization must be one of {QUANTIZATIONS}: {quantization}")
+    return {
+        "dimension": int(resource_properties.get("Dimension", 1024)),
+        "space_type": resource_properties.get("SpaceType", "l2"),
+        "m": int(resource_properties.get("M", 16)),
+        "ef_construction": int(resource_properties.get("EfConstruction", 512)),
+        "ef_search": int(resource_properties.get("EfSearch", 512)),
+        "quantization": quantization
+    }
+
+def get_metadata_field_mappings(resource_properties):
+    """
+    This function returns the mappings of the filterable metadata fields, keyword and date fields are
+    matched exactly by knowledge base retrieval filters without being analyzed.
+    """
+    return {name: {"type": field_type} for name, field_type in resource_properties.get("MetadataFields", {}).items()}
+
+def get_vector_field_mapping(configuration):
+    """
+    This function returns the knn_vector mapping of the vector field. fp16 quantization stores the vectors
+    with the faiss scalar quantizer at half the memory of float vectors, binary stores the bits of binary
+    embeddings and compares them with the hamming distance.
+    """
+    parameters = {
+        "ef_construction": configuration["ef_construction"],
+        "m": configuration["m"]
+    }
+    if configuration["quantization"] == "fp16":
+        parameters["encoder"] = {
+            "name": "sq",
+            "parameters": {
+                "type": "fp16"
+            }
+        }
+    mapping = {
+        "type": "knn_vector",
+        "dimension": configuration["dimension"],
+        "method": {
+            "name": "hnsw",
+            "space_type": configuration["space_type"],
+            "engine": "faiss",
+            "parameters": parameters
+        }
+    }
+    if configuration["quantization"] == "binary":
+        mapping["data_type"] = "binary"
+    return mapping
+
+def create_aoss_index(index_name, aos_client, configuration, metadata_fields):
     """
     This function creates an index in the Amazon OpenSearch Service (AOSS) using the
     provided index name and client. It configures the index settings and mappings
@@ -126,41 +275,70 @@ def create_aoss_index(index_name, aos_client):
     """
     index_body = {
         "settings": {
-            "index.knn": True
+            "index.knn": True,
+            "index.knn.algo_param.ef_search": configuration["ef_search"]
         },
         "mappings": {
             "properties": {
-                "vector": {
-                    "type": "knn_vector",
-                    "dimension": 1024,
-                    "method": {
-                        "name": "hnsw",
-                        "space_type": "l2",
-                        "engine": "faiss",
-                        "parameters": {
-                            "ef_construction": 512,
-                            "m": 16
-                        }
-                    }
-                },
+                "vector": get_vector_field_mapping(configuration),
                 "text": {
                     "type": "text"
                 },
                 "id": {
                     "type": "text"
                 },
+                # the metadata of a chunk is only returned with it, filters use the metadata fields
                 "text-metadata": {
-                    "type": "text"
+                    "type": "text",
+                    "index": False
                 },
                 "x-amz-bedrock-kb-source-uri": {
-                    "type": "text"
-                }
+                    "type": "keyword"
+                },
+                **metadata_fields
             }
         }
     }
     response = aos_client.indices.create(index=index_name, body=index_body)
-    print(f"Created index {index_name}")
-    sleep(120)
+    print(f"Created index {index_name}, is_complete waits until it is ready")
+    return response
+
+def update_aoss_index(index_name, aos_client, configuration, metadata_fields):
+    """
+    This function applies the configuration to an existing index. Only ef_search and new metadata fields can
+    change in place, the vector field mapping is fixed once the index is created, so a different dimension,
+    space type, HNSW graph or quantization needs a new index name. Documents ingested before a metadata field
+    was added get it on their next ingestion.
+    """
+    mapping = aos_client.indices.get_mapping(index=index_name)
+    properties = mapping.get(index_name, {}).get("mappings", {}).get("properties", {})
+    vector_field = properties.get("vector", {})
+    expected = get_vector_field_mapping(configuration)
+    existing = {
+        "dimension": vector_field.get("dimension"),
+        "data_type": vector_field.get("data_type", "float"),
+        "method": vector_field.get("method", {})
+    }
+    wanted = {
+        "dimension": expected["dimension"],
+        "data_type": expected.get("data_type", "float"),
+        "method": expected["method"]
+    }
+    if existing != wanted:
+        raise ValueError(f"The vector field of index {index_name} is mapped as {existing}, it cannot be changed "
+                         f"to {wanted} in place. {REBUILD_INDEX_HINT}")
+    for name, field in metadata_fields.items():
+        if name in properties and properties[name].get("type") != field["type"]:
+            raise ValueError(f"Metadata field {name} of index {index_name} is mapped as {properties[name]}, it "
+                             f"cannot be changed to {field} in place. {REBUILD_INDEX_HINT}")
+    new_fields = {name: field for name, field in metadata_fields.items() if name not in properties}
+    if new_fields:
+        aos_client.indices.put_mapping(index=index_name, body={"properties": new_fields})
+        print(f"Added metadata fields {list(new_fields)} to index {index_name}")
+    response = aos_client.indices.put_settings(index=index_name, body={
+        "index.knn.algo_param.ef_search": configuration["ef_search"]
+    })
+    print(f"Set ef_search of index {index_name} to {configuration['ef_search']}")
     return response
 
 def create_or_update_index(event):
@@ -168,14 +346,24 @@ def create_or_update_index(event):
     This function creates or updates an index in the Amazon OpenSearch Service (AOSS).
     It retrieves the AOSS host and index name from the resource properties, creates
     an AOSS client, and checks if the index exists. If the index doesn't exist,
-    it creates a new index using the create_aoss_index function. It returns the
-    response from the index creation or update operation.
+    it creates a new index using the create_aoss_index function. With an index alias
+    the index the alias points to is updated, and a missing alias is added to the
+    index. It returns the response from the index creation or update operation.
     """
     resource_properties = event['ResourceProperties']
     aoss_host = get_aoss_host(resource_properties)
     aos_client = get_aoss_client(aoss_host)
-    index_name = get_aoss_index_name(resource_properties)
-    response = None
+    index_name = get_current_index_name(resource_properties, aos_client)
+    configuration = get_vector_index_configuration(resource_properties)
+    metadata_fields = get_metadata_field_mappings(resource_properties)
     if not aos_client.indices.exists(index=index_name):
-        response = create_aoss_index(index_name=index_name, aos_client=aos_client)
+        response = create_aoss_index(index_name=index_name, aos_client=aos_client, configuration=configuration,
+                                     metadata_fields=metadata_fields)
+    else:
+        response = update_aoss_index(index_name=index_name, aos_client=aos_client, configuration=configuration,
+                                     metadata_fields=metadata_fields)
+    index_alias = get_aoss_index_alias(resource_properties)
+    if index_alias and not aos_client.indices.exists_alias(name=index_alias):
+        aos_client.indices.put_alias(index=index_name, name=index_alias)
+        print(f"Added alias {index_alias} to index {index_name}")
     return response
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Exports the insured members and their patients from the claims database into a sorted member directory
+snapshot in the claims review bucket. Runs on a schedule, the agent actions pick up the new version.
+"""
+import os
+import time
+
+import boto3
+from data_api_client import DataApiClient
+from member_directory import (
+    EXPORT_QUERY,
+    MANIFEST_KEY,
+    SNAPSHOT_PREFIX,
+    member_key,
+    new_version,
+    snapshot_key,
+    write_manifest,
+)
+from sorted_snapshot import write_snapshot
+
+CLAIMS_REVIEW_BUCKET_NAME = os.environ['CLAIMS_REVIEW_BUCKET_NAME']
+# Rows per Data API call, well under the 1 MB result limit
+EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', '1000'))
+# Snapshot versions kept in S3, lookups in progress may still use the previous one
+KEEP_VERSIONS = int(os.environ.get('KEEP_VERSIONS', '2'))
+
+s3 = boto3.client("s3")
+data_api = DataApiClient(
+    os.environ['CLAIMS_DB_CLUSTER_ARN'],
+    os.environ['CLAIMS_DB_CREDENTIALS_SECRET_ARN'],
+    os.environ['CLAIMS_DB_DATABASE_NAME']
+)
+
+
+def results_by_column_name(result):
+    columns = [column["name"] for column in result["columnMetadata"]]
+    return [dict(zip(columns, [list(value.values())[0] for value in record])) for record in result["records"]]
+
+
+def read_members():
+    """Pages through the members with keyset pagination on patient_id"""
+    last_patient_id = 0
+    while True:
+        result = data_api.execute_statement(EXPORT_QUERY, parameters=[
+            {'name': 'last_patient_id', 'value': {'longValue': last_patient_id}},
+            {'name': 'page_size', 'value': {'longValue': EXPORT_PAGE_SIZE}}
+        ])
+        rows = results_by_column_name(result)
+        for row in rows:
+            yield member_key(row['insured_policy_number'], row['patient_lastname'], row['patient_birth_date']), row
+        if len(rows) < EXPORT_PAGE_SIZE:
+            return
+        last_patient_id = rows[-1]['patient_id']
+
+
+def delete_old_versions(current_key):
+    response = s3.list_objects_v2(Bucket=CLAIMS_REVIEW_BUCKET_NAME, Prefix=f"{SNAPSHOT_PREFIX}/")
+    snapshot_keys = sorted(
+        (item['Key'] for item in response.get('Contents', [])
+         if item['Key'].endswith('.snap') and item['Key'] <= current_key),
+        reverse=True
+    )
+    for key in snapshot_keys[KEEP_VERSIONS:]:
+        s3.delete_object(Bucket=CLAIMS_REVIEW_BUCKET_NAME, Key=key)
+
+
+def lambda_handler(event, context):
+    print(event)
+    data_api.set_context(context)
+    started_at = time.time()
+    version = new_version()
+    path = f"/tmp/{version}.snap"
+    record_count = write_snapshot(path, read_members(), metadata={"version": version, "created_at": started_at})
+    s3.upload_file(path, CLAIMS_REVIEW_BUCKET_NAME, snapshot_key(version))
+    os.remove(path)
+    # the manifest is written last, readers never see a version that is not fully uploaded
+    write_manifest(s3, CLAIMS_REVIEW_BUCKET_NAME, version, record_count, created_at=started_at)
+    delete_old_versions(snapshot_key(version))
+    print(f"Exported {record_count} members to s3://{CLAIMS_REVIEW_BUCKET_NAME}/{snapshot_key(version)} "
+          f"in {time.time() - started_at:.1f} seconds")
+    return {
+        "version": version,
+        "record_count": record_count,
+        "manifest": f"s3://{CLAIMS_REVIEW_BUCKET_NAME}/{MANIFEST_KEY}"
+    }
@@ -9,12 +9,22 @@ import uuid
 import os
 import boto3
 from bda_wrapper import invoke_insight_generation_async
+from data_api_client import DataApiClient
 import random, string
+import threading
 
 
 CLAIMS_REVIEW_BUCKET_NAME = os.environ['CLAIMS_REVIEW_BUCKET_NAME']
 DATA_PROJECT_ARN = os.environ.get('DATA_PROJECT_ARN', None)
 BLUEPRINT_ARN = os.environ.get('BLUEPRINT_ARN', None)
+# Set when the claims database should be warmed up while the claim form is extracted
+CLAIMS_DB_CLUSTER_ARN = os.environ.get('CLAIMS_DB_CLUSTER_ARN', None)
+
+data_api = DataApiClient(
+    CLAIMS_DB_CLUSTER_ARN,
+    os.environ['CLAIMS_DB_CREDENTIALS_SECRET_ARN'],
+    os.environ['CLAIMS_DB_DATABASE_NAME']
+) if CLAIMS_DB_CLUSTER_ARN else None
 
 
 s3 = boto3.client("s3")
@@ -31,6 +41,12 @@ def lambda_handler(event, context):
     key = event['detail']['object']['key']
     claim_reference_id = get_claim_reference_id(key)
     print(f"Claim Reference ID: {claim_reference_id}")
+
+    # The ping runs alongside the data automation request, it only starts resuming a paused cluster
+    warm_up = threading.Thread(target=data_api.ping) if data_api else None
+    if warm_up:
+        warm_up.start()
+
     response = invoke_insight_generation_async(
         data_project_arn=DATA_PROJECT_ARN,
         blueprint_arn=BLUEPRINT_ARN,
@@ -39,6 +55,8 @@ def lambda_handler(event, context):
         output_s3_uri=f"s3://{CLAIMS_REVIEW_BUCKET_NAME}/{claim_reference_id}"
     )
     print(response)
+    if warm_up:
+        warm_up.join()
     return response
 
 
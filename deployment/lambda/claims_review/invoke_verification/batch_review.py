@@ -0,0 +1,246 @@
+# Lambda function handler that re-runs the claims review agent over a backlog of claims whose
+# Bedrock Data Automation output already exists in the claims review bucket.
+# The event selects the claims either by an explicit list of claim reference ids or by a prefix:
+#   {"claim_reference_ids": ["<id>", ...]} or {"prefix": "<claim reference id prefix>"}
+# Optional keys: batch_id, concurrency, rate_per_second, burst
+# Progress is checkpointed to S3 so that a batch can be resumed by invoking again with the same batch_id.
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from index import s3, invoke_bedrock_agent, review_cache, save_claim_output, save_claim_profile, save_review_provenance
+from code_index import CODE_INDEX_PREFIX
+from member_directory import SNAPSHOT_PREFIX
+from review_cache import REVIEW_CACHE_PREFIX
+from trace_profiler import AgentTraceProfiler
+
+CLAIMS_REVIEW_BUCKET_NAME = os.environ["CLAIMS_REVIEW_BUCKET_NAME"]
+BATCH_REVIEW_PREFIX = "batch_reviews"
+# Top level prefixes of the claims review bucket that hold artifacts of the solution, not claims
+RESERVED_PREFIXES = {BATCH_REVIEW_PREFIX, REVIEW_CACHE_PREFIX, SNAPSHOT_PREFIX, CODE_INDEX_PREFIX}
+DEFAULT_CONCURRENCY = int(os.environ.get("BATCH_REVIEW_CONCURRENCY", "4"))
+DEFAULT_RATE_PER_SECOND = float(os.environ.get("BATCH_REVIEW_RATE_PER_SECOND", "0.5"))
+DEFAULT_BURST = int(os.environ.get("BATCH_REVIEW_BURST", "2"))
+# Stop scheduling new reviews when less than this is left of the invocation time budget
+STOP_BEFORE_DEADLINE_SECONDS = int(os.environ.get("BATCH_REVIEW_STOP_BEFORE_DEADLINE_SECONDS", "240"))
+CHECKPOINT_INTERVAL_SECONDS = 10
+
+
+class TokenBucket:
+    """Paces agent invocations so that a batch stays within the agent's InvokeAgent quota"""
+
+    def __init__(self, rate_per_second: float, burst: int):
+        self.rate_per_second = rate_per_second
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate_per_second
+            time.sleep(wait_seconds)
+
+
+class BatchCheckpoint:
+    """Batch progress persisted as batch_reviews/<batch_id>/checkpoint.json in the claims review bucket"""
+
+    def __init__(self, batch_id: str, state: dict):
+        self.batch_id = batch_id
+        self.state = state
+        self.lock = threading.Lock()
+        self.saved_at = 0.0
+
+    @property
+    def key(self):
+        return checkpoint_key(self.batch_id)
+
+    @classmethod
+    def load_or_create(cls, batch_id: str, claim_reference_ids: list):
+        try:
+            response = s3.get_object(Bucket=CLAIMS_REVIEW_BUCKET_NAME, Key=checkpoint_key(batch_id))
+            state = json.loads(response["Body"].read().decode("utf-8"))
+            print(f"Resuming batch {batch_id}: {len(state['completed'])} of {len(state['claim_reference_ids'])} claims already reviewed")
+        except s3.exceptions.NoSuchKey:
+            state = {
+                "batch_id": batch_id,
+                "claim_reference_ids": claim_reference_ids,
+                "completed": {},
+                "failed": {},
+                "elapsed_seconds": 0.0
+            }
+        return cls(batch_id, state)
+
+    def pending(self):
+        completed = self.state["completed"]
+        return [claim_reference_id for claim_reference_id in self.state["claim_reference_ids"]
+                if claim_reference_id not in completed]
+
+    def record_success(self, claim_reference_id: str, latency_ms: float, cached: bool = False):
+        with self.lock:
+            self.state["failed"].pop(claim_reference_id, None)
+            self.state["completed"][claim_reference_id] = {"latency_ms": round(latency_ms, 1), "cached": cached}
+
+    def record_failure(self, claim_reference_id: str, error: str):
+        with self.lock:
+            self.state["failed"][claim_reference_id] = error
+
+    def save(self, force=False):
+        with self.lock:
+            if not force and time.monotonic() - self.saved_at < CHECKPOINT_INTERVAL_SECONDS:
+                return
+            body = json.dumps(self.state)
+            self.saved_at = time.monotonic()
+        s3.put_object(Bucket=CLAIMS_REVIEW_BUCKET_NAME, Key=self.key, Body=body)
+
+
+def checkpoint_key(batch_id: str):
+    return f"{BATCH_REVIEW_PREFIX}/{batch_id}/checkpoint.json"
+
+
+def list_claim_reference_ids(prefix: str):
+    claim_reference_ids = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=CLAIMS_REVIEW_BUCKET_NAME, Prefix=prefix, Delimiter="/"):
+        for common_prefix in page.get("CommonPrefixes", []):
+            claim_reference_id = common_prefix["Prefix"].rstrip("/")
+            if claim_reference_id not in RESERVED_PREFIXES:
+                claim_reference_ids.append(claim_reference_id)
+    return claim_reference_ids
+
+
+def find_claim_form_data_uri(claim_reference_id: str):
+    """
+    Returns the S3 URI of the extracted claim form data (<claim_reference_id>/<claim form file name>.json)
+    written by the claims verification function, or None if BDA output does not exist for the claim.
+    """
+    response = s3.list_objects_v2(Bucket=CLAIMS_REVIEW_BUCKET_NAME, Prefix=f"{claim_reference_id}/", Delimiter="/")
+    for item in response.get("Contents", []):
+        file_name = item["Key"].rsplit("/", 1)[1]
+        # the extracted output keeps the claim form file extension, e.g. sample1_cms-1500-P.pdf.json
+        if file_name.endswith(".json") and "." in file_name[:-len(".json")]:
+            return f"s3://{CLAIMS_REVIEW_BUCKET_NAME}/{item['Key']}"
+    return None
+
+
+def review_claim(claim_reference_id: str, token_bucket: TokenBucket, context):
+    claim_form_data_uri = find_claim_form_data_uri(claim_reference_id)
+    if claim_form_data_uri is None:
+        raise ValueError(f"No claim form data found for claim ref: {claim_reference_id}")
+    started_at = time.monotonic()
+    cache_key, cache_components = None, None
+    if review_cache:
+        cache_key, cache_components, cache_entry = review_cache.lookup(CLAIMS_REVIEW_BUCKET_NAME, claim_form_data_uri)
+        decision = review_cache.reuse(cache_entry, claim_reference_id) if cache_entry else None
+        if decision is not None:
+            save_claim_output(CLAIMS_REVIEW_BUCKET_NAME, claim_reference_id, decision)
+            save_review_provenance(CLAIMS_REVIEW_BUCKET_NAME, claim_reference_id, cache_key, cache_components,
+                                   source_claim_reference_id=cache_entry["claim_reference_id"])
+            return (time.monotonic() - started_at) * 1000, True
+    # cached reviews do not invoke the agent, only the agent invocations are paced
+    token_bucket.acquire()
+    profiler = AgentTraceProfiler(claim_reference_id, session_id=claim_reference_id)
+    started_at = time.monotonic()
+    agent_response = invoke_bedrock_agent(claim_reference_id, claim_form_data_uri, context, profiler=profiler)
+    latency_ms = (time.monotonic() - started_at) * 1000
+    save_claim_output(CLAIMS_REVIEW_BUCKET_NAME, claim_reference_id, agent_response)
+    save_claim_profile(CLAIMS_REVIEW_BUCKET_NAME, profiler)
+    # failed invocations raise, only completed reviews are cached
+    if cache_key:
+        review_cache.store(CLAIMS_REVIEW_BUCKET_NAME, cache_key, cache_components, claim_reference_id, agent_response)
+        save_review_provenance(CLAIMS_REVIEW_BUCKET_NAME, claim_reference_id, cache_key, cache_components)
+    return latency_ms, False
+
+
+def percentile(values: list, pct: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def build_report(checkpoint: BatchCheckpoint, status: str):
+    state = checkpoint.state
+    # reviews answered from the review cache take milliseconds, the percentiles are of agent reviews only
+    latencies = [item["latency_ms"] for item in state["completed"].values() if not item.get("cached")]
+    elapsed_seconds = state["elapsed_seconds"]
+    return {
+        "batch_id": checkpoint.batch_id,
+        "status": status,
+        "total": len(state["claim_reference_ids"]),
+        "completed": len(state["completed"]),
+        "failed": len(state["failed"]),
+        "cached": sum(1 for item in state["completed"].values() if item.get("cached")),
+        "pending": len(checkpoint.pending()),
+        "elapsed_seconds": round(elapsed_seconds, 1),
+        "throughput_per_minute": round(len(state["completed"]) / elapsed_seconds * 60, 2) if elapsed_seconds else None,
+        "p50_latency_ms": percentile(latencies, 50),
+        "p95_latency_ms": percentile(latencies, 95),
+        "checkpoint": f"s3://{CLAIMS_REVIEW_BUCKET_NAME}/{checkpoint.key}",
+        "errors": state["failed"]
+    }
+
+
+def lambda_handler(event, context):
+    print(f"Received event: {event}")
+    batch_id = event.get("batch_id") or str(uuid.uuid4())
+    concurrency = int(event.get("concurrency", DEFAULT_CONCURRENCY))
+    token_bucket = TokenBucket(
+        rate_per_second=float(event.get("rate_per_second", DEFAULT_RATE_PER_SECOND)),
+        burst=int(event.get("burst", DEFAULT_BURST))
+    )
+
+    claim_reference_ids = event.get("claim_reference_ids")
+    if not claim_reference_ids:
+        if "prefix" not in event:
+            raise ValueError("Either claim_reference_ids or prefix must be provided")
+        claim_reference_ids = list_claim_reference_ids(event["prefix"])
+    checkpoint = BatchCheckpoint.load_or_create(batch_id, claim_reference_ids)
+    pending = checkpoint.pending()
+    print(f"Batch {batch_id}: reviewing {len(pending)} claims with concurrency {concurrency}")
+
+    started_at = time.monotonic()
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while pending or in_flight:
+            while pending and len(in_flight) < concurrency \
+                    and context.get_remaining_time_in_millis() > STOP_BEFORE_DEADLINE_SECONDS * 1000:
+                claim_reference_id = pending.pop(0)
+                in_flight[executor.submit(review_claim, claim_reference_id, token_bucket, context)] = claim_reference_id
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                claim_reference_id = in_flight.pop(future)
+                try:
+                    checkpoint.record_success(claim_reference_id, *future.result())
+                except Exception as e:
+                    print(f"Error reviewing claim {claim_reference_id}: {str(e)}")
+                    checkpoint.record_failure(claim_reference_id, str(e))
+            checkpoint.save()
+
+    checkpoint.state["elapsed_seconds"] += time.monotonic() - started_at
+    checkpoint.save(force=True)
+    # IN_PROGRESS: claims were not started before the deadline. PARTIAL: every claim was reviewed once and
+    # some failed, failed claims stay pending so that resuming the batch retries them
+    if pending:
+        status = "IN_PROGRESS"
+    elif checkpoint.pending():
+        status = "PARTIAL"
+    else:
+        status = "COMPLETE"
+    report = build_report(checkpoint, status=status)
+    print(json.dumps(report))
+    return report
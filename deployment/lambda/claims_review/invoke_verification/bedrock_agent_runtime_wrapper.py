@@ -9,12 +9,63 @@ client to send prompts to an agent to process and respond to.
 """
 
 import logging
+import queue
+import threading
+import time
 
 from botocore.exceptions import ClientError
 
 logger = logging.getLogger(__name__)
 
 
+class DeadlineReached(Exception):
+    """Raised by read_events when no event arrived before the deadline"""
+
+
+class AgentDeadlineExceeded(Exception):
+    """Raised when the agent has not finished responding before the given deadline"""
+
+    def __init__(self, session_id, partial_completion, invoked_apis):
+        super().__init__(f"Agent did not complete before the deadline in session {session_id}")
+        self.session_id = session_id
+        self.partial_completion = partial_completion
+        self.invoked_apis = invoked_apis
+
+
+def read_events(event_stream, deadline):
+    """
+    Yields the events of the agent response stream. When a deadline (in time.monotonic() seconds) is
+    given, the stream is read on a background thread so that waiting for the next event can be abandoned
+    when the deadline is reached.
+    """
+    if deadline is None:
+        yield from event_stream
+        return
+
+    events = queue.Queue()
+    end_of_stream = object()
+
+    def reader():
+        try:
+            for event in event_stream:
+                events.put(event)
+            events.put(end_of_stream)
+        except Exception as e:
+            events.put(e)
+
+    threading.Thread(target=reader, daemon=True).start()
+    while True:
+        try:
+            event = events.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            raise DeadlineReached()
+        if event is end_of_stream:
+            return
+        if isinstance(event, Exception):
+            raise event
+        yield event
+
+
 # snippet-start:[python.example_code.bedrock-agent-runtime.BedrockAgentsRuntimeWrapper.class]
 # snippet-start:[python.example_code.bedrock-agent-runtime.BedrockAgentRuntimeWrapper.decl]
 class BedrockAgentRuntimeWrapper:
@@ -31,7 +82,8 @@ class BedrockAgentRuntimeWrapper:
     # snippet-end:[python.example_code.bedrock-agent-runtime.BedrockAgentRuntimeWrapper.decl]
 
     # snippet-start:[python.example_code.bedrock-agent-runtime.InvokeAgent]
-    def invoke_agent(self, agent_id, agent_alias_id, session_id, prompt):
+    def invoke_agent(self, agent_id, agent_alias_id, session_id, prompt, deadline=None, trace_handler=None,
+                     session_state=None):
         """
         Sends a prompt for the agent to process and respond to.
 
@@ -40,6 +92,11 @@ class BedrockAgentRuntimeWrapper:
         :param session_id: The unique identifier of the session. Use the same value across requests
                            to continue the same conversation.
         :param prompt: The prompt that you want Claude to complete.
+        :param deadline: Optional time.monotonic() value by which the agent must have responded.
+                         AgentDeadlineExceeded is raised with the partial completion when it is reached.
+        :param trace_handler: Optional callable that receives each trace part of the response stream.
+                              The trace is printed when it is not given.
+        :param session_state: Optional session state of the invocation, such as knowledge base retrieval filters.
         :return: Inference response from the model.
         """
 
@@ -52,17 +109,30 @@ class BedrockAgentRuntimeWrapper:
                 agentAliasId=agent_alias_id,
                 sessionId=session_id,
                 inputText=prompt,
-                enableTrace=True
+                enableTrace=True,
+                **({"sessionState": session_state} if session_state else {})
             )
 
             completion = ""
+            invoked_apis = []
 
-            for event in response.get("completion"):
+            for event in read_events(response.get("completion"), deadline):
                 if "chunk" in event.keys():
                     chunk = event["chunk"]
                     completion = completion + chunk["bytes"].decode()
                 elif("trace" in event.keys()):
-                    print(event["trace"]["trace"])
+                    if trace_handler:
+                        trace_handler(event["trace"])
+                    else:
+                        print(event["trace"]["trace"])
+                    invocation_input = event["trace"]["trace"].get("orchestrationTrace", {}).get("invocationInput", {})
+                    if "actionGroupInvocationInput" in invocation_input:
+                        action_group_input = invocation_input["actionGroupInvocationInput"]
+                        invoked_apis.append(f"{action_group_input.get('verb', '').upper()} {action_group_input.get('apiPath')}")
+
+        except DeadlineReached:
+            response.get("completion").close()
+            raise AgentDeadlineExceeded(session_id, completion, invoked_apis)
 
         except ClientError as e:
             logger.error(f"Couldn't invoke agent. {e}")
@@ -1,21 +1,83 @@
 import boto3
 import uuid
-from bedrock_agent_runtime_wrapper import BedrockAgentRuntimeWrapper
+from botocore.config import Config
+from bedrock_agent_runtime_wrapper import BedrockAgentRuntimeWrapper, AgentDeadlineExceeded
+from trace_profiler import AgentTraceProfiler
+from review_cache import ReviewCache
+from retry_policy import (
+    AgentInvocationError,
+    CircuitOpenError,
+    CLIENT_ERROR,
+    THROTTLING,
+    backoff_delay,
+    classify_error,
+    deferral_delay,
+    get_circuit_breaker,
+    remaining_seconds,
+)
 import os
 import json
+import time
 from urllib.parse import urlparse
 import re
 import string
 import random
 
-agent_runtime = boto3.client('bedrock-agent-runtime')
+# Retries are handled by invoke_bedrock_agent, which knows the remaining time budget of the invocation
+agent_runtime = boto3.client('bedrock-agent-runtime', config=Config(retries={'total_max_attempts': 1}))
 agent_runtime_wrapper = BedrockAgentRuntimeWrapper(agent_runtime)
 
 CLAIMS_REVIEW_AGENT_ID = os.environ["CLAIMS_REVIEW_AGENT_ID"]
 CLAIMS_REVIEW_AGENT_ALIAS_ID = os.environ["CLAIMS_REVIEW_AGENT_ALIAS_ID"]
+CLAIMS_REVIEW_RETRY_QUEUE_URL = os.environ.get("CLAIMS_REVIEW_RETRY_QUEUE_URL", None)
 ERROR_MESSAGE = "Our system is currently unable to complete this task. Please attempt to submit your claim again in approximately 5-10 minutes. If you continue to experience difficulties, we kindly request that you contact our customer support team for further assistance. We appreciate your patience and understanding as we work to resolve this issue"
 
+RETRY_BASE_DELAY_SECONDS = float(os.environ.get("RETRY_BASE_DELAY_SECONDS", "2"))
+RETRY_MAX_DELAY_SECONDS = float(os.environ.get("RETRY_MAX_DELAY_SECONDS", "30"))
+# Do not start another attempt unless at least this much of the time budget is left for it
+MIN_ATTEMPT_SECONDS = float(os.environ.get("MIN_ATTEMPT_SECONDS", "90"))
+MAX_DEFERRALS = int(os.environ.get("MAX_DEFERRALS", "5"))
+DEFERRAL_BASE_DELAY_SECONDS = float(os.environ.get("DEFERRAL_BASE_DELAY_SECONDS", "60"))
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "3"))
+CIRCUIT_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("CIRCUIT_BREAKER_COOLDOWN_SECONDS", "60"))
+# Time kept in reserve to persist the session and hand the review to a continuation invocation
+CONTINUATION_RESERVE_SECONDS = float(os.environ.get("CONTINUATION_RESERVE_SECONDS", "30"))
+MAX_CONTINUATIONS = int(os.environ.get("MAX_CONTINUATIONS", "3"))
+# Knowledge bases whose retrievals only search the documents of the plan of the member,
+# [{"knowledge_base_id": ..., "field": <keyword metadata field of the plan name>}]
+KNOWLEDGE_BASE_PLAN_FILTERS = json.loads(os.environ.get("KNOWLEDGE_BASE_PLAN_FILTERS", "[]"))
+MEMBER_ID_FIELD = "insured_id_number"
+# The plan name of the claim form is read by OCR, the filter uses the plan of the member record instead
+MEMBER_PLAN_QUERY = """
+    SELECT insured_plan_name FROM Insured_Person WHERE insured_policy_number = :insured_policy_number
+"""
+# Decisions of earlier reviews with the same claim form, member rows, knowledge base and agent versions
+# are returned without invoking the agent, see review_cache in cdk.json
+REVIEW_CACHE_ENABLED = os.environ.get("REVIEW_CACHE_ENABLED", "false").lower() == "true"
+
 s3 = boto3.client("s3")
+sqs = boto3.client("sqs")
+
+database_client = None
+if REVIEW_CACHE_ENABLED or KNOWLEDGE_BASE_PLAN_FILTERS:
+    from data_api_client import DataApiClient
+    database_client = DataApiClient(
+        os.environ["CLAIMS_DB_CLUSTER_ARN"],
+        os.environ["CLAIMS_DB_CREDENTIALS_SECRET_ARN"],
+        os.environ["CLAIMS_DB_DATABASE_NAME"]
+    )
+
+review_cache = None
+if REVIEW_CACHE_ENABLED:
+    review_cache = ReviewCache(
+        s3_client=s3,
+        database_client=database_client,
+        bedrock_agent_client=boto3.client("bedrock-agent"),
+        agent_id=CLAIMS_REVIEW_AGENT_ID,
+        agent_alias_id=CLAIMS_REVIEW_AGENT_ALIAS_ID,
+        knowledge_base_data_sources=json.loads(os.environ.get("KNOWLEDGE_BASE_DATA_SOURCES", "[]")),
+        version_refresh_seconds=float(os.environ.get("REVIEW_CACHE_VERSION_REFRESH_SECONDS", "60"))
+    )
 
 class CustomOutputNotFoundError(Exception):
     """Raised when a the custom output is not found"""
@@ -29,45 +91,261 @@ class InsightJobFailed(Exception):
 def generate_unique_id():
     return str(uuid.uuid4())
 
-def invoke_bedrock_agent(claim_reference_id:str, s3_uri:str):
+def review_prompt(s3_uri:str):
+    return f"Review the claim using claim form data in S3 URI {s3_uri}"
+
+def continuation_prompt(s3_uri:str, continuation_state:dict):
+    invoked_apis = ", ".join(continuation_state["invoked_apis"]) or "none"
+    return (f"Continue the review of the claim using claim form data in S3 URI {s3_uri}. "
+            f"Your previous response in this session was interrupted before it completed. "
+            f"These actions were already invoked before the interruption: {invoked_apis}. "
+            f"Do not create the claim record again, call the actions again only to retrieve results you need. "
+            f"Partial report produced before the interruption: {continuation_state['partial_completion'] or 'none'}. "
+            f"Respond with the complete final report.")
+
+def normalize_plan_name(plan_name:str):
+    """Plan names are stored lower case with single spaces in the plan metadata of the EOC documents"""
+    return " ".join(plan_name.lower().split())
+
+def member_plan_name(s3_uri:str):
+    """Plan of the member record of the insured id number on the claim form, None when no member matches"""
+    parsed_uri = urlparse(s3_uri)
+    claim_form = json.loads(s3.get_object(Bucket=parsed_uri.netloc, Key=parsed_uri.path.lstrip('/'))["Body"].read())
+    insured_policy_number = claim_form.get(MEMBER_ID_FIELD)
+    if not isinstance(insured_policy_number, str) or not insured_policy_number.strip():
+        return None
+    result = database_client.execute_statement(MEMBER_PLAN_QUERY, parameters=[
+        {'name': 'insured_policy_number', 'value': {'stringValue': insured_policy_number.strip()}}
+    ], include_result_metadata=False)
+    plan_names = {list(record[0].values())[0] for record in result["records"]}
+    # a policy number of several members with different plans does not name one plan
+    return plan_names.pop() if len(plan_names) == 1 else None
+
+def plan_filter_session_state(s3_uri:str):
+    """
+    Session state that restricts the knowledge base retrievals of the review to the documents of the plan
+    of the member, or None when no knowledge base is filtered by plan or the plan of the member is not known.
+    Retrievals are not filtered when the claim form or the member record cannot be read.
+    """
+    if not KNOWLEDGE_BASE_PLAN_FILTERS:
+        return None
     try:
-        session_id = claim_reference_id
-        agent_output = agent_runtime_wrapper.invoke_agent(
-            agent_id=CLAIMS_REVIEW_AGENT_ID,
-            agent_alias_id=CLAIMS_REVIEW_AGENT_ALIAS_ID,
-            session_id =  session_id,
-            prompt=f"Review the claim using claim form data in S3 URI {s3_uri}"
-        )
-        # Process the response
-        return agent_output
-        
+        plan_name = member_plan_name(s3_uri)
     except Exception as e:
-        print(f"Error invoking Bedrock agent: {str(e)}")
-        return  ERROR_MESSAGE
-    
+        print(f"The plan of the member could not be read, knowledge base retrievals are not filtered: {str(e)}")
+        return None
+    if not isinstance(plan_name, str) or not plan_name.strip():
+        print("No member record names the plan of the claim, knowledge base retrievals are not filtered")
+        return None
+    print(f"Filtering knowledge base retrievals on plan {normalize_plan_name(plan_name)}")
+    return {
+        "knowledgeBaseConfigurations": [{
+            "knowledgeBaseId": plan_filter["knowledge_base_id"],
+            "retrievalConfiguration": {
+                "vectorSearchConfiguration": {
+                    "filter": {
+                        "equals": {"key": plan_filter["field"], "value": normalize_plan_name(plan_name)}
+                    }
+                }
+            }
+        } for plan_filter in KNOWLEDGE_BASE_PLAN_FILTERS]
+    }
+
+def invoke_bedrock_agent(claim_reference_id:str, s3_uri:str, context, prompt:str=None, stop_before_deadline:bool=False,
+                         profiler:AgentTraceProfiler=None):
+    """
+    Invokes the claims review agent, retrying throttled, timed out and transient failures with
+    exponential backoff for as long as the remaining time of the invocation allows.
+    Raises AgentInvocationError when the review could not be completed, and AgentDeadlineExceeded
+    when stop_before_deadline is set and the agent is still responding close to the end of the invocation.
+    The agent trace is added to the profiler when one is given. Knowledge base retrievals are filtered on the
+    plan of the member, see plan_filter_session_state.
+    """
+    circuit_breaker = get_circuit_breaker(CLAIMS_REVIEW_AGENT_ALIAS_ID,
+                                          failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                                          cooldown_seconds=CIRCUIT_BREAKER_COOLDOWN_SECONDS)
+    session_state = plan_filter_session_state(s3_uri)
+    attempt = 0
+    while True:
+        if not circuit_breaker.allow_request():
+            raise CircuitOpenError(CLAIMS_REVIEW_AGENT_ALIAS_ID)
+        try:
+            session_id = claim_reference_id
+            agent_output = agent_runtime_wrapper.invoke_agent(
+                agent_id=CLAIMS_REVIEW_AGENT_ID,
+                agent_alias_id=CLAIMS_REVIEW_AGENT_ALIAS_ID,
+                session_id =  session_id,
+                prompt=prompt or review_prompt(s3_uri),
+                deadline=time.monotonic() + remaining_seconds(context) - CONTINUATION_RESERVE_SECONDS if stop_before_deadline else None,
+                trace_handler=profiler.add_trace if profiler else None,
+                session_state=session_state
+            )
+            circuit_breaker.record_success()
+            # Process the response
+            return agent_output
+
+        except AgentDeadlineExceeded:
+            circuit_breaker.record_success()
+            raise
+
+        except Exception as e:
+            category = classify_error(e)
+            print(f"Error invoking Bedrock agent ({category}) on attempt {attempt + 1}: {str(e)}")
+            if category == THROTTLING:
+                circuit_breaker.record_throttle()
+            else:
+                circuit_breaker.record_success()
+            if category == CLIENT_ERROR:
+                raise AgentInvocationError(str(e), category) from e
+            delay = backoff_delay(attempt, RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS)
+            if remaining_seconds(context) - delay < MIN_ATTEMPT_SECONDS:
+                raise AgentInvocationError(str(e), category) from e
+            time.sleep(delay)
+            attempt += 1
+
 def lambda_handler(event, context):
     # Log the event for debugging
     print(f"Received event: {event}")
+    if "Records" in event:
+        # Claim reviews deferred or continued through the retry queue
+        for record in event["Records"]:
+            message = json.loads(record["body"])
+            review_claim(message["event"], context,
+                         deferrals=message["deferrals"],
+                         continuations=message.get("continuations", 0))
+        return
+    return review_claim(event, context)
+
+def review_claim(event, context, deferrals=0, continuations=0):
     claim_reference_id = extract_claim_reference_id(event)
     processed_automation_output_uri = extract_document_automation_output(event,context)
+    output_s3_location_s3_bucket = event["detail"]["output_s3_location"]["s3_bucket"]
+    prompt = review_prompt(processed_automation_output_uri)
+    continuation_state = None
+    previous_profile = None
+    if continuations:
+        continuation_state = load_continuation_state(output_s3_location_s3_bucket, claim_reference_id)
+        previous_profile = load_claim_profile(output_s3_location_s3_bucket, claim_reference_id)
+        prompt = continuation_prompt(processed_automation_output_uri, continuation_state)
+        print(f"Continuing claim review in session {continuation_state['session_id']} (continuation {continuations} of {MAX_CONTINUATIONS})")
+    cache_key, cache_components = None, None
+    if review_cache and not continuations:
+        cache_key, cache_components, cache_entry = review_cache.lookup(output_s3_location_s3_bucket,
+                                                                        processed_automation_output_uri)
+        decision = review_cache.reuse(cache_entry, claim_reference_id) if cache_entry else None
+        if decision is not None:
+            save_claim_output(output_s3_location_s3_bucket, claim_reference_id, decision)
+            save_review_provenance(output_s3_location_s3_bucket, claim_reference_id, cache_key, cache_components,
+                                   source_claim_reference_id=cache_entry["claim_reference_id"])
+            return {
+                'statusCode': 200,
+                'body': decision
+            }
+    profiler = AgentTraceProfiler(claim_reference_id, session_id=claim_reference_id, previous_profile=previous_profile)
     # Invoke Bedrock agent
-    agent_response = invoke_bedrock_agent(claim_reference_id, processed_automation_output_uri)
+    try:
+        agent_response = invoke_bedrock_agent(claim_reference_id, processed_automation_output_uri, context,
+                                              prompt=prompt,
+                                              stop_before_deadline=CLAIMS_REVIEW_RETRY_QUEUE_URL is not None,
+                                              profiler=profiler)
+    except AgentDeadlineExceeded as e:
+        if continuations < MAX_CONTINUATIONS:
+            save_continuation_state(output_s3_location_s3_bucket, claim_reference_id, e, continuation_state)
+            save_claim_profile(output_s3_location_s3_bucket, profiler)
+            enqueue_claim_review(event, deferrals=deferrals, continuations=continuations + 1, delay_seconds=0)
+            return {
+                'statusCode': 202,
+                'body': f"Claim review continues in session {e.session_id}"
+            }
+        agent_response = ERROR_MESSAGE
+    except AgentInvocationError as e:
+        if e.retryable and CLAIMS_REVIEW_RETRY_QUEUE_URL and deferrals < MAX_DEFERRALS:
+            delay_seconds = deferral_delay(deferrals + 1, DEFERRAL_BASE_DELAY_SECONDS)
+            print(f"Deferring claim review by {delay_seconds} seconds (deferral {deferrals + 1} of {MAX_DEFERRALS})")
+            enqueue_claim_review(event, deferrals=deferrals + 1, continuations=continuations, delay_seconds=delay_seconds)
+            return {
+                'statusCode': 202,
+                'body': f"Claim review deferred: {str(e)}"
+            }
+        agent_response = ERROR_MESSAGE
 
     # Log the response for debugging
     print(f"Bedrock agent response: {agent_response}")
-    output_s3_location_s3_bucket = event["detail"]["output_s3_location"]["s3_bucket"]
-    
-    extracted_output = s3.put_object(
-        Bucket=output_s3_location_s3_bucket,
-        Key=f"{claim_reference_id}/claim_output.json",
-        Body=json.dumps(agent_response)
-    )    
+    save_claim_output(output_s3_location_s3_bucket, claim_reference_id, agent_response)
+    save_claim_profile(output_s3_location_s3_bucket, profiler)
+    # continued reviews are not cached, their key was not read before the agent started
+    if cache_key and agent_response != ERROR_MESSAGE:
+        review_cache.store(output_s3_location_s3_bucket, cache_key, cache_components, claim_reference_id, agent_response)
+        save_review_provenance(output_s3_location_s3_bucket, claim_reference_id, cache_key, cache_components)
+    if continuation_state:
+        s3.delete_object(Bucket=output_s3_location_s3_bucket, Key=continuation_state_key(claim_reference_id))
     # Return the response to the caller
     return {
         'statusCode': 200,
         'body': agent_response
     }
 
+def enqueue_claim_review(event, deferrals:int, continuations:int, delay_seconds:int):
+    sqs.send_message(
+        QueueUrl=CLAIMS_REVIEW_RETRY_QUEUE_URL,
+        MessageBody=json.dumps({"event": event, "deferrals": deferrals, "continuations": continuations}),
+        DelaySeconds=delay_seconds
+    )
+
+def continuation_state_key(claim_reference_id:str):
+    return f"{claim_reference_id}/continuation.json"
+
+def load_continuation_state(bucket:str, claim_reference_id:str):
+    response = s3.get_object(Bucket=bucket, Key=continuation_state_key(claim_reference_id))
+    return json.loads(response["Body"].read().decode("utf-8"))
+
+def save_continuation_state(bucket:str, claim_reference_id:str, deadline_exceeded:AgentDeadlineExceeded, previous_state:dict=None):
+    invoked_apis = (previous_state or {}).get("invoked_apis", []) + deadline_exceeded.invoked_apis
+    s3.put_object(
+        Bucket=bucket,
+        Key=continuation_state_key(claim_reference_id),
+        Body=json.dumps({
+            "session_id": deadline_exceeded.session_id,
+            "partial_completion": deadline_exceeded.partial_completion,
+            "invoked_apis": invoked_apis
+        })
+    )
+
+def save_claim_output(bucket:str, claim_reference_id:str, agent_response:str):
+    s3.put_object(
+        Bucket=bucket,
+        Key=f"{claim_reference_id}/claim_output.json",
+        Body=json.dumps(agent_response)
+    )
+
+def save_review_provenance(bucket:str, claim_reference_id:str, cache_key:str, components:dict,
+                           source_claim_reference_id:str=None):
+    """Records whether the decision was made by the agent or returned from the review of another claim"""
+    s3.put_object(
+        Bucket=bucket,
+        Key=f"{claim_reference_id}/review_provenance.json",
+        Body=json.dumps({
+            "source": "review_cache" if source_claim_reference_id else "agent",
+            "source_claim_reference_id": source_claim_reference_id or claim_reference_id,
+            "cache_key": cache_key,
+            "components": components
+        })
+    )
+
+def save_claim_profile(bucket:str, profiler:AgentTraceProfiler):
+    s3.put_object(
+        Bucket=bucket,
+        Key=f"{profiler.claim_reference_id}/claim_profile.json",
+        Body=profiler.to_json()
+    )
+
+def load_claim_profile(bucket:str, claim_reference_id:str):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=f"{claim_reference_id}/claim_profile.json")
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(response["Body"].read().decode("utf-8"))
+
 def extract_claim_reference_id(event):
     input_s3_object_key = event["detail"]["input_s3_object"]["name"]
     #extract claim reference id from input_s3_object_key
@@ -0,0 +1,139 @@
+"""
+Purpose
+
+Classifies Amazon Bedrock Agents Runtime errors and decides how a failed agent invocation is retried:
+exponential backoff with full jitter inside the remaining time budget of the invocation, and a per agent
+alias circuit breaker that sheds load while the agent is being throttled.
+"""
+
+import random
+import threading
+import time
+
+from botocore.exceptions import (
+    ClientError,
+    ConnectionClosedError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    ReadTimeoutError,
+)
+
+THROTTLING = "THROTTLING"
+TIMEOUT = "TIMEOUT"
+TRANSIENT = "TRANSIENT"
+CLIENT_ERROR = "CLIENT_ERROR"
+
+# Error codes are matched case-insensitively, the agent response stream reports them in camel case
+THROTTLING_ERROR_CODES = {
+    "throttlingexception",
+    "toomanyrequestsexception",
+    "servicequotaexceededexception",
+}
+TRANSIENT_ERROR_CODES = {
+    "internalserverexception",
+    "serviceunavailableexception",
+    "dependencyfailedexception",
+    "badgatewayexception",
+    "modelnotreadyexception",
+    # raised while another request is still running in the same session
+    "conflictexception",
+}
+TIMEOUT_EXCEPTIONS = (ReadTimeoutError, ConnectTimeoutError, EndpointConnectionError, ConnectionClosedError)
+
+
+class AgentInvocationError(Exception):
+    """Raised when the agent could not complete the review"""
+
+    def __init__(self, message, category):
+        super().__init__(message)
+        self.category = category
+
+    @property
+    def retryable(self):
+        return self.category != CLIENT_ERROR
+
+
+class CircuitOpenError(AgentInvocationError):
+    """Raised without calling the agent while the circuit breaker for the agent alias is open"""
+
+    def __init__(self, agent_alias_id):
+        super().__init__(f"Circuit breaker open for agent alias {agent_alias_id}", THROTTLING)
+
+
+def classify_error(error: Exception) -> str:
+    if isinstance(error, TIMEOUT_EXCEPTIONS):
+        return TIMEOUT
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code", "").lower()
+        status_code = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        if code in THROTTLING_ERROR_CODES or status_code == 429:
+            return THROTTLING
+        if code in TRANSIENT_ERROR_CODES or status_code >= 500:
+            return TRANSIENT
+    return CLIENT_ERROR
+
+
+def backoff_delay(attempt: int, base_seconds: float, max_seconds: float) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(max_seconds, base_seconds * (2 ** attempt)))
+
+
+def deferral_delay(deferrals: int, base_seconds: float) -> int:
+    """Exponential backoff with equal jitter, capped at the 15 minute maximum SQS message delay"""
+    delay = min(900, base_seconds * (2 ** (deferrals - 1)))
+    return int(delay / 2 + random.uniform(0, delay / 2))
+
+
+def remaining_seconds(context) -> float:
+    return context.get_remaining_time_in_millis() / 1000
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive throttled invocations and rejects invocations for
+    `cooldown_seconds`. After the cooldown a single trial invocation is let through (half open); its
+    outcome closes the circuit or opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        self.lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_in_progress or time.monotonic() - self.opened_at < self.cooldown_seconds:
+                return False
+            self.trial_in_progress = True
+            return True
+
+    def record_success(self):
+        """Records an invocation that was not throttled"""
+        with self.lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.trial_in_progress = False
+
+    def record_throttle(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.trial_in_progress or self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_in_progress = False
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(agent_alias_id: str, failure_threshold: int, cooldown_seconds: float) -> CircuitBreaker:
+    """Circuit breakers are kept per agent alias for the lifetime of the Lambda container"""
+    with _circuit_breakers_lock:
+        if agent_alias_id not in _circuit_breakers:
+            _circuit_breakers[agent_alias_id] = CircuitBreaker(failure_threshold, cooldown_seconds)
+        return _circuit_breakers[agent_alias_id]
@@ -0,0 +1,236 @@
+"""
+Purpose
+
+Cache of claim review decisions. Resubmitted and duplicate claims are reviewed again by the agent with the same
+inputs, so a review is answered from an earlier decision when everything the decision depends on is unchanged:
+
+    claim_form      hash of the compacted extraction of the claim form, in canonical JSON
+    member          row versions (xmin) of the insured member and the patients of the policy on the form
+    knowledge_bases latest completed ingestion job of every knowledge base data source of the agent
+    agent           agent alias and the agent version it routes to
+
+The cache key is the hash of these components, so an update of the member, a new ingestion of the EOC
+documents or a new agent version makes the next review of the claim a miss. Entries are stored as
+review_cache/<key>.json in the claims review bucket and expire with a lifecycle rule of the bucket.
+
+A cached decision is reused by copying the claim and service lines the earlier review created to the new claim
+reference id, and naming the new claim reference id and claim id in the decision instead of the earlier ones.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+from claims_form_compaction import compact_claims_form
+from ingestion_version import latest_ingestion_job_id
+
+REVIEW_CACHE_PREFIX = "review_cache"
+MEMBER_ID_FIELD = "insured_id_number"
+NO_MEMBER_VERSION = "none"
+
+# xmin changes with every update of a row, the patient versions are ordered so the string is stable
+MEMBER_VERSION_QUERY = """
+    SELECT i.xmin::text insured_version,
+    string_agg(p.patient_id::text || ':' || p.xmin::text, ',' ORDER BY p.patient_id) patient_versions
+    FROM insured_person i LEFT JOIN patient p ON p.insured_id = i.insured_id
+    WHERE i.insured_policy_number = :insured_policy_number
+    GROUP BY i.insured_id, i.xmin::text
+    ORDER BY i.insured_id
+"""
+
+# Claim and service lines of the earlier review, written for the new claim reference id in one statement. A
+# retry returns the claim copied before. No row is returned when the earlier review did not create a claim.
+COPY_CLAIM_QUERY = """
+    WITH source_claim AS (
+        SELECT claim_id, claim_date, patient_id, diagnosis_1, diagnosis_2, diagnosis_3, diagnosis_4,
+        total_charges, balanceDue, amountPaid, claim_status
+        FROM Claim WHERE claim_reference_id = :source_claim_reference_id
+        ORDER BY claim_date DESC LIMIT 1
+    ), copied_claim AS (
+        INSERT INTO Claim (claim_reference_id, patient_id, claim_date, diagnosis_1, diagnosis_2, diagnosis_3, diagnosis_4,
+        total_charges, balanceDue, amountPaid, claim_status)
+        SELECT :claim_reference_id, patient_id, claim_date, diagnosis_1, diagnosis_2, diagnosis_3, diagnosis_4,
+        total_charges, balanceDue, amountPaid, claim_status FROM source_claim
+        ON CONFLICT (claim_reference_id, claim_date) DO UPDATE SET claim_status = EXCLUDED.claim_status
+        RETURNING claim_id, claim_date
+    ), copied_services AS (
+        INSERT INTO SERVICE (claim_id, claim_date, line_number, date_of_service, place_of_service, type_of_service,
+        procedure_code, charge_amount)
+        SELECT c.claim_id, c.claim_date, s.line_number, s.date_of_service, s.place_of_service, s.type_of_service,
+        s.procedure_code, s.charge_amount
+        FROM copied_claim c, source_claim sc JOIN SERVICE s ON s.claim_id = sc.claim_id AND s.claim_date = sc.claim_date
+        ON CONFLICT (claim_id, claim_date, line_number) DO NOTHING
+    )
+    SELECT sc.claim_id source_claim_id, c.claim_id FROM source_claim sc, copied_claim c
+"""
+
+
+def canonical_value(value):
+    """Sorted keys and single spaced strings, extractions that differ only in layout hash the same"""
+    if isinstance(value, dict):
+        return {key: canonical_value(item) for key, item in sorted(value.items())}
+    if isinstance(value, list):
+        return [canonical_value(item) for item in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+
+def hash_json(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def rebind_decision(decision: str, source_claim_reference_id: str, claim_reference_id: str,
+                    source_claim_id=None, claim_id=None) -> str:
+    """The decision text with the claim reference id and claim id of the earlier review replaced by the new ones"""
+    decision = decision.replace(source_claim_reference_id, claim_reference_id)
+    if source_claim_id is not None and claim_id is not None:
+        # claim ids are small integers, only the ones that follow "claim id" are replaced
+        decision = re.sub(rf"(?i)(claim[ _-]?id\W{{0,5}}){source_claim_id}\b", rf"\g<1>{claim_id}", decision)
+    return decision
+
+
+def claim_form_hash(claim_form: dict) -> str:
+    compacted, _ = compact_claims_form(claim_form, token_budget=0)
+    return hash_json(canonical_value(compacted))
+
+
+class ReviewCache:
+    """
+    Looks up and stores review decisions. The knowledge base and agent versions are read at most every
+    version_refresh_seconds; lookups that fail are reported as misses so the review falls back to the agent.
+    """
+
+    def __init__(self, s3_client, database_client, bedrock_agent_client, agent_id: str, agent_alias_id: str,
+                 knowledge_base_data_sources: list, version_refresh_seconds: float = 60):
+        self.s3_client = s3_client
+        self.database_client = database_client
+        self.bedrock_agent_client = bedrock_agent_client
+        self.agent_id = agent_id
+        self.agent_alias_id = agent_alias_id
+        # [{"knowledge_base_id": ..., "data_source_id": ...}]
+        self.knowledge_base_data_sources = knowledge_base_data_sources
+        self.version_refresh_seconds = version_refresh_seconds
+        self.versions = None
+        self.versions_checked_at = 0
+        self.lock = threading.Lock()
+
+    def agent_version(self) -> str:
+        alias = self.bedrock_agent_client.get_agent_alias(agentId=self.agent_id,
+                                                          agentAliasId=self.agent_alias_id)["agentAlias"]
+        version = alias["routingConfiguration"][0]["agentVersion"]
+        if version == "DRAFT":
+            # the draft changes without a new version, every preparation of the agent starts over
+            agent = self.bedrock_agent_client.get_agent(agentId=self.agent_id)["agent"]
+            version = f"DRAFT@{agent['preparedAt'].isoformat()}" if agent.get("preparedAt") else "DRAFT"
+        return f"{self.agent_alias_id}:{version}"
+
+    def service_versions(self) -> dict:
+        """Versions of the knowledge bases and the agent, shared by all reviews of the container"""
+        with self.lock:
+            if self.versions is not None and time.monotonic() - self.versions_checked_at < self.version_refresh_seconds:
+                return self.versions
+        versions = {
+            "knowledge_bases": {
+                data_source["knowledge_base_id"]: latest_ingestion_job_id(
+                    self.bedrock_agent_client, data_source["knowledge_base_id"], data_source["data_source_id"])
+                for data_source in self.knowledge_base_data_sources
+            },
+            "agent": self.agent_version()
+        }
+        with self.lock:
+            if versions != self.versions:
+                print(f"Review cache service versions: {json.dumps(versions)}")
+            self.versions = versions
+            self.versions_checked_at = time.monotonic()
+        return versions
+
+    def member_version(self, claim_form: dict) -> str:
+        insured_policy_number = claim_form.get(MEMBER_ID_FIELD)
+        if not isinstance(insured_policy_number, str) or not insured_policy_number.strip():
+            return NO_MEMBER_VERSION
+        result = self.database_client.execute_statement(MEMBER_VERSION_QUERY, parameters=[
+            {'name': 'insured_policy_number', 'value': {'stringValue': insured_policy_number.strip()}}
+        ], include_result_metadata=False)
+        rows = [[list(value.values())[0] for value in record] for record in result["records"]]
+        return hash_json(rows) if rows else NO_MEMBER_VERSION
+
+    def key_components(self, claim_form: dict) -> dict:
+        return {
+            "claim_form": claim_form_hash(claim_form),
+            "member": self.member_version(claim_form),
+            **self.service_versions()
+        }
+
+    def load_claim_form(self, claim_form_data_uri: str) -> dict:
+        parsed_uri = urlparse(claim_form_data_uri)
+        response = self.s3_client.get_object(Bucket=parsed_uri.netloc, Key=parsed_uri.path.lstrip('/'))
+        return json.loads(response["Body"].read())
+
+    def lookup(self, bucket: str, claim_form_data_uri: str):
+        """
+        Returns the cache key, its components and the cached entry, None when the review is not cached.
+        The key is None when the components could not be read, the review is then not cached either.
+        """
+        try:
+            components = self.key_components(self.load_claim_form(claim_form_data_uri))
+        except Exception as e:
+            print(f"Review cache unavailable, reviewing without it: {str(e)}")
+            return None, None, None
+        key = hash_json(components)
+        try:
+            response = self.s3_client.get_object(Bucket=bucket, Key=entry_key(key))
+        except self.s3_client.exceptions.NoSuchKey:
+            print(f"Review cache miss {key}")
+            return key, components, None
+        except Exception as e:
+            print(f"Review cache entry {key} could not be read, reviewing without it: {str(e)}")
+            return key, components, None
+        entry = json.loads(response["Body"].read().decode("utf-8"))
+        print(f"Review cache hit {key}, decided for claim ref: {entry['claim_reference_id']}")
+        return key, components, entry
+
+    def copy_claim(self, source_claim_reference_id: str, claim_reference_id: str):
+        """Claim id of the earlier review and of its copy, (None, None) when the earlier review created no claim"""
+        result = self.database_client.execute_statement(COPY_CLAIM_QUERY, parameters=[
+            {'name': 'source_claim_reference_id', 'value': {'stringValue': source_claim_reference_id}},
+            {'name': 'claim_reference_id', 'value': {'stringValue': claim_reference_id}}
+        ], include_result_metadata=False)
+        if not result["records"]:
+            return None, None
+        source_claim_id, claim_id = [list(value.values())[0] for value in result["records"][0]]
+        return source_claim_id, claim_id
+
+    def reuse(self, entry: dict, claim_reference_id: str):
+        """
+        Decision of a cache entry for the claim reference id, after the claim of the earlier review is copied to it.
+        None when the claim could not be copied, the claim is then reviewed by the agent.
+        """
+        source_claim_reference_id = entry["claim_reference_id"]
+        try:
+            source_claim_id, claim_id = self.copy_claim(source_claim_reference_id, claim_reference_id)
+        except Exception as e:
+            print(f"Claim of claim ref: {source_claim_reference_id} could not be copied, reviewing without the review cache: {str(e)}")
+            return None
+        print(f"Copied claim {source_claim_id} of claim ref: {source_claim_reference_id} to claim {claim_id} of claim ref: {claim_reference_id}")
+        return rebind_decision(entry["decision"], source_claim_reference_id, claim_reference_id, source_claim_id, claim_id)
+
+    def store(self, bucket: str, key: str, components: dict, claim_reference_id: str, decision: str):
+        self.s3_client.put_object(
+            Bucket=bucket,
+            Key=entry_key(key),
+            Body=json.dumps({
+                "decision": decision,
+                "claim_reference_id": claim_reference_id,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "components": components
+            })
+        )
+
+
+def entry_key(key: str) -> str:
+    return f"{REVIEW_CACHE_PREFIX}/{key}.json"
@@ -0,0 +1,154 @@
+"""
+Purpose
+
+Builds a per-claim profile from the Amazon Bedrock Agents trace events emitted while the agent reviews
+a claim: the duration of every orchestration step, the latency and input/output token counts of each
+model invocation, and the duration of each action group call and knowledge base lookup along with the
+number of references retrieved.
+"""
+
+import json
+import time
+
+# Trace types that carry model invocations, keyed by the phase of the agent sequence they belong to
+PHASES = {
+    "preProcessingTrace": "PRE_PROCESSING",
+    "orchestrationTrace": "ORCHESTRATION",
+    "postProcessingTrace": "POST_PROCESSING",
+}
+
+
+def event_timestamp(trace_part: dict) -> float:
+    event_time = trace_part.get("eventTime")
+    return event_time.timestamp() if event_time is not None else time.time()
+
+
+def elapsed_ms(started_at: float, ended_at: float):
+    if started_at is None or ended_at is None:
+        return None
+    return round((ended_at - started_at) * 1000, 1)
+
+
+class AgentTraceProfiler:
+    """Accumulates the trace events of one claim review. Feed it with add_trace and persist to_json."""
+
+    def __init__(self, claim_reference_id: str, session_id: str, previous_profile: dict = None):
+        self.claim_reference_id = claim_reference_id
+        self.session_id = session_id
+        # steps of earlier invocations of the same review, e.g. before a continuation
+        self.previous_steps = (previous_profile or {}).get("steps", [])
+        self.previous_duration_ms = (previous_profile or {}).get("total_duration_ms", 0)
+        self.started_at = time.time()
+        self.ended_at = None
+        self.steps = {}
+        self.failures = []
+
+    def step(self, trace_id: str, phase: str, timestamp: float) -> dict:
+        if trace_id not in self.steps:
+            self.steps[trace_id] = {
+                "trace_id": trace_id,
+                "phase": phase,
+                "started_at": timestamp,
+                "ended_at": timestamp,
+                "model_invocation_started_at": None,
+                "model_latency_ms": None,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "tool_calls": []
+            }
+        step = self.steps[trace_id]
+        step["ended_at"] = max(step["ended_at"], timestamp)
+        return step
+
+    def add_trace(self, trace_part: dict):
+        """Adds the `trace` member of an InvokeAgent response stream event"""
+        timestamp = event_timestamp(trace_part)
+        self.ended_at = timestamp
+        trace = trace_part.get("trace", {})
+        if "failureTrace" in trace:
+            self.failures.append(trace["failureTrace"].get("failureReason"))
+        for trace_type, phase in PHASES.items():
+            if trace_type in trace:
+                self.add_phase_trace(phase, trace[trace_type], timestamp)
+
+    def add_phase_trace(self, phase: str, phase_trace: dict, timestamp: float):
+        for trace_kind, value in phase_trace.items():
+            if not isinstance(value, dict) or "traceId" not in value:
+                continue
+            step = self.step(value["traceId"], phase, timestamp)
+            if trace_kind == "modelInvocationInput":
+                step["model_invocation_started_at"] = timestamp
+            elif trace_kind == "modelInvocationOutput":
+                step["model_latency_ms"] = elapsed_ms(step["model_invocation_started_at"], timestamp)
+                usage = value.get("metadata", {}).get("usage", {})
+                step["input_tokens"] += usage.get("inputTokens", 0)
+                step["output_tokens"] += usage.get("outputTokens", 0)
+            elif trace_kind == "invocationInput":
+                self.start_tool_call(step, value, timestamp)
+            elif trace_kind == "observation":
+                self.end_tool_call(step, value, timestamp)
+
+    def start_tool_call(self, step: dict, invocation_input: dict, timestamp: float):
+        invocation_type = invocation_input.get("invocationType")
+        if "actionGroupInvocationInput" in invocation_input:
+            action_group_input = invocation_input["actionGroupInvocationInput"]
+            name = action_group_input.get("function") or \
+                f"{action_group_input.get('verb', '').upper()} {action_group_input.get('apiPath')}"
+        elif "knowledgeBaseLookupInput" in invocation_input:
+            name = invocation_input["knowledgeBaseLookupInput"].get("knowledgeBaseId")
+        else:
+            return
+        step["tool_calls"].append({
+            "type": invocation_type,
+            "name": name,
+            "started_at": timestamp,
+            "duration_ms": None
+        })
+
+    def end_tool_call(self, step: dict, observation: dict, timestamp: float):
+        pending = [call for call in step["tool_calls"] if call["duration_ms"] is None]
+        if not pending:
+            return
+        tool_call = pending[0]
+        tool_call["duration_ms"] = elapsed_ms(tool_call["started_at"], timestamp)
+        if "knowledgeBaseLookupOutput" in observation:
+            tool_call["retrieved_references"] = len(observation["knowledgeBaseLookupOutput"].get("retrievedReferences", []))
+
+    def to_dict(self) -> dict:
+        steps = self.previous_steps + [
+            {
+                "trace_id": step["trace_id"],
+                "phase": step["phase"],
+                "duration_ms": elapsed_ms(step["started_at"], step["ended_at"]),
+                "model_latency_ms": step["model_latency_ms"],
+                "input_tokens": step["input_tokens"],
+                "output_tokens": step["output_tokens"],
+                "tool_calls": [
+                    {key: value for key, value in call.items() if key != "started_at"}
+                    for call in step["tool_calls"]
+                ]
+            }
+            for step in self.steps.values()
+        ]
+        tool_calls = [call for step in steps for call in step["tool_calls"]]
+        return {
+            "claim_reference_id": self.claim_reference_id,
+            "session_id": self.session_id,
+            "total_duration_ms": self.previous_duration_ms + (elapsed_ms(self.started_at, self.ended_at) or 0),
+            "totals": {
+                "steps": len(steps),
+                "model_invocations": sum(1 for step in steps if step["model_latency_ms"] is not None),
+                "model_latency_ms": round(sum(step["model_latency_ms"] or 0 for step in steps), 1),
+                "input_tokens": sum(step["input_tokens"] for step in steps),
+                "output_tokens": sum(step["output_tokens"] for step in steps),
+                "action_group_calls": sum(1 for call in tool_calls if call["type"] == "ACTION_GROUP"),
+                "knowledge_base_lookups": sum(1 for call in tool_calls if call["type"] == "KNOWLEDGE_BASE"),
+                "retrieved_references": sum(call.get("retrieved_references", 0) for call in tool_calls),
+                "tool_call_duration_ms": round(sum(call["duration_ms"] or 0 for call in tool_calls), 1)
+            },
+            "failures": self.failures,
+            "steps": steps
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), separators=(",", ":"))
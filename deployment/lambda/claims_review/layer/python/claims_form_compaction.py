@@ -0,0 +1,179 @@
+"""
+Purpose
+
+Compacts the claim form data extracted by Bedrock Data Automation before it is returned to the agent.
+The extracted inference_result holds every field of the CMS-1500 blueprint, most of them empty, and is
+carried in the agent context on every subsequent orchestration turn. Compaction drops empty values,
+flattens the service lines into a columns/rows table, orders the fields by relevance for the review and
+enforces a token budget by leaving out the least relevant fields.
+"""
+
+import json
+import math
+import re
+
+SERVICE_LINES_FIELD = "medical_procedures"
+
+# Fields in the order the claims review uses them, fields not listed here follow in form order
+FIELD_RELEVANCE = [
+    "insured_id_number",
+    "patient_name",
+    "patient_date_of_birth",
+    "insured_name",
+    "insured_insurance_plan_name",
+    "insured_policy_feca_number",
+    "diagnosis_1",
+    "diagnosis_2",
+    "diagnosis_3",
+    "diagnosis_4",
+    SERVICE_LINES_FIELD,
+    "total_charges",
+    "amount_paid",
+    "patient_relationship_to_insured",
+    "patient_sex",
+    "insured_date_of_birth",
+    "patient_address",
+    "insured_address",
+    "insured_phone_number",
+    "prior_authorization_number",
+    "insurance_program",
+    "another_health_benefit_plan_indicator",
+    "patient_condition_related_to",
+    "illness_injury_date",
+    "hospitalization_start_date",
+    "hospitalization_end_date",
+]
+# Fields the review cannot do without, they are kept whatever the token budget
+REQUIRED_FIELDS = set(FIELD_RELEVANCE[:FIELD_RELEVANCE.index("amount_paid") + 1])
+
+SERVICE_LINE_COLUMNS = [
+    "service_start_date",
+    "service_end_date",
+    "place_of_service",
+    "type_of_service",
+    "procedure_code",
+    "procedure_modifier",
+    "diagnosis_code",
+    "charge_amount",
+]
+
+JSON_PATH_TOKEN = re.compile(r"\.([A-Za-z_][\w-]*)|\[(\*|\d+)\]|\['([^']+)'\]")
+
+
+class InvalidJsonPathError(ValueError):
+    """Raised when a fields expression is not a supported JSONPath"""
+    pass
+
+
+def estimate_tokens(value) -> int:
+    """Approximates the number of model tokens of the JSON serialized value (about 4 characters per token)"""
+    return math.ceil(len(json.dumps(value, separators=(",", ":"))) / 4)
+
+
+def is_empty(value) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return not value.strip()
+    if isinstance(value, (list, dict)):
+        return not value
+    return False
+
+
+def drop_empty(value):
+    """Recursively removes null, blank string, empty list and empty object values"""
+    if isinstance(value, dict):
+        compacted = {key: drop_empty(item) for key, item in value.items()}
+        return {key: item for key, item in compacted.items() if not is_empty(item)}
+    if isinstance(value, list):
+        compacted = [drop_empty(item) for item in value]
+        return [item for item in compacted if not is_empty(item)]
+    return value
+
+
+def flatten_service_lines(service_lines: list) -> dict:
+    """Turns the list of service line objects into a table so that field names are not repeated per line"""
+    rows = []
+    for service_line in service_lines:
+        # single day services repeat the start date as end date
+        if service_line.get("service_end_date") == service_line.get("service_start_date"):
+            service_line = {key: value for key, value in service_line.items() if key != "service_end_date"}
+        rows.append(service_line)
+    present = {key for row in rows for key in row}
+    columns = [column for column in SERVICE_LINE_COLUMNS if column in present] + \
+        sorted(present.difference(SERVICE_LINE_COLUMNS))
+    return {
+        "columns": columns,
+        "rows": [[row.get(column) for column in columns] for row in rows]
+    }
+
+
+def order_by_relevance(claims_form_data: dict) -> dict:
+    ranked = [field for field in FIELD_RELEVANCE if field in claims_form_data]
+    ranked += [field for field in claims_form_data if field not in ranked]
+    return {field: claims_form_data[field] for field in ranked}
+
+
+def compact_claims_form(claims_form_data: dict, token_budget: int = None):
+    """
+    Returns the compacted claim form data and the list of fields left out to stay within token_budget.
+    Required fields are never left out, so the result can still exceed a very small budget.
+    """
+    compacted = drop_empty(claims_form_data)
+    if isinstance(compacted.get(SERVICE_LINES_FIELD), list):
+        compacted[SERVICE_LINES_FIELD] = flatten_service_lines(compacted[SERVICE_LINES_FIELD])
+    compacted = order_by_relevance(compacted)
+
+    omitted_fields = []
+    if token_budget:
+        for field in reversed(list(compacted)):
+            if estimate_tokens(compacted) <= token_budget:
+                break
+            if field not in REQUIRED_FIELDS:
+                del compacted[field]
+                omitted_fields.insert(0, field)
+    return compacted, omitted_fields
+
+
+def parse_json_path(expression: str) -> list:
+    """Parses the supported JSONPath subset: $.field, $['field'], $.list[0] and $.list[*]"""
+    expression = expression.strip()
+    if not expression.startswith("$"):
+        raise InvalidJsonPathError(f"JSONPath must start with $: {expression}")
+    steps = []
+    position = 1
+    while position < len(expression):
+        match = JSON_PATH_TOKEN.match(expression, position)
+        if not match:
+            raise InvalidJsonPathError(f"Unsupported JSONPath: {expression}")
+        name, index, quoted_name = match.groups()
+        if index is not None:
+            steps.append("*" if index == "*" else int(index))
+        else:
+            steps.append(name if name is not None else quoted_name)
+        position = match.end()
+    return steps
+
+
+def evaluate_json_path(value, steps: list):
+    if not steps:
+        return value
+    step, remaining = steps[0], steps[1:]
+    if step == "*":
+        if not isinstance(value, list):
+            return None
+        results = [evaluate_json_path(item, remaining) for item in value]
+        return [result for result in results if result is not None]
+    if isinstance(step, int):
+        return evaluate_json_path(value[step], remaining) if isinstance(value, list) and -len(value) <= step < len(value) else None
+    return evaluate_json_path(value[step], remaining) if isinstance(value, dict) and step in value else None
+
+
+def project_fields(claims_form_data: dict, expressions: list) -> dict:
+    """Selects the values matched by each JSONPath expression, keyed by the expression"""
+    projection = {}
+    for expression in expressions:
+        result = evaluate_json_path(claims_form_data, parse_json_path(expression))
+        if not is_empty(result):
+            projection[expression.strip()] = drop_empty(result)
+    return projection
@@ -0,0 +1,179 @@
+"""
+Purpose
+
+Read only index of the medical codes of a claim form: ICD-10-CM diagnosis codes, CPT and HCPCS Level II
+procedure codes and procedure modifiers. The index is a sorted snapshot file keyed by code system and
+normalized code, built offline from the code set releases and loaded once per container, so validating
+every code of a claim is a few binary searches in memory mapped pages instead of knowledge base
+retrievals by the agent.
+"""
+
+import os
+import re
+
+from sorted_snapshot import SortedSnapshot, write_snapshot
+
+ICD10CM = "icd10cm"
+CPT = "cpt"
+HCPCS = "hcpcs"
+MODIFIER = "modifier"
+KEY_SEPARATOR = "\x1f"
+CODE_INDEX_PREFIX = "code_index"
+CODE_INDEX_KEY = f"{CODE_INDEX_PREFIX}/code_index.snap"
+
+# Letter, digit, alphanumeric category, then up to 4 characters of etiology, site, severity and extension
+ICD10CM_FORMAT = re.compile(r"^[A-Z][0-9][0-9A-Z][0-9A-Z]{0,4}$")
+# Category I codes are 5 digits, category II end in F, category III in T and laboratory analyses in U
+CPT_FORMAT = re.compile(r"^[0-9]{4}[0-9FTU]$")
+HCPCS_FORMAT = re.compile(r"^[A-V][0-9]{4}$")
+MODIFIER_FORMAT = re.compile(r"^[0-9A-Z]{2}$")
+# Item 24E points at the diagnoses of item 21 by letter, A to L, or by number on the earlier form version
+DIAGNOSIS_POINTER_FORMAT = re.compile(r"^([A-L]{1,4}|[1-9]{1,4})$")
+MAX_SUGGESTIONS = 5
+
+
+def normalize_code(code) -> str:
+    """Upper case without the dot, spaces and dashes that codes are printed with, E11.9 is E119"""
+    return re.sub(r"[\s.\-]", "", str(code)).upper()
+
+
+def index_key(system: str, code: str) -> str:
+    return f"{system}{KEY_SEPARATOR}{normalize_code(code)}"
+
+
+def procedure_code_system(code: str):
+    if CPT_FORMAT.match(code):
+        return CPT
+    if HCPCS_FORMAT.match(code):
+        return HCPCS
+    return None
+
+
+def write_code_index(path: str, records, metadata: dict = None) -> int:
+    """Writes (system, code, entry) records, entries hold the description and, for ICD-10-CM, billable"""
+    return write_snapshot(path, ((index_key(system, code), entry) for system, code, entry in records), metadata)
+
+
+class CodeIndex:
+    """Validates codes against a code index snapshot, the results name the problem and closest valid codes"""
+
+    def __init__(self, snapshot: SortedSnapshot):
+        self.snapshot = snapshot
+        self.metadata = snapshot.metadata
+
+    @classmethod
+    def load(cls, s3_client, bucket: str, key: str, download_directory: str = "/tmp"):
+        path = os.path.join(download_directory, os.path.basename(key))
+        s3_client.download_file(bucket, key, path)
+        code_index = cls(SortedSnapshot(path))
+        print(f"Loaded code index version {code_index.metadata.get('version')} with {len(code_index.snapshot)} codes")
+        return code_index
+
+    def lookup(self, system: str, code: str):
+        return self.snapshot.get(index_key(system, code))
+
+    def codes_with_prefix(self, system: str, prefix: str, billable_only: bool = False) -> list:
+        prefix_key = index_key(system, prefix)
+        codes = []
+        for index in self.snapshot.prefix_range(prefix_key, limit=MAX_SUGGESTIONS * 20):
+            if billable_only and not self.snapshot.value_at(index).get("billable", True):
+                continue
+            codes.append(self.snapshot.key_at(index).decode("utf-8").split(KEY_SEPARATOR, 1)[1])
+            if len(codes) == MAX_SUGGESTIONS:
+                break
+        return codes
+
+    def validate_diagnosis(self, code) -> dict:
+        normalized = normalize_code(code)
+        result = {"code": code, "system": ICD10CM, "valid": False}
+        if not ICD10CM_FORMAT.match(normalized):
+            result["error"] = "Not an ICD-10-CM code"
+            return result
+        entry = self.lookup(ICD10CM, normalized)
+        if entry is None:
+            result["error"] = "Unknown ICD-10-CM code"
+            result["suggestions"] = self.codes_with_prefix(ICD10CM, normalized[:3], billable_only=True)
+        elif not entry["billable"]:
+            result["description"] = entry["description"]
+            result["error"] = "ICD-10-CM category that is not billable, a more specific code is required"
+            result["suggestions"] = self.codes_with_prefix(ICD10CM, normalized, billable_only=True)
+        else:
+            result["valid"] = True
+            result["description"] = entry["description"]
+        return result
+
+    def validate_procedure(self, code) -> dict:
+        normalized = normalize_code(code)
+        system = procedure_code_system(normalized)
+        result = {"code": code, "system": system, "valid": False}
+        if system is None:
+            result["error"] = "Not a CPT or HCPCS code"
+            return result
+        entry = self.lookup(system, normalized)
+        if entry is None:
+            result["error"] = f"Unknown {system.upper()} code"
+        else:
+            result["valid"] = True
+            result["description"] = entry["description"]
+        return result
+
+    def validate_modifier(self, modifier) -> dict:
+        normalized = normalize_code(modifier)
+        result = {"code": modifier, "system": MODIFIER, "valid": False}
+        entry = self.lookup(MODIFIER, normalized) if MODIFIER_FORMAT.match(normalized) else None
+        if entry is None:
+            result["error"] = "Unknown procedure modifier"
+        else:
+            result["valid"] = True
+            result["description"] = entry["description"]
+        return result
+
+    def validate_diagnosis_pointer(self, pointer, diagnosis_codes: list) -> dict:
+        """
+        The diagnoses a service line points at. Lines that hold a diagnosis code instead of a pointer are
+        validated as diagnosis codes.
+        """
+        normalized = re.sub(r"[^0-9A-Z]", "", str(pointer).upper())
+        if not DIAGNOSIS_POINTER_FORMAT.match(normalized):
+            return {"pointer": pointer, "diagnoses": [self.validate_diagnosis(pointer)]}
+        result = {"pointer": pointer, "diagnoses": []}
+        for character in normalized:
+            position = int(character) - 1 if character.isdigit() else ord(character) - ord("A")
+            if position >= len(diagnosis_codes) or not diagnosis_codes[position]:
+                result["error"] = f"Pointer {character} refers to a diagnosis that is not on the claim form"
+            else:
+                result["diagnoses"].append(self.validate_diagnosis(diagnosis_codes[position]))
+        return result
+
+    def validate_service_line(self, line_number: int, service_line: dict, diagnosis_codes: list) -> dict:
+        result = {"line": line_number}
+        if service_line.get("procedure_code"):
+            result["procedure"] = self.validate_procedure(service_line["procedure_code"])
+        else:
+            result["procedure"] = {"code": None, "valid": False, "error": "No procedure code"}
+        modifiers = [modifier for modifier in re.split(r"[\s,;/]+", str(service_line.get("procedure_modifier") or ""))
+                     if modifier]
+        result["modifiers"] = [self.validate_modifier(modifier) for modifier in modifiers]
+        if service_line.get("diagnosis_code"):
+            result["diagnosis_pointer"] = self.validate_diagnosis_pointer(service_line["diagnosis_code"],
+                                                                          diagnosis_codes)
+        pointer = result.get("diagnosis_pointer", {})
+        checks = [result["procedure"], *result["modifiers"], *pointer.get("diagnoses", [])]
+        result["valid"] = all(check["valid"] for check in checks) and "error" not in pointer
+        return result
+
+    def validate_claim(self, diagnosis_codes: list, service_lines: list) -> dict:
+        """
+        Validates the diagnoses of item 21, in order, and every service line of item 24 with the diagnoses
+        its pointer refers to. Empty service lines are skipped.
+        """
+        diagnoses = [self.validate_diagnosis(code) for code in diagnosis_codes if code]
+        lines = [self.validate_service_line(line_number, service_line, diagnosis_codes)
+                 for line_number, service_line in enumerate(service_lines, start=1)
+                 if any(service_line.get(field) for field in ("procedure_code", "procedure_modifier", "diagnosis_code"))]
+        return {
+            "valid": all(item["valid"] for item in diagnoses + lines),
+            "diagnoses": diagnoses,
+            "service_lines": lines,
+            "code_index_version": self.metadata.get("version")
+        }
@@ -0,0 +1,185 @@
+"""
+Purpose
+
+RDS Data API client for the claims database that copes with Aurora Serverless v2 resuming from idle.
+While the cluster resumes, or when the Data API throttles, calls fail with errors such as
+DatabaseResumingException; these are classified as retryable and retried with exponential backoff and
+full jitter, within a retry budget and the remaining time of the Lambda invocation. ping() sends a cheap
+statement that starts resuming the cluster without waiting for it.
+"""
+
+import random
+import time
+
+import boto3
+from botocore.exceptions import ClientError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError
+
+RESUMING = "RESUMING"
+THROTTLING = "THROTTLING"
+TRANSIENT = "TRANSIENT"
+STATEMENT_TIMEOUT = "STATEMENT_TIMEOUT"
+CLIENT_ERROR = "CLIENT_ERROR"
+
+RESUMING_ERROR_CODES = {"DatabaseResumingException", "DatabaseUnavailableException"}
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException"}
+TRANSIENT_ERROR_CODES = {"ServiceUnavailableError", "InternalServerErrorException", "UnsupportedResultException"}
+# Returned as BadRequestException by the Data API while the connection to a resuming cluster is established
+RESUMING_ERROR_MESSAGES = ("communications link failure", "is resuming after being auto-paused")
+
+
+class DataApiError(Exception):
+    """Raised when a Data API call fails and is not retried any further"""
+
+    def __init__(self, message, category):
+        super().__init__(message)
+        self.category = category
+
+
+def classify_error(error: Exception) -> str:
+    if isinstance(error, (ReadTimeoutError, ConnectTimeoutError, EndpointConnectionError)):
+        return TRANSIENT
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code", "")
+        message = error.response.get("Error", {}).get("Message", "").lower()
+        status_code = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        if code in RESUMING_ERROR_CODES or any(text in message for text in RESUMING_ERROR_MESSAGES):
+            return RESUMING
+        if code in THROTTLING_ERROR_CODES or status_code == 429:
+            return THROTTLING
+        if code == "StatementTimeoutException":
+            return STATEMENT_TIMEOUT
+        if code in TRANSIENT_ERROR_CODES or status_code >= 500:
+            return TRANSIENT
+    return CLIENT_ERROR
+
+
+class DataApiClient:
+    """
+    Wraps the rds-data calls used by the claims review functions. Retries stop when max_retry_seconds
+    have been spent on a call or, when a Lambda context is set, less than reserve_seconds of the
+    invocation remain. Statement timeouts are only retried outside of transactions, where the statement
+    has been rolled back, and not for statements that continue after the timeout.
+    """
+
+    def __init__(self, resource_arn: str, secret_arn: str, database: str, client=None,
+                 max_retry_seconds: float = 60, base_delay_seconds: float = 0.5, max_delay_seconds: float = 8,
+                 reserve_seconds: float = 5):
+        self.resource_arn = resource_arn
+        self.secret_arn = secret_arn
+        self.database = database
+        self.client = client or boto3.client("rds-data")
+        self.max_retry_seconds = max_retry_seconds
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.reserve_seconds = reserve_seconds
+        self.context = None
+
+    def set_context(self, context):
+        """Sets the Lambda context of the current invocation, retries then also stop before its timeout"""
+        self.context = context
+
+    def remaining_seconds(self, started_at: float) -> float:
+        remaining = self.max_retry_seconds - (time.monotonic() - started_at)
+        if self.context is not None:
+            remaining = min(remaining, self.context.get_remaining_time_in_millis() / 1000 - self.reserve_seconds)
+        return remaining
+
+    def call(self, operation: str, **kwargs):
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                return getattr(self.client, operation)(**kwargs)
+            except Exception as e:
+                category = classify_error(e)
+                retryable = category in (RESUMING, THROTTLING, TRANSIENT) or \
+                    (category == STATEMENT_TIMEOUT and "transactionId" not in kwargs and not kwargs.get("continueAfterTimeout"))
+                if not retryable:
+                    raise
+                delay = random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * (2 ** attempt)))
+                if delay >= self.remaining_seconds(started_at):
+                    raise DataApiError(f"{operation} failed after {attempt + 1} attempts: {e}", category) from e
+                attempt += 1
+                print(f"{operation} attempt {attempt} failed with {category}, retrying in {delay:.2f} seconds: {e}")
+                time.sleep(delay)
+
+    def execute_statement(self, sql: str, parameters: list = None, transaction_id: str = None,
+                          include_result_metadata: bool = True, continue_after_timeout: bool = False):
+        """
+        With continue_after_timeout, a statement that runs longer than the Data API call timeout keeps
+        running in the database and the call fails with a StatementTimeoutException that is not retried.
+        """
+        return self.call(
+            "execute_statement",
+            resourceArn=self.resource_arn,
+            secretArn=self.secret_arn,
+            database=self.database,
+            sql=sql,
+            includeResultMetadata=include_result_metadata,
+            parameters=parameters or [],
+            continueAfterTimeout=continue_after_timeout,
+            **({'transactionId': transaction_id} if transaction_id else {})
+        )
+
+    def batch_execute_statement(self, sql: str, parameter_sets: list, transaction_id: str = None):
+        return self.call(
+            "batch_execute_statement",
+            resourceArn=self.resource_arn,
+            secretArn=self.secret_arn,
+            database=self.database,
+            sql=sql,
+            parameterSets=parameter_sets,
+            **({'transactionId': transaction_id} if transaction_id else {})
+        )
+
+    def begin_transaction(self) -> str:
+        return self.call(
+            "begin_transaction",
+            resourceArn=self.resource_arn,
+            secretArn=self.secret_arn,
+            database=self.database
+        )["transactionId"]
+
+    def commit_transaction(self, transaction_id: str):
+        return self.call(
+            "commit_transaction",
+            resourceArn=self.resource_arn,
+            secretArn=self.secret_arn,
+            transactionId=transaction_id
+        )
+
+    def rollback_transaction(self, transaction_id: str):
+        return self.call(
+            "rollback_transaction",
+            resourceArn=self.resource_arn,
+            secretArn=self.secret_arn,
+            transactionId=transaction_id
+        )
+
+    def run_in_transaction(self, work):
+        """Calls work(transaction_id) in a transaction, committed if it returns and rolled back if it raises"""
+        transaction_id = self.begin_transaction()
+        try:
+            result = work(transaction_id)
+        except Exception:
+            self.rollback_transaction(transaction_id)
+            raise
+        self.commit_transaction(transaction_id)
+        return result
+
+    def ping(self) -> bool:
+        """
+        Sends a single SELECT 1 without retrying. A paused cluster starts resuming on the first call, so
+        this warms the database for statements that follow later. Returns whether the database answered.
+        """
+        try:
+            self.client.execute_statement(
+                resourceArn=self.resource_arn,
+                secretArn=self.secret_arn,
+                database=self.database,
+                sql="SELECT 1"
+            )
+            return True
+        except Exception as e:
+            print(f"Database ping: {classify_error(e)} {e}")
+            return False
@@ -0,0 +1,21 @@
+"""
+Purpose
+
+Version of the documents of a knowledge base data source: the id of its latest completed ingestion job.
+Caches of results derived from knowledge base retrievals include it in their keys, so they start over
+after every completed ingestion.
+"""
+
+NO_INGESTION_VERSION = "none"
+
+
+def latest_ingestion_job_id(bedrock_agent_client, knowledge_base_id: str, data_source_id: str) -> str:
+    """The id of the latest completed ingestion job of the data source, NO_INGESTION_VERSION before the first"""
+    jobs = bedrock_agent_client.list_ingestion_jobs(
+        knowledgeBaseId=knowledge_base_id,
+        dataSourceId=data_source_id,
+        filters=[{"attribute": "STATUS", "operator": "EQ", "values": ["COMPLETE"]}],
+        sortBy={"attribute": "STARTED_AT", "order": "DESCENDING"},
+        maxResults=1
+    )["ingestionJobSummaries"]
+    return jobs[0]["ingestionJobId"] if jobs else NO_INGESTION_VERSION
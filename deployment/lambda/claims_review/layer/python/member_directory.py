@@ -0,0 +1,115 @@
+"""
+Purpose
+
+Member directory snapshot: the insured members and their patients exported from the claims database
+into a sorted snapshot in S3, keyed by insured policy number, patient last name and patient birth date.
+The export job writes a new snapshot file and then the manifest pointing at it; the agent actions
+download the snapshot once per version and look members up without a database round trip.
+"""
+
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+from sorted_snapshot import SortedSnapshot
+
+SNAPSHOT_PREFIX = "member_snapshots"
+MANIFEST_KEY = f"{SNAPSHOT_PREFIX}/manifest.json"
+KEY_SEPARATOR = "\x1f"
+
+# Same columns as the member and patient details lookup of the agent actions
+EXPORT_QUERY = """
+    SELECT
+    i.insured_id,i.insured_name,i.insured_group_number,i.insured_plan_name,i.insured_birth_date,i.insured_policy_number,i.address insured_address,i.phone_number insured_phone_number,
+    p.patient_id,p.patient_firstname,p.patient_lastname,p.patient_birth_date,p.relationship_to_insured,p.phone_number patient_phone_number,p.sex patient_sex,p.address patient_address
+    FROM Patient p, Insured_Person i WHERE i.insured_id = p.insured_id AND p.patient_id > :last_patient_id
+    ORDER BY p.patient_id LIMIT :page_size
+"""
+
+
+def member_key(insured_policy_number: str, patient_lastname: str, patient_birth_date: str) -> str:
+    """Matches the equality conditions of the SQL lookup, so a snapshot hit returns the same row"""
+    return KEY_SEPARATOR.join((insured_policy_number, patient_lastname, patient_birth_date))
+
+
+def snapshot_key(version: str) -> str:
+    return f"{SNAPSHOT_PREFIX}/{version}.snap"
+
+
+def new_version() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+class MemberDirectory:
+    """
+    Serves lookups from the latest snapshot of the manifest. The manifest is checked at most every
+    refresh_seconds and a new version is downloaded to /tmp when it changes. lookup() returns None when
+    the member is not in the snapshot, or when there is no snapshot younger than max_age_seconds, so the
+    caller falls back to the database.
+    """
+
+    def __init__(self, s3_client, json_cache, bucket: str, max_age_seconds: float, refresh_seconds: float = 60,
+                 download_directory: str = "/tmp", manifest_max_age_seconds: float = 0):
+        self.s3_client = s3_client
+        self.json_cache = json_cache
+        self.bucket = bucket
+        self.max_age_seconds = max_age_seconds
+        self.refresh_seconds = refresh_seconds
+        # the manifest is replaced by every export, its cache entry is revalidated on each check by default
+        self.manifest_max_age_seconds = manifest_max_age_seconds
+        self.download_directory = download_directory
+        self.snapshot = None
+        self.version = None
+        self.created_at = None
+        self.checked_at = None
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.refresh_seconds:
+            return
+        self.checked_at = now
+        try:
+            manifest = self.json_cache.get_json(f"s3://{self.bucket}/{MANIFEST_KEY}",
+                                                max_age_seconds=self.manifest_max_age_seconds)
+        except Exception as e:
+            print(f"Unable to read the member snapshot manifest: {e}")
+            return
+        if manifest.get("version") == self.version:
+            return
+        path = os.path.join(self.download_directory, os.path.basename(manifest["key"]))
+        try:
+            self.s3_client.download_file(self.bucket, manifest["key"], path)
+            snapshot = SortedSnapshot(path)
+        except Exception as e:
+            print(f"Unable to load member snapshot {manifest.get('version')}: {e}")
+            return
+        previous = self.snapshot
+        self.snapshot, self.version, self.created_at = snapshot, manifest["version"], manifest["created_at"]
+        print(f"Loaded member snapshot {self.version} with {len(snapshot)} members")
+        if previous is not None:
+            previous.close()
+            os.remove(previous.path)
+
+    def is_fresh(self) -> bool:
+        return self.snapshot is not None and time.time() - self.created_at <= self.max_age_seconds
+
+    def lookup(self, insured_policy_number: str, patient_lastname: str, patient_birth_date: str):
+        self.refresh()
+        if not self.is_fresh():
+            return None
+        return self.snapshot.get(member_key(insured_policy_number, patient_lastname, patient_birth_date))
+
+
+def write_manifest(s3_client, bucket: str, version: str, record_count: int, created_at: float):
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=MANIFEST_KEY,
+        Body=json.dumps({
+            "version": version,
+            "key": snapshot_key(version),
+            "record_count": record_count,
+            "created_at": created_at
+        }),
+        ContentType="application/json"
+    )
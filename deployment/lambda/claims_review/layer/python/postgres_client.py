@@ -0,0 +1,200 @@
+"""
+Purpose
+
+PostgreSQL client for the claims database that uses the pg8000 driver over a connection held for the
+lifetime of the Lambda container, directly or through an RDS Proxy. It exposes the interface of
+DataApiClient: statements use the same :name placeholders, parameters are passed in the Data API format
+and results are returned as Data API columnMetadata/records, so the callers work with either client.
+"""
+
+import datetime
+import decimal
+import json
+import ssl
+import threading
+import uuid
+
+import boto3
+import pg8000.exceptions
+import pg8000.native
+
+
+def parameter_value(value: dict):
+    """Converts a Data API typed parameter value, e.g. {'stringValue': 'x'}, to a Python value"""
+    if value.get("isNull"):
+        return None
+    for key in ("stringValue", "longValue", "doubleValue", "booleanValue"):
+        if key in value:
+            return value[key]
+    raise ValueError(f"Unsupported parameter value: {value}")
+
+
+def field_value(value) -> dict:
+    """Converts a Python value to a Data API field, with the formats the Data API returns"""
+    if value is None:
+        return {"isNull": True}
+    if isinstance(value, bool):
+        return {"booleanValue": value}
+    if isinstance(value, int):
+        return {"longValue": value}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, datetime.datetime):
+        return {"stringValue": value.strftime("%Y-%m-%d %H:%M:%S")}
+    if isinstance(value, (datetime.date, decimal.Decimal)):
+        return {"stringValue": str(value)}
+    return {"stringValue": str(value)}
+
+
+def get_credentials(secret_arn: str) -> dict:
+    """Reads the username and password from the database cluster secret"""
+    secret = boto3.client("secretsmanager").get_secret_value(SecretId=secret_arn)
+    return json.loads(secret["SecretString"])
+
+
+class PostgresClient:
+    """
+    Connects lazily and reconnects after a connection error outside of a transaction. A client is used by
+    one invocation at a time, calls from several threads are serialized. Transactions run on the held
+    connection, the transaction id only identifies them to the callers.
+    """
+
+    def __init__(self, host: str, port: int, database: str, secret_arn: str = None, ca_bundle: str = None,
+                 connect_timeout_seconds: float = 10, credentials: dict = None, use_tls: bool = True,
+                 verify_certificate: bool = True):
+        self.host = host
+        self.port = port
+        self.database = database
+        self.secret_arn = secret_arn
+        # username and password, read from the secret when not given
+        self.credentials = credentials
+        self.ca_bundle = ca_bundle
+        self.use_tls = use_tls
+        self.verify_certificate = verify_certificate
+        self.connect_timeout_seconds = connect_timeout_seconds
+        self.connection = None
+        self.transaction_id = None
+        self.lock = threading.RLock()
+
+    def set_context(self, context):
+        """Accepted for compatibility with DataApiClient, statements are not retried"""
+        pass
+
+    def ssl_context(self):
+        if not self.use_tls:
+            return None
+        # the RDS CA bundle verifies cluster and instance endpoints, RDS Proxy endpoints have certificates of
+        # a public certificate authority of the default trust store
+        context = ssl.create_default_context()
+        if self.ca_bundle:
+            context.load_verify_locations(cafile=self.ca_bundle)
+        if not self.verify_certificate:
+            # encrypted without certificate verification, only when explicitly opted out
+            print(f"Connecting to {self.host} without verifying its certificate")
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    def connect(self):
+        credentials = self.credentials or get_credentials(self.secret_arn)
+        return pg8000.native.Connection(
+            user=credentials["username"],
+            password=credentials["password"],
+            host=self.host,
+            port=self.port,
+            database=self.database,
+            ssl_context=self.ssl_context(),
+            timeout=self.connect_timeout_seconds
+        )
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                try:
+                    self.connection.close()
+                except Exception:
+                    pass
+                self.connection = None
+                self.transaction_id = None
+
+    def run(self, sql: str, parameters: dict):
+        with self.lock:
+            reconnected = self.connection is None
+            if self.connection is None:
+                self.connection = self.connect()
+            try:
+                return self.execute(sql, parameters)
+            except (pg8000.exceptions.InterfaceError, OSError):
+                # a connection kept from an earlier invocation may have been closed by the server
+                in_transaction = self.transaction_id is not None
+                self.close()
+                if reconnected or in_transaction:
+                    raise
+                self.connection = self.connect()
+                return self.execute(sql, parameters)
+
+    def execute(self, sql: str, parameters: dict):
+        rows = self.connection.run(sql, **parameters)
+        return rows, self.connection.columns, max(self.connection.row_count, 0)
+
+    def execute_statement(self, sql: str, parameters: list = None, transaction_id: str = None,
+                          include_result_metadata: bool = True, continue_after_timeout: bool = False):
+        """Statements run to completion, continue_after_timeout is accepted for compatibility with DataApiClient"""
+        rows, columns, row_count = self.run(sql, {
+            parameter["name"]: parameter_value(parameter["value"]) for parameter in parameters or []
+        })
+        result = {
+            "records": [[field_value(value) for value in row] for row in rows or []],
+            "numberOfRecordsUpdated": row_count
+        }
+        if include_result_metadata:
+            result["columnMetadata"] = [{"name": column["name"]} for column in columns or []]
+        return result
+
+    def batch_execute_statement(self, sql: str, parameter_sets: list, transaction_id: str = None):
+        for parameters in parameter_sets:
+            self.execute_statement(sql, parameters=parameters, include_result_metadata=False)
+        return {"updateResults": [{"generatedFields": []} for _ in parameter_sets]}
+
+    def begin_transaction(self) -> str:
+        with self.lock:
+            self.run("BEGIN", {})
+            self.transaction_id = str(uuid.uuid4())
+            return self.transaction_id
+
+    def commit_transaction(self, transaction_id: str):
+        with self.lock:
+            self.run("COMMIT", {})
+            self.transaction_id = None
+            return {"transactionStatus": "Transaction Committed"}
+
+    def rollback_transaction(self, transaction_id: str):
+        with self.lock:
+            try:
+                if self.connection is not None:
+                    self.run("ROLLBACK", {})
+            except Exception as e:
+                print(f"Rollback failed, closing the connection: {e}")
+                self.close()
+            self.transaction_id = None
+            return {"transactionStatus": "Rollback Complete"}
+
+    def run_in_transaction(self, work):
+        """Calls work(transaction_id) in a transaction, committed if it returns and rolled back if it raises"""
+        with self.lock:
+            transaction_id = self.begin_transaction()
+            try:
+                result = work(transaction_id)
+            except Exception:
+                self.rollback_transaction(transaction_id)
+                raise
+            self.commit_transaction(transaction_id)
+            return result
+
+    def ping(self) -> bool:
+        try:
+            self.execute_statement("SELECT 1")
+            return True
+        except Exception as e:
+            print(f"Database ping: {e}")
+            return False
@@ -0,0 +1,139 @@
+"""
+Purpose
+
+Compact, immutable key/value snapshot files with keys stored in sorted order. A snapshot is written
+once, by an export job, and read through mmap: a lookup is a binary search over the offset table and
+only touches the pages of the records it compares, so a Lambda container can serve lookups over
+millions of records without reading the whole file into memory.
+
+File layout (little endian):
+    magic         8 bytes   b"CSNAP001"
+    record_count  uint32
+    metadata_len  uint32
+    metadata      metadata_len bytes of JSON
+    offsets       (record_count + 1) x uint64, record offsets relative to the start of the records
+    records       per record: key_len uint16, key bytes (UTF-8), value bytes (JSON, UTF-8)
+"""
+
+import json
+import mmap
+import struct
+
+MAGIC = b"CSNAP001"
+HEADER = struct.Struct("<8sII")
+OFFSET = struct.Struct("<Q")
+KEY_LENGTH = struct.Struct("<H")
+
+
+class SnapshotFormatError(Exception):
+    """Raised when a file is not a snapshot in the expected format"""
+    pass
+
+
+def encode_key(key) -> bytes:
+    return key if isinstance(key, bytes) else str(key).encode("utf-8")
+
+
+def write_snapshot(path: str, records, metadata: dict = None) -> int:
+    """
+    Writes the (key, value) records to path, values must be JSON serializable. When a key occurs more
+    than once the last record wins. Returns the number of records written.
+    """
+    entries = {}
+    for key, value in records:
+        entries[encode_key(key)] = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    keys = sorted(entries)
+    metadata_bytes = json.dumps(metadata or {}, separators=(",", ":")).encode("utf-8")
+
+    offsets = []
+    position = 0
+    for key in keys:
+        offsets.append(position)
+        position += KEY_LENGTH.size + len(key) + len(entries[key])
+    offsets.append(position)
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(keys), len(metadata_bytes)))
+        f.write(metadata_bytes)
+        for offset in offsets:
+            f.write(OFFSET.pack(offset))
+        for key in keys:
+            f.write(KEY_LENGTH.pack(len(key)))
+            f.write(key)
+            f.write(entries[key])
+    return len(keys)
+
+
+class SortedSnapshot:
+    """Read only view of a snapshot file, lookups are O(log n)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise SnapshotFormatError(f"Empty snapshot file: {path}")
+        magic, self.record_count, metadata_length = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            self.close()
+            raise SnapshotFormatError(f"Not a snapshot file: {path}")
+        self.metadata = json.loads(self.buffer[HEADER.size:HEADER.size + metadata_length])
+        self.offsets_start = HEADER.size + metadata_length
+        self.records_start = self.offsets_start + (self.record_count + 1) * OFFSET.size
+
+    def __len__(self):
+        return self.record_count
+
+    def offset(self, index: int) -> int:
+        return self.records_start + OFFSET.unpack_from(self.buffer, self.offsets_start + index * OFFSET.size)[0]
+
+    def key_at(self, index: int) -> bytes:
+        start = self.offset(index)
+        key_length = KEY_LENGTH.unpack_from(self.buffer, start)[0]
+        return self.buffer[start + KEY_LENGTH.size:start + KEY_LENGTH.size + key_length]
+
+    def value_at(self, index: int):
+        start = self.offset(index)
+        key_length = KEY_LENGTH.unpack_from(self.buffer, start)[0]
+        return json.loads(self.buffer[start + KEY_LENGTH.size + key_length:self.offset(index + 1)])
+
+    def bisect_left(self, key) -> int:
+        """Index of the first key not less than key, record_count when all keys are less"""
+        key = encode_key(key)
+        low, high = 0, self.record_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, key) -> int:
+        """Index of the key, or -1"""
+        key = encode_key(key)
+        index = self.bisect_left(key)
+        return index if index < self.record_count and self.key_at(index) == key else -1
+
+    def prefix_range(self, prefix, limit: int = None) -> range:
+        """
+        Indexes of the keys starting with prefix, at most limit of them. Keys sharing a prefix are adjacent
+        in the sorted order, so only the records of the range are read after the binary search.
+        """
+        prefix = encode_key(prefix)
+        start = self.bisect_left(prefix)
+        end = start
+        while end < self.record_count and (limit is None or end - start < limit) \
+                and self.key_at(end).startswith(prefix):
+            end += 1
+        return range(start, end)
+
+    def get(self, key, default=None):
+        index = self.find(key)
+        return self.value_at(index) if index >= 0 else default
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
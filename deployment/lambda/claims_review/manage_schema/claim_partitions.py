@@ -0,0 +1,182 @@
+"""
+Purpose
+
+Monthly range partitions of the CLAIM and SERVICE tables on claim_date. SERVICE is partitioned with the same
+bounds as CLAIM and carries the claim_date of its claim, so the service lines of a claim are in the partition
+of the claim's month and queries bounded by claim date only scan the partitions of those months. Rows with a
+claim date outside of the created partitions go to the DEFAULT partition of each table.
+"""
+
+from datetime import date
+
+PARTITIONED_TABLES = ("claim", "service")
+
+TABLE_KIND_QUERY = "SELECT relkind FROM pg_class WHERE oid = to_regclass(:table_name)"
+
+DEFAULT_PARTITION_ROWS_QUERY = """
+    SELECT EXISTS (SELECT 1 FROM {table}_default WHERE claim_date >= CAST(:start AS DATE) AND claim_date < CAST(:end AS DATE))
+"""
+
+# Tables created before partitioning are renamed, recreated as partitioned tables with the same columns, and
+# copied over. The id sequences are kept so existing claim ids stay valid.
+CONVERSION_STATEMENTS = [
+    "ALTER TABLE service RENAME TO service_unpartitioned",
+    "ALTER TABLE claim RENAME TO claim_unpartitioned",
+    "ALTER INDEX claim_pkey RENAME TO claim_unpartitioned_pkey",
+    "ALTER INDEX IF EXISTS claim_claim_reference_id_key RENAME TO claim_unpartitioned_claim_reference_id_key",
+    "ALTER INDEX service_pkey RENAME TO service_unpartitioned_pkey",
+    "ALTER INDEX IF EXISTS service_claim_id_line_number_key RENAME TO service_unpartitioned_claim_id_line_number_key",
+    "ALTER SEQUENCE claim_claim_id_seq OWNED BY NONE",
+    "ALTER SEQUENCE service_service_id_seq OWNED BY NONE",
+    """
+    CREATE TABLE claim (
+        LIKE claim_unpartitioned INCLUDING DEFAULTS,
+        CONSTRAINT claim_pkey PRIMARY KEY (claim_id, claim_date),
+        CONSTRAINT claim_claim_reference_id_key UNIQUE (claim_reference_id, claim_date),
+        FOREIGN KEY (patient_id) REFERENCES patient(patient_id)
+    ) PARTITION BY RANGE (claim_date)
+    """,
+    """
+    CREATE TABLE service (
+        LIKE service_unpartitioned INCLUDING DEFAULTS,
+        claim_date DATE NOT NULL,
+        CONSTRAINT service_pkey PRIMARY KEY (service_id, claim_date),
+        CONSTRAINT service_claim_id_line_number_key UNIQUE (claim_id, claim_date, line_number),
+        FOREIGN KEY (claim_id, claim_date) REFERENCES claim(claim_id, claim_date)
+    ) PARTITION BY RANGE (claim_date)
+    """,
+    "CREATE TABLE claim_default PARTITION OF claim DEFAULT",
+    "CREATE TABLE service_default PARTITION OF service DEFAULT",
+    "CREATE INDEX claim_patient_id_claim_date_idx ON claim (patient_id, claim_date DESC)",
+]
+
+CONVERSION_MONTHS_QUERY = """
+    SELECT DISTINCT TO_CHAR(date_trunc('month', claim_date), 'YYYY-MM-DD') AS month FROM claim_unpartitioned ORDER BY 1
+"""
+
+# The rows are copied one month at a time, each statement has to finish within the 45 second statement timeout
+# of the Data API, so the conversion is limited by the largest month. The indexes find the rows of a month.
+COPY_INDEX_STATEMENTS = [
+    "CREATE INDEX claim_unpartitioned_claim_date_idx ON claim_unpartitioned (claim_date)",
+    "CREATE INDEX service_unpartitioned_claim_id_idx ON service_unpartitioned (claim_id)",
+]
+
+COPY_MONTH_STATEMENTS = [
+    """
+    INSERT INTO claim SELECT * FROM claim_unpartitioned
+    WHERE claim_date >= CAST(:start AS DATE) AND claim_date < CAST(:end AS DATE)
+    """,
+    """
+    INSERT INTO service SELECT s.*, c.claim_date FROM service_unpartitioned s JOIN claim_unpartitioned c ON c.claim_id = s.claim_id
+    WHERE c.claim_date >= CAST(:start AS DATE) AND c.claim_date < CAST(:end AS DATE)
+    """,
+]
+
+COPY_STATEMENTS = [
+    "DROP TABLE service_unpartitioned",
+    "DROP TABLE claim_unpartitioned",
+    "ALTER SEQUENCE claim_claim_id_seq OWNED BY claim.claim_id",
+    "ALTER SEQUENCE service_service_id_seq OWNED BY service.service_id",
+]
+
+
+def string_param(name: str, value: str) -> dict:
+    return {"name": name, "value": {"stringValue": value}}
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    years, month_index = divmod(month.month - 1 + months, 12)
+    return date(month.year + years, month_index + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+
+def table_kind(client, table: str, transaction_id: str = None):
+    """'p' for a partitioned table, 'r' for a plain table, None when it does not exist"""
+    result = client.execute_statement(TABLE_KIND_QUERY, parameters=[string_param("table_name", table)],
+                                      transaction_id=transaction_id)
+    return result["records"][0][0].get("stringValue") if result["records"] else None
+
+
+def default_partition_has_rows(client, table: str, start: date, end: date, transaction_id: str = None) -> bool:
+    result = client.execute_statement(
+        DEFAULT_PARTITION_ROWS_QUERY.format(table=table),
+        parameters=[string_param("start", start.isoformat()), string_param("end", end.isoformat())],
+        transaction_id=transaction_id
+    )
+    return result["records"][0][0]["booleanValue"]
+
+
+def create_month_partitions(client, month: date, transaction_id: str = None) -> list:
+    """
+    Creates the partitions of the month that do not exist yet and returns their names. A partition is not
+    created while the DEFAULT partition holds rows of its month, PostgreSQL would reject it.
+    """
+    end = add_months(month, 1)
+    created = []
+    for table in PARTITIONED_TABLES:
+        name = partition_name(table, month)
+        if table_kind(client, name, transaction_id) is not None:
+            continue
+        if default_partition_has_rows(client, table, month, end, transaction_id):
+            print(f"Not creating partition {name}, {table}_default has rows from {month} to {end}")
+            continue
+        client.execute_statement(
+            f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')",
+            transaction_id=transaction_id
+        )
+        created.append(name)
+    return created
+
+
+def ensure_partitions(client, months_ahead: int = 3, months_back: int = 0, today: date = None) -> list:
+    """Creates the monthly partitions from months_back months ago to months_ahead months ahead"""
+    if table_kind(client, "claim") != "p":
+        print("The claim table is not partitioned, no partitions created")
+        return []
+    current_month = month_start(today or date.today())
+    created = []
+    for offset in range(-months_back, months_ahead + 1):
+        created += create_month_partitions(client, add_months(current_month, offset))
+    print(f"Created partitions: {created}")
+    return created
+
+
+def convert_to_partitioned(client) -> bool:
+    """
+    Converts the CLAIM and SERVICE tables of a database created before partitioning, in one transaction.
+    Partitions are created for every month with claims and the rows are copied month by month, each
+    statement copies one month. Returns False when the tables are partitioned already.
+    """
+    if table_kind(client, "claim") != "r":
+        return False
+
+    def convert(transaction_id):
+        for statement in CONVERSION_STATEMENTS:
+            print(f"Executing statement: {statement}")
+            client.execute_statement(statement, transaction_id=transaction_id)
+        result = client.execute_statement(CONVERSION_MONTHS_QUERY, transaction_id=transaction_id)
+        months = [date.fromisoformat(record[0]["stringValue"]) for record in result["records"]]
+        for month in months:
+            create_month_partitions(client, month, transaction_id)
+        for statement in COPY_INDEX_STATEMENTS:
+            print(f"Executing statement: {statement}")
+            client.execute_statement(statement, transaction_id=transaction_id)
+        for month in months:
+            parameters = [string_param("start", month.isoformat()), string_param("end", add_months(month, 1).isoformat())]
+            for statement in COPY_MONTH_STATEMENTS:
+                client.execute_statement(statement, parameters=parameters, transaction_id=transaction_id)
+            print(f"Copied the claims and service lines of {month:%Y-%m}")
+        for statement in COPY_STATEMENTS:
+            print(f"Executing statement: {statement}")
+            client.execute_statement(statement, transaction_id=transaction_id)
+
+    client.run_in_transaction(convert)
+    print("Converted the claim and service tables to partitioned tables")
+    return True
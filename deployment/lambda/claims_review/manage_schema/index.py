@@ -1,73 +1,127 @@
-import boto3
-import os
-import json
-
-rds_data_client = boto3.client('rds-data')
-s3_client = boto3.client('s3')
-cluster_arn = os.environ['CLUSTER_ARN']
-secret_arn = os.environ['SECRET_ARN']
-database_name = os.environ['DATABASE_NAME']
-create_schema_sql_file = os.environ['CREATE_SCHEMA_FILE']
-delete_schema_sql_file = os.environ['DELETE_SCHEMA_FILE']
-update_schema_sql_file = os.environ.get('UPDATE_SCHEMA_FILE',None)
-initial_data_sql_file = os.environ.get('INITIAL_DATA_FILE', None)
-
-def handler(event, context):
-    
-    print(event)
-    request_type = event['RequestType']
-    match request_type:
-        case 'Create':
-            execute(create_schema_sql_file)
-            if initial_data_sql_file:
-                execute(initial_data_sql_file)
-        case 'Update':
-            if update_schema_sql_file:
-                execute(update_schema_sql_file)
-        case 'Delete':
-            execute(delete_schema_sql_file)
-        case _:
-          raise ValueError(f"Invalid request type: {request_type}")
-    
-
-    return {
-        'statusCode': 200,
-        'body': json.dumps(f'Successfully executed {request_type} operation')
-    }
-
-def execute(sql_file_path:str):
-    """Create the schema in the database."""
-
-    # Download SQL script from S3
-    bucket_name, key_name = parse_s3_url(sql_file_path)
-    
-    sql_script = download_sql_script(bucket_name, key_name)
-    
-    # Split script into individual statements and execute each one
-    statements = sql_script.split(';')
-    
-    for statement in statements:
-        if statement.strip():
-            # Execute each statement
-            print(f"Executing statement: {statement}")
-            execute_statement(cluster_arn, secret_arn, database_name, statement)
-
-def parse_s3_url(s3_url):
-    """Parse S3 URL into bucket name and key."""
-    s3_url_parts = s3_url.replace("s3://", "").split("/", 1)
-    return s3_url_parts[0], s3_url_parts[1]
-
-def download_sql_script(bucket_name, key_name):
-    """Download SQL script from S3."""
-    response = s3_client.get_object(Bucket=bucket_name, Key=key_name)
-    return response['Body'].read().decode('utf-8')
-
-def execute_statement(cluster_arn, secret_arn, database_name, sql_statement):
-    """Execute a single SQL statement using RDS Data API."""
-    response = rds_data_client.execute_statement(
-        resourceArn=cluster_arn,
-        secretArn=secret_arn,
-        database=database_name,
-        sql=sql_statement
-    )
-
+import boto3
+import os
+import json
+from data_api_client import DataApiClient
+from claim_partitions import ensure_partitions, convert_to_partitioned
+from sql_script import split_statements
+from roster_loader import RosterLoader, read_roster, roster_keys
+from migrations import MigrationRunner, read_migrations_archive
+
+s3_client = boto3.client('s3')
+cluster_arn = os.environ['CLUSTER_ARN']
+secret_arn = os.environ['SECRET_ARN']
+database_name = os.environ['DATABASE_NAME']
+# A newly created or idle cluster may still be resuming when the schema is applied
+data_api = DataApiClient(cluster_arn, secret_arn, database_name,
+                         max_retry_seconds=float(os.environ.get('DATA_API_MAX_RETRY_SECONDS', '120')))
+create_schema_sql_file = os.environ['CREATE_SCHEMA_FILE']
+delete_schema_sql_file = os.environ['DELETE_SCHEMA_FILE']
+# Zip archive of the numbered migration files, see schemas/migrations
+migrations_archive = os.environ.get('MIGRATIONS_ARCHIVE', None)
+initial_data_sql_file = os.environ.get('INITIAL_DATA_FILE', None)
+# Monthly claim partitions are created this many months ahead, on deployment and by a daily schedule
+partition_months_ahead = int(os.environ.get('PARTITION_MONTHS_AHEAD', '3'))
+# Member roster files (CSV or Parquet) loaded after the schema is created, an S3 URI of a file or prefix
+roster_uri = os.environ.get('ROSTER_URI', None)
+# The load_roster action only reads files under these URIs, the function has no read access to other objects
+roster_allowed_uris = json.loads(os.environ.get('ROSTER_ALLOWED_URIS', '[]'))
+roster_batch_size = int(os.environ.get('ROSTER_BATCH_SIZE', '500'))
+roster_parallelism = int(os.environ.get('ROSTER_PARALLELISM', '8'))
+
+def handler(event, context):
+    
+    print(event)
+    data_api.set_context(context)
+    if event.get('action') == 'ensure_partitions':
+        created = ensure_partitions(data_api, months_ahead=partition_months_ahead)
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'created_partitions': created})
+        }
+    if event.get('action') == 'load_roster':
+        return {
+            'statusCode': 200,
+            'body': json.dumps(load_roster(event.get('uri', roster_uri)))
+        }
+    request_type = event['RequestType']
+    match request_type:
+        case 'Create':
+            execute(create_schema_sql_file)
+            if initial_data_sql_file:
+                execute(initial_data_sql_file)
+            if roster_uri:
+                load_roster(roster_uri)
+            # the create script is the latest schema, the migrations are recorded without running them
+            if migrations_archive:
+                MigrationRunner(data_api).baseline(read_migrations(migrations_archive))
+            ensure_partitions(data_api, months_ahead=partition_months_ahead)
+        case 'Update':
+            if migrations_archive:
+                MigrationRunner(data_api).apply(read_migrations(migrations_archive))
+            # CLAIM and SERVICE tables of databases created before partitioning are converted once
+            convert_to_partitioned(data_api)
+            ensure_partitions(data_api, months_ahead=partition_months_ahead)
+        case 'Delete':
+            execute(delete_schema_sql_file)
+        case _:
+          raise ValueError(f"Invalid request type: {request_type}")
+    
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f'Successfully executed {request_type} operation')
+    }
+
+def execute(sql_file_path:str):
+    """Runs the statements of a SQL script in one transaction, the script is applied completely or not at all."""
+
+    # Download SQL script from S3
+    bucket_name, key_name = parse_s3_url(sql_file_path)
+    
+    sql_script = download_sql_script(bucket_name, key_name)
+    
+    # Split script into individual statements and execute each one
+    statements = split_statements(sql_script)
+
+    def execute_script(transaction_id):
+        for statement in statements:
+            # Execute each statement
+            print(f"Executing statement: {statement}")
+            execute_statement(statement, transaction_id)
+
+    data_api.run_in_transaction(execute_script)
+
+def load_roster(uri: str) -> dict:
+    """Loads the roster file, or every CSV and Parquet file under the prefix, and returns the load totals."""
+    if not uri:
+        raise ValueError("No roster URI given and ROSTER_URI is not set")
+    if not any(uri.startswith(allowed_uri) for allowed_uri in roster_allowed_uris):
+        raise ValueError(f"Roster URI {uri} is not under the roster URI or allowed_uris of database.roster in cdk.json: "
+                         f"{roster_allowed_uris}")
+    bucket_name, prefix = parse_s3_url(uri)
+    totals = {}
+    loader = RosterLoader([data_api] * roster_parallelism, batch_size=roster_batch_size)
+    for key in roster_keys(s3_client, bucket_name, prefix):
+        print(f"Loading roster s3://{bucket_name}/{key}")
+        totals[key] = loader.load(read_roster(s3_client, bucket_name, key))
+    return totals
+
+def read_migrations(archive_url: str) -> list:
+    bucket_name, key_name = parse_s3_url(archive_url)
+    response = s3_client.get_object(Bucket=bucket_name, Key=key_name)
+    return read_migrations_archive(response['Body'].read())
+
+def parse_s3_url(s3_url):
+    """Parse S3 URL into bucket name and key."""
+    s3_url_parts = s3_url.replace("s3://", "").split("/", 1)
+    return s3_url_parts[0], s3_url_parts[1]
+
+def download_sql_script(bucket_name, key_name):
+    """Download SQL script from S3."""
+    response = s3_client.get_object(Bucket=bucket_name, Key=key_name)
+    return response['Body'].read().decode('utf-8')
+
+def execute_statement(sql_statement, transaction_id=None):
+    """Execute a single SQL statement using RDS Data API."""
+    response = data_api.execute_statement(sql_statement, transaction_id=transaction_id, include_result_metadata=False)
+
@@ -0,0 +1,190 @@
+"""
+Purpose
+
+Versioned schema migrations. A migration is a SQL file named <version>_<description>.sql. Migrations are
+applied in version order and recorded in the SCHEMA_MIGRATIONS ledger with the SHA-256 checksum of the file.
+Applied migrations are skipped, so applying an unchanged set of migrations only reads the ledger, and a
+migration that was changed after it was applied fails the run.
+
+A migration runs in one transaction together with its ledger entry. A migration with the line
+"-- migration: no-transaction" runs statement by statement outside of a transaction, for statements such as
+CREATE INDEX CONCURRENTLY that build indexes without blocking writes to the table. Such a migration is only
+recorded once all of its statements succeed, its statements must be safe to run again after a failure.
+"""
+
+import hashlib
+import io
+import os
+import re
+import time
+import zipfile
+from collections import namedtuple
+
+from data_api_client import classify_error, STATEMENT_TIMEOUT
+from sql_script import split_statements
+
+MIGRATION_FILE_NAME = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+NO_TRANSACTION_MARKER = re.compile(r"^--\s*migration:\s*no-transaction\s*$", re.MULTILINE)
+
+CREATE_LEDGER_STATEMENT = """
+    CREATE TABLE IF NOT EXISTS SCHEMA_MIGRATIONS (
+        version INT PRIMARY KEY,
+        name VARCHAR(200) NOT NULL,
+        checksum CHAR(64) NOT NULL,
+        applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+        execution_milliseconds INT,
+        baseline BOOLEAN NOT NULL DEFAULT FALSE
+    )
+"""
+
+APPLIED_MIGRATIONS_QUERY = "SELECT version, checksum FROM SCHEMA_MIGRATIONS ORDER BY version"
+
+RECORD_MIGRATION_STATEMENT = """
+    INSERT INTO SCHEMA_MIGRATIONS (version, name, checksum, execution_milliseconds, baseline)
+    VALUES (:version, :name, :checksum, :execution_milliseconds, :baseline)
+"""
+
+# A statement that outlived its Data API call is still listed as active until it completes
+RUNNING_STATEMENT_QUERY = """
+    SELECT COUNT(*) FROM pg_stat_activity WHERE state = 'active' AND pid <> pg_backend_pid() AND LEFT(query, 200) = LEFT(:sql, 200)
+"""
+
+# A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind
+INVALID_INDEXES_QUERY = """
+    SELECT CAST(indexrelid::regclass AS TEXT) FROM pg_index WHERE NOT indisvalid
+"""
+
+Migration = namedtuple("Migration", ["version", "name", "script", "checksum", "transactional"])
+
+
+class MigrationError(Exception):
+    """Raised for migration files that cannot be applied, or that differ from the applied ones"""
+    pass
+
+
+def parse_migration(file_name: str, script: str) -> Migration:
+    match = MIGRATION_FILE_NAME.match(file_name)
+    if not match:
+        raise MigrationError(f"Migration file names must look like 0001_description.sql: {file_name}")
+    return Migration(
+        version=int(match.group(1)),
+        name=file_name,
+        script=script,
+        checksum=hashlib.sha256(script.encode("utf-8")).hexdigest(),
+        transactional=NO_TRANSACTION_MARKER.search(script) is None
+    )
+
+
+def sorted_migrations(scripts: dict) -> list:
+    """Migrations of the {file name: script} mapping in version order"""
+    migrations = sorted((parse_migration(name, script) for name, script in scripts.items()), key=lambda m: m.version)
+    for previous, migration in zip(migrations, migrations[1:]):
+        if previous.version == migration.version:
+            raise MigrationError(f"Migrations {previous.name} and {migration.name} have the same version")
+    return migrations
+
+
+def read_migrations_archive(data: bytes) -> list:
+    """Migrations of a zip archive, such as the S3 asset of the migrations directory"""
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        return sorted_migrations({
+            os.path.basename(name): archive.read(name).decode("utf-8")
+            for name in archive.namelist() if name.endswith(".sql")
+        })
+
+
+def read_migrations_directory(path: str) -> list:
+    scripts = {}
+    for name in os.listdir(path):
+        if name.endswith(".sql"):
+            with open(os.path.join(path, name)) as f:
+                scripts[name] = f.read()
+    return sorted_migrations(scripts)
+
+
+class MigrationRunner:
+
+    def __init__(self, client, statement_poll_seconds: float = 5):
+        self.client = client
+        self.statement_poll_seconds = statement_poll_seconds
+
+    def ensure_ledger(self):
+        self.client.execute_statement(CREATE_LEDGER_STATEMENT)
+
+    def applied_checksums(self) -> dict:
+        result = self.client.execute_statement(APPLIED_MIGRATIONS_QUERY)
+        return {record[0]["longValue"]: record[1]["stringValue"] for record in result["records"]}
+
+    def pending(self, migrations: list) -> list:
+        """Migrations not applied yet, after checking that the applied ones are unchanged"""
+        applied = self.applied_checksums()
+        for migration in migrations:
+            if migration.version in applied and applied[migration.version] != migration.checksum:
+                raise MigrationError(f"Migration {migration.name} was changed after it was applied, "
+                                     f"add a new migration instead")
+        return [migration for migration in migrations if migration.version not in applied]
+
+    def record(self, migration: Migration, execution_milliseconds: int, baseline: bool = False, transaction_id: str = None):
+        self.client.execute_statement(RECORD_MIGRATION_STATEMENT, parameters=[
+            {"name": "version", "value": {"longValue": migration.version}},
+            {"name": "name", "value": {"stringValue": migration.name}},
+            {"name": "checksum", "value": {"stringValue": migration.checksum}},
+            {"name": "execution_milliseconds", "value": {"longValue": execution_milliseconds}},
+            {"name": "baseline", "value": {"booleanValue": baseline}},
+        ], transaction_id=transaction_id)
+
+    def wait_for_statement(self, sql: str):
+        while True:
+            result = self.client.execute_statement(RUNNING_STATEMENT_QUERY, parameters=[
+                {"name": "sql", "value": {"stringValue": sql}}
+            ])
+            if result["records"][0][0]["longValue"] == 0:
+                return
+            print(f"Waiting for the statement to complete: {sql[:200]}")
+            time.sleep(self.statement_poll_seconds)
+
+    def run_outside_transaction(self, statement: str):
+        try:
+            self.client.execute_statement(statement, continue_after_timeout=True)
+        except Exception as e:
+            if classify_error(e) != STATEMENT_TIMEOUT:
+                raise
+            self.wait_for_statement(statement)
+
+    def apply_migration(self, migration: Migration):
+        started_at = time.perf_counter()
+        statements = split_statements(migration.script)
+        if migration.transactional:
+            def apply(transaction_id):
+                for statement in statements:
+                    print(f"Executing statement: {statement}")
+                    self.client.execute_statement(statement, transaction_id=transaction_id)
+                self.record(migration, int((time.perf_counter() - started_at) * 1000), transaction_id=transaction_id)
+            self.client.run_in_transaction(apply)
+        else:
+            for statement in statements:
+                print(f"Executing statement outside of a transaction: {statement}")
+                self.run_outside_transaction(statement)
+            invalid_indexes = [record[0]["stringValue"] for record in
+                               self.client.execute_statement(INVALID_INDEXES_QUERY)["records"]]
+            if invalid_indexes:
+                raise MigrationError(f"Migration {migration.name} left invalid indexes {invalid_indexes}, "
+                                     f"drop them and deploy again")
+            self.record(migration, int((time.perf_counter() - started_at) * 1000))
+        print(f"Applied migration {migration.name} in {time.perf_counter() - started_at:.1f} seconds")
+
+    def apply(self, migrations: list) -> list:
+        """Applies the pending migrations in version order and returns their names"""
+        self.ensure_ledger()
+        pending = self.pending(migrations)
+        if not pending:
+            print("The schema is up to date, no migrations to apply")
+        for migration in pending:
+            self.apply_migration(migration)
+        return [migration.name for migration in pending]
+
+    def baseline(self, migrations: list):
+        """Records the migrations as applied without running them, for a schema created at the latest version"""
+        self.ensure_ledger()
+        for migration in self.pending(migrations):
+            self.record(migration, 0, baseline=True)
@@ -0,0 +1,183 @@
+"""
+Purpose
+
+Bulk loads member rosters into the INSURED_PERSON and PATIENT tables. A roster is a CSV or Parquet file with
+one row per patient and the columns of ROSTER_COLUMNS. A row without patient names only loads the insured
+member. Rows are upserted, on the insured policy number and on the insured member, name and birth date of the
+patient, so loading a roster again updates the same records.
+
+Rows are sent with batch_execute_statement, batch_size rows per call, and every batch is committed in its own
+transaction. Batches run in parallel on one client per worker. All rows of a policy number go to the same
+worker and a worker runs its batches in order, so concurrent transactions never write the same rows.
+"""
+
+import codecs
+import csv
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyarrow.parquet as parquet
+except ImportError:
+    parquet = None
+
+ROSTER_COLUMNS = (
+    "insured_policy_number", "insured_name", "insured_group_number", "insured_plan_name", "insured_birth_date",
+    "insured_phone_number", "insured_address",
+    "patient_firstname", "patient_lastname", "patient_birth_date", "relationship_to_insured",
+    "patient_phone_number", "patient_sex", "patient_address",
+)
+
+UPSERT_INSURED_STATEMENT = """
+    INSERT INTO INSURED_PERSON (insured_policy_number, insured_name, insured_group_number, insured_plan_name, insured_birth_date, phone_number, address)
+    VALUES (:insured_policy_number, :insured_name, :insured_group_number, :insured_plan_name, CAST(:insured_birth_date AS DATE), :insured_phone_number, :insured_address)
+    ON CONFLICT (insured_policy_number) DO UPDATE SET
+    insured_name=EXCLUDED.insured_name, insured_group_number=EXCLUDED.insured_group_number, insured_plan_name=EXCLUDED.insured_plan_name,
+    insured_birth_date=EXCLUDED.insured_birth_date, phone_number=EXCLUDED.phone_number, address=EXCLUDED.address
+"""
+
+UPSERT_PATIENT_STATEMENT = """
+    INSERT INTO PATIENT (insured_id, patient_firstname, patient_lastname, patient_birth_date, relationship_to_insured, phone_number, sex, address)
+    SELECT insured_id, :patient_firstname, :patient_lastname, CAST(:patient_birth_date AS DATE), :relationship_to_insured,
+    :patient_phone_number, :patient_sex, :patient_address
+    FROM INSURED_PERSON WHERE insured_policy_number = :insured_policy_number
+    ON CONFLICT (insured_id, patient_lastname, patient_firstname, patient_birth_date) DO UPDATE SET
+    relationship_to_insured=EXCLUDED.relationship_to_insured, phone_number=EXCLUDED.phone_number, sex=EXCLUDED.sex, address=EXCLUDED.address
+"""
+
+INSURED_COLUMNS = ROSTER_COLUMNS[:7]
+PATIENT_COLUMNS = ("insured_policy_number",) + ROSTER_COLUMNS[7:]
+
+
+class RosterFormatError(ValueError):
+    """Raised for roster files that cannot be loaded"""
+    pass
+
+
+def column_value(name: str, value) -> dict:
+    if value is None or value == "":
+        return {"name": name, "value": {"isNull": True}}
+    return {"name": name, "value": {"stringValue": str(value).strip()}}
+
+
+def row_parameters(row: dict, columns: tuple) -> list:
+    return [column_value(column, row.get(column)) for column in columns]
+
+
+def csv_rows(lines):
+    reader = csv.DictReader(lines)
+    missing = [column for column in ("insured_policy_number",) if column not in (reader.fieldnames or [])]
+    if missing:
+        raise RosterFormatError(f"Missing roster columns: {missing}")
+    yield from reader
+
+
+def parquet_rows(path: str, batch_size: int = 10000):
+    if parquet is None:
+        raise RosterFormatError("Parquet rosters need pyarrow, see database.roster.pyarrow_layer_arn in cdk.json")
+    roster = parquet.ParquetFile(path)
+    if "insured_policy_number" not in roster.schema_arrow.names:
+        raise RosterFormatError("Missing roster columns: ['insured_policy_number']")
+    for batch in roster.iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def read_roster(s3_client, bucket: str, key: str, download_directory: str = "/tmp"):
+    """Rows of a roster object in S3, CSV rows are streamed and Parquet files are downloaded first"""
+    if key.endswith(".parquet"):
+        path = os.path.join(download_directory, os.path.basename(key))
+        s3_client.download_file(bucket, key, path)
+        try:
+            yield from parquet_rows(path)
+        finally:
+            os.remove(path)
+    elif key.endswith(".csv"):
+        body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+        yield from csv_rows(codecs.iterdecode(body.iter_lines(keepends=True), "utf-8-sig"))
+    else:
+        raise RosterFormatError(f"Unsupported roster file, expected .csv or .parquet: {key}")
+
+
+def roster_keys(s3_client, bucket: str, prefix: str) -> list:
+    """The roster object itself, or the CSV and Parquet objects under a prefix"""
+    if prefix.endswith((".csv", ".parquet")):
+        return [prefix]
+    keys = []
+    for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        keys += [item["Key"] for item in page.get("Contents", []) if item["Key"].endswith((".csv", ".parquet"))]
+    return sorted(keys)
+
+
+class RosterLoader:
+
+    def __init__(self, clients: list, batch_size: int = 500):
+        """clients: one database client per worker, the number of clients is the number of parallel batches"""
+        self.clients = clients
+        self.batch_size = batch_size
+
+    def write_batch(self, client, rows: list):
+        # one parameter set per policy number, the last row of a policy in the batch wins
+        insured = {row["insured_policy_number"]: row_parameters(row, INSURED_COLUMNS) for row in rows}
+        patients = [row_parameters(row, PATIENT_COLUMNS) for row in rows
+                    if row.get("patient_lastname") and row.get("patient_firstname")]
+
+        def write(transaction_id):
+            client.batch_execute_statement(UPSERT_INSURED_STATEMENT, list(insured.values()), transaction_id=transaction_id)
+            if patients:
+                client.batch_execute_statement(UPSERT_PATIENT_STATEMENT, patients, transaction_id=transaction_id)
+
+        client.run_in_transaction(write)
+        return len(insured), len(patients)
+
+    def load(self, rows) -> dict:
+        """Loads the roster rows and returns the number of rows and batches, and of insured member and patient upserts"""
+        workers = [ThreadPoolExecutor(max_workers=1) for _ in self.clients]
+        pending = [None] * len(self.clients)
+        buffers = [[] for _ in self.clients]
+        totals = {"rows": 0, "batches": 0, "insured": 0, "patients": 0}
+        started_at = time.perf_counter()
+
+        def collect(index):
+            if pending[index] is not None:
+                insured, patients = pending[index].result()
+                totals["insured"] += insured
+                totals["patients"] += patients
+                pending[index] = None
+
+        def submit(index):
+            # waits for the previous batch of the worker, so at most one batch per worker is in flight
+            collect(index)
+            pending[index] = workers[index].submit(self.write_batch, self.clients[index], buffers[index])
+            buffers[index] = []
+            totals["batches"] += 1
+            if totals["batches"] % (20 * len(self.clients)) == 0:
+                elapsed = time.perf_counter() - started_at
+                print(f"{totals['rows']:,} roster rows read, {totals['rows'] / elapsed:,.0f} rows/s")
+
+        try:
+            for row in rows:
+                policy_number = row.get("insured_policy_number")
+                if not policy_number:
+                    raise RosterFormatError(f"Roster row {totals['rows'] + 1} has no insured_policy_number")
+                index = zlib.crc32(str(policy_number).encode("utf-8")) % len(self.clients)
+                buffers[index].append(row)
+                totals["rows"] += 1
+                if len(buffers[index]) >= self.batch_size:
+                    submit(index)
+            for index, buffer in enumerate(buffers):
+                if buffer:
+                    submit(index)
+            for index in range(len(self.clients)):
+                collect(index)
+        finally:
+            for worker in workers:
+                worker.shutdown(wait=True)
+
+        elapsed = time.perf_counter() - started_at
+        totals["seconds"] = round(elapsed, 3)
+        totals["rows_per_second"] = round(totals["rows"] / elapsed) if elapsed else 0
+        print(f"Loaded {totals['rows']:,} roster rows with {totals['insured']:,} insured member and "
+              f"{totals['patients']:,} patient upserts in {elapsed:.1f} seconds, {totals['rows_per_second']:,} rows/s")
+        return totals
@@ -0,0 +1,98 @@
+"""
+Purpose
+
+Splits a PostgreSQL script into statements for the Data API, which runs one statement per call. Semicolons
+only end a statement outside of string literals ('...' and E'...'), quoted identifiers, dollar-quoted
+strings such as function bodies ($$...$$, $body$...$body$), and -- or /* */ comments.
+"""
+
+import re
+
+DOLLAR_QUOTE_TAG = re.compile(r"\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$")
+
+
+class SqlScriptError(ValueError):
+    """Raised when a script ends inside a string literal, quoted identifier or comment"""
+    pass
+
+
+def is_identifier_character(character: str) -> bool:
+    return character.isalnum() or character in "_$"
+
+
+def skip_quoted(script: str, position: int, quote: str, backslash_escapes: bool) -> int:
+    """Position after the closing quote of the literal or identifier that starts at position"""
+    i = position + 1
+    while i < len(script):
+        if backslash_escapes and script[i] == "\\":
+            i += 2
+        elif script[i] == quote:
+            if script.startswith(quote * 2, i):
+                i += 2
+            else:
+                return i + 1
+        else:
+            i += 1
+    raise SqlScriptError(f"Unterminated {quote} quoted text starting at offset {position}")
+
+
+def skip_block_comment(script: str, position: int) -> int:
+    """Position after the end of the block comment that starts at position, block comments nest"""
+    depth = 0
+    i = position
+    while i < len(script):
+        if script.startswith("/*", i):
+            depth += 1
+            i += 2
+        elif script.startswith("*/", i):
+            depth -= 1
+            i += 2
+            if depth == 0:
+                return i
+        else:
+            i += 1
+    raise SqlScriptError(f"Unterminated comment starting at offset {position}")
+
+
+def split_statements(script: str) -> list:
+    """Statements of the script without the terminating semicolons, comment-only parts are left out"""
+    statements = []
+    start = 0
+    has_code = False
+    i = 0
+    while i < len(script):
+        character = script[i]
+        follows_identifier = i > 0 and is_identifier_character(script[i - 1])
+        if character == "'":
+            # E'...' escape string constants accept backslash escapes
+            escape_string = follows_identifier and script[i - 1] in "eE" and not (
+                i > 1 and is_identifier_character(script[i - 2]))
+            i = skip_quoted(script, i, "'", escape_string)
+            has_code = True
+        elif character == '"':
+            i = skip_quoted(script, i, '"', False)
+            has_code = True
+        elif script.startswith("--", i):
+            end = script.find("\n", i)
+            i = len(script) if end < 0 else end + 1
+        elif script.startswith("/*", i):
+            i = skip_block_comment(script, i)
+        elif character == "$" and not follows_identifier and DOLLAR_QUOTE_TAG.match(script, i):
+            tag = DOLLAR_QUOTE_TAG.match(script, i).group(0)
+            end = script.find(tag, i + len(tag))
+            if end < 0:
+                raise SqlScriptError(f"Unterminated {tag} quoted string starting at offset {i}")
+            i = end + len(tag)
+            has_code = True
+        elif character == ";":
+            if has_code:
+                statements.append(script[start:i].strip())
+            start = i + 1
+            has_code = False
+            i += 1
+        else:
+            has_code = has_code or not character.isspace()
+            i += 1
+    if has_code:
+        statements.append(script[start:].strip())
+    return statements
@@ -1,26 +1,61 @@
 import os
 from aws_cdk import (
     aws_bedrock as bedrock,
+    aws_dynamodb as dynamodb,
     aws_iam as iam,
+    aws_ec2 as ec2,
+    aws_events as events,
+    aws_events_targets as targets,
     aws_lambda as _lambda,
+    aws_s3_assets as s3_assets,
     Duration,
+    RemovalPolicy,
     Stack,
     CustomResource,
     CfnOutput,
     custom_resources,
     CfnCondition,
-    Fn
+    Fn,
+    Size,
+    Token
 )
 import re
+import urllib.request
 
 import json
 from constructs import Construct
-from .prompts.claims_review_agent import claims_review_agent_instruction
+from .prompts.claims_review_agent import get_claims_review_agent_instruction
 from stacks.claims_review_stack.vector_store import VectorStore
 from stacks.claims_review_stack.knowledge_base import KnowledgeBase
+from stacks.claims_review_stack.knowledge_base_parameters import (
+    get_metadata_fields,
+    get_plan_filter_field,
+    get_vector_index_configuration,
+)
 from stacks.claims_review_stack.document_automation import DocumentAutomation
 from .prompts.prompt_overrides import prompt_overrides
 from stacks.claims_review_stack.database import Database
+
+# Certificate authorities of the RDS and Aurora endpoints of all regions
+RDS_CA_BUNDLE_URL = "https://truststore.pki.rds.amazonaws.com/global/global-bundle.pem"
+RDS_CA_BUNDLE_FILE = "rds-global-bundle.pem"
+
+
+def ensure_rds_ca_bundle(path: str):
+    """Downloads the RDS CA bundle to path once, later deployments package the downloaded file"""
+    if os.path.exists(path):
+        return
+    try:
+        with urllib.request.urlopen(RDS_CA_BUNDLE_URL, timeout=30) as response:
+            bundle = response.read()
+    except OSError as e:
+        raise RuntimeError(f"The RDS CA bundle could not be downloaded from {RDS_CA_BUNDLE_URL}, download it to "
+                           f"{path} and deploy again: {str(e)}")
+    if b"BEGIN CERTIFICATE" not in bundle:
+        raise RuntimeError(f"{RDS_CA_BUNDLE_URL} did not return a certificate bundle")
+    with open(path, "wb") as f:
+        f.write(bundle)
+
 class ClaimsReviewAgentStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None: 
@@ -54,11 +89,23 @@ class ClaimsReviewAgentStack(Stack):
         claims_review_agent_actions_lambda_function = self.create_claims_review_agent_actions_lambda_function(
             database_cluster_arn=database_cluster.cluster_arn,
             database_credentials_secret=database_cluster.secret.secret_arn,
-            default_database_name=aurora_serverless_v2.database_name
+            default_database_name=aurora_serverless_v2.database_name,
+            database_reader_endpoint=aurora_serverless_v2.reader_endpoint,
+            database_writer_host=aurora_serverless_v2.writer_host,
+            vpc=aurora_serverless_v2.vpc
         )
+        self.add_coverage_search(
+            agent_actions_function=claims_review_agent_actions_lambda_function,
+            coverage_cache_configuration=self.node.try_get_context("coverage_cache") or {}
+        )
+        # Medical code index of the validateCodes action, see code_index in cdk.json. The action and its
+        # prompt step are left out until the index is enabled, it is built with build_code_index.py
+        code_index_configuration = self.node.try_get_context("code_index") or {}
+        code_validation = code_index_configuration.get("enabled", False)
         claims_review_agent = self.create_agent(
             claims_review_agent_actions_lambda_function=claims_review_agent_actions_lambda_function,
-            claims_review_action_group_schema=self.get_claims_review_action_group_schema(),
+            claims_review_action_group_schema=self.get_claims_review_action_group_schema(code_validation=code_validation),
+            code_validation=code_validation,
             foundation_model_id = foundation_model_id,
             inference_profile_id=inference_profile_id,
             model_arns=model_arns,
@@ -69,28 +116,189 @@ class ClaimsReviewAgentStack(Stack):
             claims_review_agent_id=claims_review_agent.attr_agent_id,
             claims_review_agent_arn = claims_review_agent.attr_agent_arn,
             claims_review_agent_alias_id=claims_review_agent_alias.attr_agent_alias_id,
-            claims_review_agent_alias_arn=claims_review_agent_alias.attr_agent_alias_arn
+            claims_review_agent_alias_arn=claims_review_agent_alias.attr_agent_alias_arn,
+            knowledge_base_plan_filters=self.knowledge_base_plan_filters
         )
         
         document_automation.claims_review_bucket.grant_read(claims_review_agent_actions_lambda_function)
         database_cluster.grant_data_api_access(claims_review_agent_actions_lambda_function)
+        if claims_review_agent_actions_lambda_function.is_bound_to_vpc:
+            aurora_serverless_v2.allow_connections_from(claims_review_agent_actions_lambda_function)
+
+        # Member directory snapshot exported on a schedule, see member_snapshot in cdk.json
+        member_snapshot_configuration = self.node.try_get_context("member_snapshot") or {}
+        if member_snapshot_configuration.get("enabled", False):
+            self.create_member_snapshot_export(
+                claims_review_bucket=document_automation.claims_review_bucket,
+                database_cluster=database_cluster,
+                database_name=aurora_serverless_v2.database_name,
+                agent_actions_function=claims_review_agent_actions_lambda_function,
+                member_snapshot_configuration=member_snapshot_configuration
+            )
+
+        if code_validation:
+            self.add_code_index(
+                agent_actions_function=claims_review_agent_actions_lambda_function,
+                claims_review_bucket=document_automation.claims_review_bucket
+            )
+
+        # Retrievals are filtered on the plan of the member record, which the review functions read from the database
+        if self.knowledge_base_plan_filters:
+            for function in (document_automation.claims_verification_lambda_function,
+                             document_automation.batch_review_lambda_function):
+                self.add_database_access(function=function, database_cluster=database_cluster,
+                                         database_name=aurora_serverless_v2.database_name)
+
+        # Start resuming the database as soon as a claim form is submitted, while the data automation
+        # job extracts it, so the agent does not wait for the cluster to resume
+        database_configuration = self.node.try_get_context("database") or {}
+        if database_configuration.get("warm_up_on_submission", False):
+            self.add_database_access(
+                function=document_automation.invoke_data_automation_lambda_function,
+                database_cluster=database_cluster,
+                database_name=aurora_serverless_v2.database_name
+            )
+
+        # Decisions of earlier reviews with unchanged inputs are returned without invoking the agent
+        review_cache_configuration = self.node.try_get_context("review_cache") or {}
+        if review_cache_configuration.get("enabled", False):
+            self.add_review_cache(
+                document_automation=document_automation,
+                claims_review_agent=claims_review_agent,
+                claims_review_agent_alias=claims_review_agent_alias,
+                database_cluster=database_cluster,
+                database_name=aurora_serverless_v2.database_name,
+                review_cache_configuration=review_cache_configuration
+            )
 
         self.output_kb_info(
             agent_alias_id=claims_review_agent_alias.attr_agent_alias_id,
             agent_id=claims_review_agent.attr_agent_id
         )   
 
+    def add_database_access(self, function: _lambda.Function, database_cluster, database_name: str):
+        function.add_environment("CLAIMS_DB_CLUSTER_ARN", database_cluster.cluster_arn)
+        function.add_environment("CLAIMS_DB_CREDENTIALS_SECRET_ARN", database_cluster.secret.secret_arn)
+        function.add_environment("CLAIMS_DB_DATABASE_NAME", database_name)
+        database_cluster.grant_data_api_access(function)
+
+    def add_code_index(self, agent_actions_function: _lambda.Function, claims_review_bucket):
+        """The index file is built and uploaded to code_index/ with source/claims_review_app/build_code_index.py"""
+        agent_actions_function.add_environment("CLAIMS_REVIEW_BUCKET_NAME", claims_review_bucket.bucket_name)
+        agent_actions_function.add_environment("CODE_INDEX_ENABLED", "true")
+
+    def add_review_cache(self, document_automation: DocumentAutomation, claims_review_agent, claims_review_agent_alias,
+                    database_cluster, database_name: str, review_cache_configuration: dict):
+        """
+        The review functions key cached decisions on the member rows, the ingestion jobs of the knowledge
+        bases and the agent version of the alias. Entries expire after ttl_days.
+        """
+        knowledge_base_data_sources = [{
+            "knowledge_base_id": knowledge_base.knowledgebase.attr_knowledge_base_id,
+            "data_source_id": knowledge_base.knowledgebase_datasource.attr_data_source_id
+        } for knowledge_base, _ in self.knowledge_base_constructs.values()]
+        for function in (document_automation.claims_verification_lambda_function,
+                         document_automation.batch_review_lambda_function):
+            self.add_database_access(function=function, database_cluster=database_cluster, database_name=database_name)
+            function.add_environment("REVIEW_CACHE_ENABLED", "true")
+            function.add_environment("KNOWLEDGE_BASE_DATA_SOURCES",
+                                     Stack.of(self).to_json_string(knowledge_base_data_sources))
+            function.add_environment("REVIEW_CACHE_VERSION_REFRESH_SECONDS",
+                                     str(review_cache_configuration.get("version_refresh_seconds", 60)))
+            if self.knowledge_base_constructs:
+                function.add_to_role_policy(iam.PolicyStatement(
+                    actions=["bedrock:ListIngestionJobs"],
+                    resources=[knowledge_base.knowledgebase.attr_knowledge_base_arn
+                               for knowledge_base, _ in self.knowledge_base_constructs.values()]
+                ))
+            function.add_to_role_policy(iam.PolicyStatement(
+                actions=["bedrock:GetAgentAlias", "bedrock:GetAgent"],
+                resources=[claims_review_agent.attr_agent_arn, claims_review_agent_alias.attr_agent_alias_arn]
+            ))
+        document_automation.claims_review_bucket.add_lifecycle_rule(
+            prefix="review_cache/",
+            expiration=Duration.days(review_cache_configuration.get("ttl_days", 30))
+        )
+
+    def create_member_snapshot_export(self, claims_review_bucket, database_cluster, database_name: str,
+                    agent_actions_function: _lambda.Function, member_snapshot_configuration: dict):
+        export_layer = _lambda.LayerVersion(self, 'export_member_snapshot_layer',
+            code=_lambda.Code.from_asset('lambda/claims_review/layer'),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_10]
+        )
+        export_function = _lambda.Function(
+            self, 'export_member_snapshot',
+            runtime=_lambda.Runtime.PYTHON_3_10,
+            code=_lambda.Code.from_asset('lambda/claims_review/export_member_snapshot'),
+            handler='index.lambda_handler',
+            timeout=Duration.minutes(15),
+            memory_size=1024,
+            ephemeral_storage_size=Size.gibibytes(2),
+            layers=[export_layer],
+            environment={
+                "CLAIMS_REVIEW_BUCKET_NAME": claims_review_bucket.bucket_name,
+                "CLAIMS_DB_CLUSTER_ARN": database_cluster.cluster_arn,
+                "CLAIMS_DB_CREDENTIALS_SECRET_ARN": database_cluster.secret.secret_arn,
+                "CLAIMS_DB_DATABASE_NAME": database_name
+            }
+        )
+        database_cluster.grant_data_api_access(export_function)
+        claims_review_bucket.grant_read_write(export_function)
+        claims_review_bucket.grant_delete(export_function)
+
+        events.Rule(self, "export_member_snapshot_schedule",
+            schedule=events.Schedule.rate(Duration.minutes(member_snapshot_configuration.get("export_interval_minutes", 60))),
+            targets=[targets.LambdaFunction(export_function)]
+        )
+
+        agent_actions_function.add_environment("CLAIMS_REVIEW_BUCKET_NAME", claims_review_bucket.bucket_name)
+        agent_actions_function.add_environment("MEMBER_SNAPSHOT_MAX_AGE_SECONDS",
+            str(member_snapshot_configuration.get("max_age_minutes", 180) * 60))
+        agent_actions_function.add_environment("MEMBER_SNAPSHOT_REFRESH_SECONDS",
+            str(member_snapshot_configuration.get("refresh_seconds", 60)))
+        return export_function
+
     def create_claims_review_agent_actions_lambda_function(self,
                     database_cluster_arn:str,
                     database_credentials_secret:str,
-                    default_database_name:str) ->_lambda.Function:
+                    default_database_name:str,
+                    database_reader_endpoint=None,
+                    database_writer_host:str=None,
+                    vpc:ec2.IVpc=None) ->_lambda.Function:
                         
+        agent_actions_configuration = self.node.try_get_context("agent_actions") or {}
+        database_configuration = self.node.try_get_context("database") or {}
+        # DATA_API or POSTGRES, see database.backend in cdk.json
+        database_backend = database_configuration.get("backend", "DATA_API")
+        # lookups read from the reader endpoint over a direct connection, which needs the function in the VPC
+        reader_environment = {
+            "CLAIMS_DB_READER_HOST": database_reader_endpoint.hostname,
+            "CLAIMS_DB_PORT": Token.as_string(database_reader_endpoint.port),
+            "CLAIMS_DB_READER_MAX_STALENESS_SECONDS": str(database_configuration.get("reader_max_staleness_seconds", 1))
+        } if database_reader_endpoint is not None else {}
+        connects_to_database = database_reader_endpoint is not None or database_backend == "POSTGRES"
+        # direct connections verify the certificate of the cluster or proxy endpoint, the RDS CA bundle is
+        # added to the layer before it is packaged
+        tls_environment = {}
+        if connects_to_database:
+            ensure_rds_ca_bundle(os.path.join("lambda", "claims_review", "layer", "python", RDS_CA_BUNDLE_FILE))
+            tls_environment = {
+                "CLAIMS_DB_CA_BUNDLE": f"/opt/python/{RDS_CA_BUNDLE_FILE}",
+                "CLAIMS_DB_TLS_VERIFY": str(database_configuration.get("tls_verify", True)).lower()
+            }
+
         #create a lambda layer from the functions/layer directory
         claims_review_agent_actions_layer = _lambda.LayerVersion(self, 'claims_review_agent_actions_layer',
             code=_lambda.Code.from_asset('lambda/claims_review/layer'),
             compatible_runtimes=[_lambda.Runtime.PYTHON_3_10]
         )
 
+        # the actions Lambda compiles its request router from the same OpenAPI schema as the action group
+        claims_review_api_schema_asset = s3_assets.Asset(
+            self,
+            "ClaimsReviewApiSchemaAsset",
+            path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "schemas", "claims_review_openapi.json"),
+        )
         claims_review_agent_actions_function = _lambda.Function(
             self, 'agent_actions',
             runtime=_lambda.Runtime.PYTHON_3_10,
@@ -98,12 +306,24 @@ class ClaimsReviewAgentStack(Stack):
             handler='index.lambda_handler',
             timeout=Duration.seconds(600),
             layers=[claims_review_agent_actions_layer],
+            **({'vpc': vpc, 'vpc_subnets': ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS)}
+               if connects_to_database else {}),
             environment={
                 "CLAIMS_DB_CLUSTER_ARN": database_cluster_arn,
                 "CLAIMS_DB_CREDENTIALS_SECRET_ARN": database_credentials_secret,
-                "CLAIMS_DB_DATABASE_NAME": default_database_name
+                "CLAIMS_DB_DATABASE_NAME": default_database_name,
+                "CLAIMS_REVIEW_API_SCHEMA_FILE": claims_review_api_schema_asset.s3_object_url,
+                "CLAIMS_FORM_TOKEN_BUDGET": str(agent_actions_configuration.get("claims_form_token_budget", 0)),
+                "DATA_API_MAX_RETRY_SECONDS": str(database_configuration.get("data_api_max_retry_seconds", 60)),
+                "CLAIMS_DB_BACKEND": database_backend,
+                **({"CLAIMS_DB_WRITER_HOST": database_writer_host} if database_backend == "POSTGRES" else {}),
+                **reader_environment,
+                **tls_environment,
+                "CLAIMS_S3_CACHE_MAX_BYTES": str(agent_actions_configuration.get("s3_cache_max_bytes", 32 * 1024 * 1024)),
+                "CLAIMS_S3_CACHE_MAX_AGE_SECONDS": str(agent_actions_configuration.get("s3_cache_max_age_seconds", 300))
             }
         )
+        claims_review_api_schema_asset.grant_read(claims_review_agent_actions_function)
         return claims_review_agent_actions_function
         
     
@@ -167,7 +387,7 @@ class ClaimsReviewAgentStack(Stack):
             )
         )
         return claims_review_agent_resource_role
-    def get_claims_review_action_group_schema(self):
+    def get_claims_review_action_group_schema(self, code_validation: bool = False):
                 # Construct the path to the schema file
         current_dir = os.path.dirname(os.path.abspath(__file__))
         schema_path = os.path.join(current_dir, "schemas", "claims_review_openapi.json")
@@ -175,7 +395,16 @@ class ClaimsReviewAgentStack(Stack):
 
         with open(schema_path, "r") as f:
             claims_review_action_group_schema = json.load(f)
-            return claims_review_action_group_schema
+        if not code_validation:
+            claims_review_action_group_schema["paths"].pop("/codes/validate", None)
+        # Bedrock Agents reject action groups with more APIs than the APIs per Agent quota, 11 by default
+        max_apis = self.node.try_get_context("agent_max_apis") or 11
+        api_count = sum(1 for path_item in claims_review_action_group_schema["paths"].values() for method in path_item
+                        if method in ("get", "put", "post", "delete", "patch"))
+        if api_count > max_apis:
+            raise ValueError(f"The action group schema has {api_count} APIs, more than the {max_apis} APIs per agent "
+                             "of agent_max_apis in cdk.json")
+        return claims_review_action_group_schema
 
     def create_agent(self,
                     claims_review_agent_actions_lambda_function: _lambda.Function,
@@ -183,7 +412,8 @@ class ClaimsReviewAgentStack(Stack):
                     knowledge_bases: list[bedrock.CfnKnowledgeBase],
                     foundation_model_id=None,
                     inference_profile_id=None,
-                    model_arns=None) -> bedrock.CfnAgent:        
+                    model_arns=None,
+                    code_validation: bool = False) -> bedrock.CfnAgent:        
 
         claims_review_agent_resource_role = self.create_bedrock_agent_resource_role(
             knowledge_bases = knowledge_bases,
@@ -213,7 +443,7 @@ class ClaimsReviewAgentStack(Stack):
             auto_prepare=True,
             description="Claims Review Agent",
             foundation_model=foundation_model_id if foundation_model_id else inference_profile_id,
-            instruction=claims_review_agent_instruction,            
+            instruction=get_claims_review_agent_instruction(code_validation=code_validation),            
             tags={
                 "project": "claims-review"
             },
@@ -307,7 +537,8 @@ class ClaimsReviewAgentStack(Stack):
         return VectorStore(self, "vector_store",
                                 kb_service_role_arn=bedrock_service_role.role_arn,
                                 vector_store_collection_name=claims_vector_store_collection_name,
-                                vector_store_collection_description=claims_vector_store_collection_description)
+                                vector_store_collection_description=claims_vector_store_collection_description,
+                                data_access_principal_arns=vector_store_configuration.get('data_access_principal_arns', []))
 
     def create_knowledge_bases(self,
                               vector_store: VectorStore,
@@ -316,12 +547,17 @@ class ClaimsReviewAgentStack(Stack):
 
         knowledge_bases_config = self.node.try_get_context('knowledge_bases')
         knowledge_bases = []
+        self.knowledge_base_plan_filters = []
+        self.knowledge_base_constructs = {}
         for knowledge_base_name, knowledgebase_parameters in knowledge_bases_config.items():
 
             vector_store_index_creation_resource = self.create_vector_store_index(
                             service_token = vector_store.vector_store_index_creation_provider.service_token,
                             vector_store_index_name = knowledgebase_parameters["vector_store_index_params"]["index_name"],
-                            aoss_collection_endpoint = vector_store.aoss_collection_endpoint
+                            vector_store_index_alias = knowledgebase_parameters["vector_store_index_params"].get("index_alias"),
+                            aoss_collection_endpoint = vector_store.aoss_collection_endpoint,
+                            vector_index_configuration = get_vector_index_configuration(knowledgebase_parameters),
+                            metadata_fields = get_metadata_fields(knowledgebase_parameters)
             )
 
             knowledge_base = KnowledgeBase(self,
@@ -333,20 +569,85 @@ class ClaimsReviewAgentStack(Stack):
             )
             knowledge_base.knowledgebase.add_dependency(vector_store_index_creation_resource.node.default_child)
             knowledge_bases.append(knowledge_base.knowledgebase)
+            self.knowledge_base_constructs[knowledge_base_name] = (knowledge_base, knowledgebase_parameters)
+            plan_filter_field = get_plan_filter_field(knowledgebase_parameters)
+            if plan_filter_field:
+                self.knowledge_base_plan_filters.append({
+                    "knowledge_base_id": knowledge_base.knowledgebase.attr_knowledge_base_id,
+                    "field": plan_filter_field
+                })
 
         return knowledge_bases
     
+    def add_coverage_search(self, agent_actions_function: _lambda.Function, coverage_cache_configuration: dict):
+        """
+        Configures the searchCoverage action on a knowledge base, the first one by default, with the semantic
+        cache table when the cache is enabled
+        """
+        if not self.knowledge_base_constructs:
+            return
+        knowledge_base_name = coverage_cache_configuration.get("knowledge_base", next(iter(self.knowledge_base_constructs)))
+        knowledge_base, knowledgebase_parameters = self.knowledge_base_constructs[knowledge_base_name]
+        embedding_model_id = knowledgebase_parameters["embedding_model_id"]
+        agent_actions_function.add_environment("COVERAGE_KNOWLEDGE_BASE_ID", knowledge_base.knowledgebase.attr_knowledge_base_id)
+        agent_actions_function.add_environment("COVERAGE_DATA_SOURCE_ID", knowledge_base.knowledgebase_datasource.attr_data_source_id)
+        agent_actions_function.add_environment("COVERAGE_PLAN_FILTER_FIELD", get_plan_filter_field(knowledgebase_parameters) or "")
+        agent_actions_function.add_to_role_policy(iam.PolicyStatement(
+            actions=["bedrock:Retrieve", "bedrock:ListIngestionJobs"],
+            resources=[knowledge_base.knowledgebase.attr_knowledge_base_arn]
+        ))
+        if not coverage_cache_configuration.get("enabled", False):
+            return
+
+        coverage_cache_table = dynamodb.Table(self, "coverage_cache_table",
+            partition_key=dynamodb.Attribute(name="scope", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="query_hash", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY
+        )
+        coverage_cache_table.grant_read_write_data(agent_actions_function)
+        agent_actions_function.add_environment("COVERAGE_CACHE_TABLE_NAME", coverage_cache_table.table_name)
+        agent_actions_function.add_environment("COVERAGE_EMBEDDING_MODEL_ID", embedding_model_id)
+        agent_actions_function.add_environment("COVERAGE_EMBEDDING_DIMENSIONS",
+            str(coverage_cache_configuration.get("embedding_dimensions", 256)))
+        agent_actions_function.add_environment("COVERAGE_CACHE_SIMILARITY_THRESHOLD",
+            str(coverage_cache_configuration.get("similarity_threshold", 0.95)))
+        agent_actions_function.add_environment("COVERAGE_CACHE_TTL_SECONDS",
+            str(coverage_cache_configuration.get("ttl_hours", 24) * 3600))
+        agent_actions_function.add_environment("COVERAGE_CACHE_MAX_ENTRIES_PER_PLAN",
+            str(coverage_cache_configuration.get("max_entries_per_plan", 1000)))
+        agent_actions_function.add_environment("COVERAGE_VERSION_REFRESH_SECONDS",
+            str(coverage_cache_configuration.get("version_refresh_seconds", 60)))
+        # the cache matches queries on embeddings of the knowledge base's embedding model
+        agent_actions_function.add_to_role_policy(iam.PolicyStatement(
+            actions=["bedrock:InvokeModel"],
+            resources=[f"arn:aws:bedrock:{Stack.of(self).region}::foundation-model/{embedding_model_id}"]
+        ))
+
     def create_vector_store_index(self,
                               service_token,
                               vector_store_index_name,
-                              aoss_collection_endpoint
+                              vector_store_index_alias,
+                              aoss_collection_endpoint,
+                              vector_index_configuration: dict,
+                              metadata_fields: dict
                               ) -> CustomResource:
         return  CustomResource (
             self, f"vector_store_index_creation_resource_{vector_store_index_name}",
             service_token=service_token,
             properties={
                 "AOSSIndexName": vector_store_index_name,
-                "AOSSHost": aoss_collection_endpoint
+                "AOSSHost": aoss_collection_endpoint,
+                "Dimension": vector_index_configuration["dimension"],
+                "SpaceType": vector_index_configuration["space_type"],
+                "M": vector_index_configuration["m"],
+                "EfConstruction": vector_index_configuration["ef_construction"],
+                "EfSearch": vector_index_configuration["ef_search"],
+                "Quantization": vector_index_configuration["quantization"],
+                "MetadataFields": metadata_fields,
+                # the knowledge base uses the alias, the reindex script moves it to rebuilt versions of the index
+                **({"AOSSIndexAlias": vector_store_index_alias} if vector_store_index_alias else {})
             }
         )
     
@@ -377,7 +678,8 @@ class ClaimsReviewAgentStack(Stack):
                         claims_review_agent_id: str,
                         claims_review_agent_alias_id: str,
                         claims_review_agent_arn: str,
-                        claims_review_agent_alias_arn: str
+                        claims_review_agent_alias_arn: str,
+                        knowledge_base_plan_filters: list = None
                     ):
         return DocumentAutomation(
             self,
@@ -385,7 +687,8 @@ class ClaimsReviewAgentStack(Stack):
             claims_review_agent_id=claims_review_agent_id,
             claims_review_agent_arn=claims_review_agent_arn,
             claims_review_agent_alias_id=claims_review_agent_alias_id,
-            claims_review_agent_alias_arn=claims_review_agent_alias_arn
+            claims_review_agent_alias_arn=claims_review_agent_alias_arn,
+            knowledge_base_plan_filters=knowledge_base_plan_filters
         )
     
     def create_get_inference_profile_custom_resource(self, inference_profile_id:str):
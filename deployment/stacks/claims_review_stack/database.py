@@ -3,16 +3,19 @@ from aws_cdk import (
     aws_rds as rds,
     aws_ec2 as ec2,
     aws_s3_assets as s3_assets,
+    aws_s3 as s3,
     CfnOutput,
     RemovalPolicy,
     custom_resources,
     CustomResource,
     aws_lambda as _lambda,
+    aws_events as events,
+    aws_events_targets as targets,
     Duration
 )
 from constructs import Construct
-from datetime import datetime, timezone
 import os
+import json
 from collections import namedtuple
 
 class Database(Construct):
@@ -21,6 +24,12 @@ class Database(Construct):
         self.database_name = self.node.try_get_context('database_name')
 
         self.database_cluster = self.create_database_cluster(self.database_name)
+        # Reader endpoint for lookups when the cluster has a reader instance, see database.reader in cdk.json
+        self.reader_endpoint = self.database_cluster.cluster_read_endpoint if self.has_reader else None
+        # Functions using the POSTGRES backend connect to the writer directly or through an RDS Proxy,
+        # which pools the connections of many concurrent Lambda containers
+        self.proxy = self.create_database_proxy() if self.use_proxy else None
+        self.writer_host = self.proxy.endpoint if self.proxy is not None else self.database_cluster.cluster_endpoint.hostname
 
         schema_assets = self.create_schema_file_assets()
         manage_schema_lambda_function = self.create_manage_schema_lambda_function(
@@ -28,10 +37,11 @@ class Database(Construct):
             create_schema_asset=schema_assets.create,
             delete_schema_asset=schema_assets.delete,
             database_name=self.database_name,
-            update_schema_asset=schema_assets.update if schema_assets.update else None,
+            migrations_asset=schema_assets.migrations,
             initial_data_asset=schema_assets.initial_data if schema_assets.initial_data else None
         )
-        self.create_create_schema_custom_resource(manage_schema_lambda_function)
+        self.create_create_schema_custom_resource(manage_schema_lambda_function, schema_assets.migrations)
+        self.create_partition_maintenance_schedule(manage_schema_lambda_function)
 
         self.database_cluster.secret.grant_read(manage_schema_lambda_function)
 
@@ -46,20 +56,31 @@ class Database(Construct):
     def create_database_cluster(self, 
                                 database_name:str):
         # Create VPC for the database
-        vpc = ec2.Vpc(self, "AuroraVPC",
+        self.vpc = vpc = ec2.Vpc(self, "AuroraVPC",
             max_azs=2,
         )
 
+        # A minimum capacity of 0 lets the cluster pause when idle, the Data API client retries while it resumes
+        database_configuration = self.node.try_get_context("database") or {}
+        self.has_reader = database_configuration.get("reader", False)
+        self.use_proxy = database_configuration.get("proxy", False)
+
         # Create Aurora Serverless V2 Cluster
         cluster = rds.DatabaseCluster(self, "claims-review-cluster",
             engine=rds.DatabaseClusterEngine.aurora_postgres(
                 version=rds.AuroraPostgresEngineVersion.VER_15_10
             ),
-            serverless_v2_max_capacity=2,
-            serverless_v2_min_capacity=0.5,
+            serverless_v2_max_capacity=database_configuration.get("max_capacity", 2),
+            serverless_v2_min_capacity=database_configuration.get("min_capacity", 0.5),
             writer=rds.ClusterInstance.serverless_v2("writer",
                 publicly_accessible=True
             ),
+            # the reader scales independently of the writer, with its own ACUs for lookup traffic
+            readers=[
+                rds.ClusterInstance.serverless_v2("reader",
+                    scale_with_writer=False
+                )
+            ] if self.has_reader else None,
             vpc=vpc,
             default_database_name=database_name,
             removal_policy=RemovalPolicy.DESTROY,
@@ -67,8 +88,25 @@ class Database(Construct):
         )
         return cluster
 
+    def create_database_proxy(self) -> rds.DatabaseProxy:
+        proxy = self.database_cluster.add_proxy("claims-review-proxy",
+            secrets=[self.database_cluster.secret],
+            vpc=self.vpc,
+            require_tls=True
+        )
+        self.database_cluster.connections.allow_default_port_from(proxy)
+        return proxy
+
+    def allow_connections_from(self, function: _lambda.Function):
+        """Lets the function connect to the writer, reader or proxy with the credentials of the cluster secret"""
+        self.database_cluster.connections.allow_default_port_from(function)
+        if self.proxy is not None:
+            self.proxy.connections.allow_default_port_from(function)
+        self.database_cluster.secret.grant_read(function)
+
     def create_create_schema_custom_resource(self, 
-                                             manage_schema_lambda_function: _lambda.Function):
+                                             manage_schema_lambda_function: _lambda.Function,
+                                             migrations_asset: s3_assets.Asset):
  
         # Create Custom Resource provider
         provider = custom_resources.Provider(
@@ -82,11 +120,23 @@ class Database(Construct):
             "manage_aurora_schema",
             service_token=provider.service_token,
             properties={
-                "timestamp": str(datetime.now(timezone.utc))  # Force update on each deployment
+                # Updates, which apply the pending migrations, only run when the migrations change
+                "migrations": migrations_asset.asset_hash
             }
         )
         manage_schema_custom_resource.node.add_dependency(self.database_cluster)
     
+    def create_partition_maintenance_schedule(self, manage_schema_lambda_function: _lambda.Function):
+        # The monthly claim partitions are created ahead of time, a claim for a month without a partition
+        # would go to the default partition
+        events.Rule(self, "claim_partition_maintenance",
+            schedule=events.Schedule.rate(Duration.days(1)),
+            targets=[targets.LambdaFunction(
+                manage_schema_lambda_function,
+                event=events.RuleTargetInput.from_object({"action": "ensure_partitions"})
+            )]
+        )
+
     def create_schema_file_assets(self):
         current_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -96,14 +146,12 @@ class Database(Construct):
             "CreateSQLSchemaAsset",
             path=os.path.join(current_dir, "schemas/create_database_schema.sql"),
         )
-        update_schema_file = None
-        #if update_database_schema.sql exists then create an S3 asset for it
-        if os.path.exists(os.path.join(current_dir, "schemas/update_database_schema.sql")):
-            update_schema_file = s3_assets.Asset(
-                self,
-                "UpdateSQLSchemaAsset",
-                path=os.path.join(current_dir, "schemas/update_database_schema.sql"),
-            )
+        # The numbered migration files, uploaded as a zip archive
+        migrations = s3_assets.Asset(
+            self,
+            "MigrationsAsset",
+            path=os.path.join(current_dir, "schemas/migrations"),
+        )
 
         # Upload the SQL schema file to S3 as an asset
         delete_schema_file = s3_assets.Asset(
@@ -119,18 +167,34 @@ class Database(Construct):
             path=os.path.join(current_dir, "data/initial_data.sql"),
         )
         
-        SchemaAssets = namedtuple('SchemaAssets', ['create', 'delete', 'update', 'initial_data'])  # import collections
-        return SchemaAssets(create_schema_file, delete_schema_file, update_schema_file, initial_data_file)
+        SchemaAssets = namedtuple('SchemaAssets', ['create', 'delete', 'migrations', 'initial_data'])  # import collections
+        return SchemaAssets(create_schema_file, delete_schema_file, migrations, initial_data_file)
     
     def create_manage_schema_lambda_function(self,
             cluster:rds.DatabaseCluster,
             database_name:str,
             create_schema_asset:s3_assets.Asset,
             delete_schema_asset:s3_assets.Asset,
-            update_schema_asset:s3_assets.Asset=None,
+            migrations_asset:s3_assets.Asset=None,
             initial_data_asset:s3_assets.Asset=None
         ):
         
+        # Layer with the resume-aware Data API client
+        manage_schema_lambda_layer = _lambda.LayerVersion(self, 'manage_schema_lambda_layer',
+            code=_lambda.Code.from_asset('lambda/claims_review/layer'),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_10]
+        )
+        # Member rosters loaded after the schema is created, see database.roster in cdk.json. Parquet rosters
+        # need pyarrow, e.g. from the AWS SDK for pandas layer of the region. The load_roster action reads the
+        # roster URI and the allowed URIs only, the function is granted read access to nothing else.
+        roster_configuration = (self.node.try_get_context("database") or {}).get("roster") or {}
+        roster_uri = roster_configuration.get("uri")
+        roster_allowed_uris = ([roster_uri] if roster_uri else []) + (roster_configuration.get("allowed_uris") or [])
+        layers = [manage_schema_lambda_layer]
+        if roster_configuration.get("pyarrow_layer_arn"):
+            layers.append(_lambda.LayerVersion.from_layer_version_arn(self, "pyarrow_layer",
+                roster_configuration["pyarrow_layer_arn"]))
+
         # Define the Lambda function that will execute the schema
         manage_schema_lambda_function = _lambda.Function(
             self,
@@ -138,22 +202,34 @@ class Database(Construct):
             runtime=_lambda.Runtime.PYTHON_3_10,
             handler="index.handler",
             code=_lambda.Code.from_asset("lambda/claims_review/manage_schema"),
-            timeout=Duration.seconds(300),
+            # roster loads of millions of members take minutes
+            timeout=Duration.minutes(15),
+            memory_size=1024,
+            layers=layers,
             environment={
                 "CLUSTER_ARN": cluster.cluster_arn,
                 "SECRET_ARN": cluster.secret.secret_arn,
                 "DATABASE_NAME": database_name,
+                "PARTITION_MONTHS_AHEAD": str((self.node.try_get_context("database") or {}).get("partition_months_ahead", 3)),
                 "CREATE_SCHEMA_FILE": create_schema_asset.s3_object_url,  # Path to the uploaded SQL file in S3
                 "DELETE_SCHEMA_FILE": delete_schema_asset.s3_object_url,  # Path to the uploaded SQL file in S3
                 **({'INITIAL_DATA_FILE': initial_data_asset.s3_object_url} if initial_data_asset is not None else {}),
-                **({'UPDATE_SCHEMA_FILE': update_schema_asset.s3_object_url} if update_schema_asset is not None else {}),
+                **({'MIGRATIONS_ARCHIVE': migrations_asset.s3_object_url} if migrations_asset is not None else {}),
+                **({'ROSTER_URI': roster_uri} if roster_uri else {}),
+                "ROSTER_ALLOWED_URIS": json.dumps(roster_allowed_uris),
+                "ROSTER_BATCH_SIZE": str(roster_configuration.get("batch_size", 500)),
+                "ROSTER_PARALLELISM": str(roster_configuration.get("parallelism", 8)),
             }
         )
+        for index, allowed_uri in enumerate(roster_allowed_uris):
+            roster_bucket, _, roster_prefix = allowed_uri.replace("s3://", "").partition("/")
+            s3.Bucket.from_bucket_name(self, f"roster_bucket_{index}", roster_bucket).grant_read(
+                manage_schema_lambda_function, f"{roster_prefix}*")
 
         create_schema_asset.grant_read(manage_schema_lambda_function)
         delete_schema_asset.grant_read(manage_schema_lambda_function)
-        if update_schema_asset:
-            update_schema_asset.grant_read(manage_schema_lambda_function)
+        if migrations_asset:
+            migrations_asset.grant_read(manage_schema_lambda_function)
         if initial_data_asset:
             initial_data_asset.grant_read(manage_schema_lambda_function)
 
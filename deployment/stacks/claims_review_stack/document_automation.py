@@ -7,6 +7,8 @@ from aws_cdk import (
     aws_events as events,
     aws_events_targets as targets,
     aws_lambda as _lambda,
+    aws_lambda_event_sources as lambda_event_sources,
+    aws_sqs as sqs,
     Duration,
     custom_resources,
     CustomResource,
@@ -25,6 +27,7 @@ class DocumentAutomation(Construct):
                     claims_review_agent_alias_id:str,
                     claims_review_agent_arn:str,
                     claims_review_agent_alias_arn:str,
+                    knowledge_base_plan_filters: Optional[list] = None,
                     **kwargs) -> None:
 
         super().__init__(scope, construct_id, **kwargs)
@@ -41,7 +44,7 @@ class DocumentAutomation(Construct):
         self.claims_review_bucket = self.create_claims_review_bucket()
 
         # Lambda function to trigger bedrock data insight on submitted claim forms
-        invoke_data_automation_lambda_function = self.create_invoke_data_automation_function(
+        self.invoke_data_automation_lambda_function = invoke_data_automation_lambda_function = self.create_invoke_data_automation_function(
             self.claims_review_bucket, 
             lambda_layer=lambda_layer,
             **({'blueprint_arn': blueprint_arn} if blueprint_arn is not None else {}),
@@ -57,7 +60,8 @@ class DocumentAutomation(Construct):
                                                             invoke_data_automation_lambda_function=invoke_data_automation_lambda_function)
 
         # EventBridge Rule to trigger Bedrock Agent when a new Claim form is successfully processed by Bedrock Data Insight
-        claims_verification_lambda_function = self.create_invoke_claims_verification_function(
+        self.claims_verification_lambda_function = claims_verification_lambda_function = self.create_invoke_claims_verification_function(
+                    lambda_layer=lambda_layer,
                     claims_review_agent_id=claims_review_agent_id,
                     claims_review_agent_arn=claims_review_agent_arn,
                     claims_review_agent_alias_id=claims_review_agent_alias_id,
@@ -66,6 +70,24 @@ class DocumentAutomation(Construct):
         self.claims_review_bucket.grant_read_write(claims_verification_lambda_function)
         self.create_eventbridge_rule_to_invoke_claims_verification(
              claims_verification_lambda_function=claims_verification_lambda_function)
+        self.create_claims_review_retry_queue(claims_verification_lambda_function=claims_verification_lambda_function)
+
+        # Lambda function to re-run the claims review over a backlog of already extracted claims
+        self.batch_review_lambda_function = batch_review_lambda_function = self.create_batch_review_function(
+                    lambda_layer=lambda_layer,
+                    claims_review_bucket=self.claims_review_bucket,
+                    claims_review_agent_id=claims_review_agent_id,
+                    claims_review_agent_arn=claims_review_agent_arn,
+                    claims_review_agent_alias_id=claims_review_agent_alias_id,
+                    claims_review_agent_alias_arn=claims_review_agent_alias_arn
+                )
+        self.claims_review_bucket.grant_read_write(batch_review_lambda_function)
+
+        # Knowledge base retrievals of a review only search the documents of the plan of the member
+        if knowledge_base_plan_filters:
+            for review_lambda_function in (claims_verification_lambda_function, batch_review_lambda_function):
+                review_lambda_function.add_environment("KNOWLEDGE_BASE_PLAN_FILTERS",
+                                                       Stack.of(self).to_json_string(knowledge_base_plan_filters))
     
     def load_blueprint_schema(self):
         current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -85,7 +107,7 @@ class DocumentAutomation(Construct):
     def create_lambda_layer(self):
         # Create layer
         layer = _lambda.LayerVersion(self, 'blueprint_creation_lambda_layer',
-            description='Dependencies for the Blueprint creation lambda function',
+            description='Shared modules of the document automation and claims review lambda functions',
             code= _lambda.Code.from_asset( 'lambda/claims_review/layer/'), # required
             compatible_runtimes=[
                 _lambda.Runtime.PYTHON_3_10
@@ -207,20 +229,29 @@ class DocumentAutomation(Construct):
         return document_automation_lambda_function
 
     def create_invoke_claims_verification_function(self, 
+                            lambda_layer:_lambda.LayerVersion,
                             claims_review_agent_id:str, 
                             claims_review_agent_arn:str,
                             claims_review_agent_alias_id:str,
                             claims_review_agent_alias_arn:str):
         
+        # Reviews still running close to the timeout are handed over to a continuation invocation
+        # that resumes the same agent session, see claims_verification in cdk.json
+        claims_verification_configuration = self.node.try_get_context("claims_verification") or {}
         claims_verification_lambda_function = _lambda.Function(
             self, 'invoke_verification',
             runtime=_lambda.Runtime.PYTHON_3_10,
             code=_lambda.Code.from_asset('lambda/claims_review/invoke_verification'),
             handler='index.lambda_handler',
-            timeout=Duration.seconds(300),
+            timeout=Duration.seconds(claims_verification_configuration.get("timeout_seconds", 300)),
+            layers=[lambda_layer],
             environment={
                 'CLAIMS_REVIEW_AGENT_ID': claims_review_agent_id,
-                'CLAIMS_REVIEW_AGENT_ALIAS_ID': claims_review_agent_alias_id
+                'CLAIMS_REVIEW_AGENT_ALIAS_ID': claims_review_agent_alias_id,
+                **({'CONTINUATION_RESERVE_SECONDS': str(claims_verification_configuration["continuation_reserve_seconds"])}
+                   if "continuation_reserve_seconds" in claims_verification_configuration else {}),
+                **({'MAX_CONTINUATIONS': str(claims_verification_configuration["max_continuations"])}
+                   if "max_continuations" in claims_verification_configuration else {})
             }
         )
 
@@ -232,6 +263,64 @@ class DocumentAutomation(Construct):
 
         return claims_verification_lambda_function
 
+    def create_claims_review_retry_queue(self,
+                        claims_verification_lambda_function: _lambda.Function):
+        # Queue for claim reviews deferred after throttling or transient agent errors.
+        # Reviews that keep failing after all deferrals are moved to the dead letter queue
+        claims_review_retry_dead_letter_queue = sqs.Queue(self, "claims_review_retry_dlq",
+            retention_period=Duration.days(14),
+            enforce_ssl=True
+        )
+        claims_review_retry_queue = sqs.Queue(self, "claims_review_retry_queue",
+            visibility_timeout=Duration.minutes(30),
+            enforce_ssl=True,
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=3,
+                queue=claims_review_retry_dead_letter_queue
+            )
+        )
+        claims_review_retry_queue.grant_send_messages(claims_verification_lambda_function)
+        claims_verification_lambda_function.add_environment("CLAIMS_REVIEW_RETRY_QUEUE_URL", claims_review_retry_queue.queue_url)
+        claims_verification_lambda_function.add_event_source(
+            lambda_event_sources.SqsEventSource(claims_review_retry_queue, batch_size=1)
+        )
+        return claims_review_retry_queue
+
+    def create_batch_review_function(self,
+                            lambda_layer:_lambda.LayerVersion,
+                            claims_review_bucket: s3.Bucket,
+                            claims_review_agent_id:str,
+                            claims_review_agent_arn:str,
+                            claims_review_agent_alias_id:str,
+                            claims_review_agent_alias_arn:str):
+
+        batch_review_configuration = self.node.try_get_context("batch_review") or {}
+        batch_review_lambda_function = _lambda.Function(
+            self, 'batch_review',
+            runtime=_lambda.Runtime.PYTHON_3_10,
+            code=_lambda.Code.from_asset('lambda/claims_review/invoke_verification'),
+            handler='batch_review.lambda_handler',
+            timeout=Duration.minutes(15),
+            layers=[lambda_layer],
+            environment={
+                'CLAIMS_REVIEW_AGENT_ID': claims_review_agent_id,
+                'CLAIMS_REVIEW_AGENT_ALIAS_ID': claims_review_agent_alias_id,
+                'CLAIMS_REVIEW_BUCKET_NAME': claims_review_bucket.bucket_name,
+                **{f"BATCH_REVIEW_{key.upper()}": str(value) for key, value in batch_review_configuration.items()}
+            }
+        )
+
+        batch_review_lambda_function.add_to_role_policy(iam.PolicyStatement(
+            actions=["bedrock:InvokeAgent"],
+            resources=[claims_review_agent_arn, claims_review_agent_alias_arn]
+        ))
+
+        CfnOutput(self, "output_batch_review_function",
+            export_name="claims-batch-review-function",
+            value=batch_review_lambda_function.function_name)
+
+        return batch_review_lambda_function
+
     def create_eventbridge_rule_to_invoke_document_automation(self,
                                                        claims_submission_bucket: s3.Bucket,
                                                        invoke_data_automation_lambda_function: _lambda.Function):
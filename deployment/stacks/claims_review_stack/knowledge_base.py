@@ -14,6 +14,11 @@ import random, string
 from constructs import Construct
 import uuid
 import uuid
+from stacks.claims_review_stack.knowledge_base_parameters import (
+    get_chunking_parameters,
+    get_knowledge_base_index_name,
+    get_vector_index_configuration,
+)
 
 class KnowledgeBase(Construct):
     def __init__(self, scope: Construct, construct_id: str,
@@ -98,10 +103,11 @@ class KnowledgeBase(Construct):
         embedding_model_id = knowledgebase_parameters['embedding_model_id']
         embedding_model_arn = f"arn:aws:bedrock:{Stack.of(self).region}::foundation-model/{embedding_model_id}"
 
-        vector_store_index_name = knowledgebase_parameters['vector_store_index_params']["index_name"]
+        vector_store_index_name = get_knowledge_base_index_name(knowledgebase_parameters)
         metadata_field = knowledgebase_parameters['vector_store_index_params']["metadata_field"]
         text_field = knowledgebase_parameters['vector_store_index_params']['text_field']
         vector_field = knowledgebase_parameters['vector_store_index_params']['vector_field']
+        vector_index_configuration = get_vector_index_configuration(knowledgebase_parameters)
 
         #Create the Bedrock Knowledge Base with the s3 bucket as knowledge base
         return bedrock.CfnKnowledgeBase(self, "knowledgebase",
@@ -109,7 +115,13 @@ class KnowledgeBase(Construct):
             knowledge_base_configuration=bedrock.CfnKnowledgeBase.KnowledgeBaseConfigurationProperty(
                 type="VECTOR",
                 vector_knowledge_base_configuration=bedrock.CfnKnowledgeBase.VectorKnowledgeBaseConfigurationProperty(
-                    embedding_model_arn=f"{embedding_model_arn}"
+                    embedding_model_arn=f"{embedding_model_arn}",
+                    embedding_model_configuration=bedrock.CfnKnowledgeBase.EmbeddingModelConfigurationProperty(
+                        bedrock_embedding_model_configuration=bedrock.CfnKnowledgeBase.BedrockEmbeddingModelConfigurationProperty(
+                            dimensions=vector_index_configuration["dimension"],
+                            embedding_data_type="BINARY" if vector_index_configuration["quantization"] == "binary" else "FLOAT32"
+                        )
+                    )
                 )
             ),
             role_arn=kb_service_role_arn,            
@@ -202,14 +214,41 @@ class KnowledgeBase(Construct):
     def get_chunking_configuration_from_parameters(self,
                                                    knowledgebase_parameters: dict):
         
-        knowledgebase_chunking_parameters = knowledgebase_parameters['datasource_parameters']['chunking_configuration']
-        return bedrock.CfnDataSource.ChunkingConfigurationProperty(
-            chunking_strategy="FIXED_SIZE",
-            fixed_size_chunking_configuration=bedrock.CfnDataSource.FixedSizeChunkingConfigurationProperty(
-                max_tokens=1024,
-                overlap_percentage=30
+        chunking_parameters = get_chunking_parameters(knowledgebase_parameters)
+        strategy = chunking_parameters["strategy"]
+        if strategy == "fixed":
+            return bedrock.CfnDataSource.ChunkingConfigurationProperty(
+                chunking_strategy="FIXED_SIZE",
+                fixed_size_chunking_configuration=bedrock.CfnDataSource.FixedSizeChunkingConfigurationProperty(
+                    max_tokens=chunking_parameters["max_tokens"],
+                    overlap_percentage=chunking_parameters["overlap_percentage"]
+                )
             )
-        )
+        if strategy == "hierarchical":
+            return bedrock.CfnDataSource.ChunkingConfigurationProperty(
+                chunking_strategy="HIERARCHICAL",
+                hierarchical_chunking_configuration=bedrock.CfnDataSource.HierarchicalChunkingConfigurationProperty(
+                    level_configurations=[
+                        bedrock.CfnDataSource.HierarchicalChunkingLevelConfigurationProperty(
+                            max_tokens=chunking_parameters["parent_max_tokens"]
+                        ),
+                        bedrock.CfnDataSource.HierarchicalChunkingLevelConfigurationProperty(
+                            max_tokens=chunking_parameters["child_max_tokens"]
+                        )
+                    ],
+                    overlap_tokens=chunking_parameters["overlap_tokens"]
+                )
+            )
+        if strategy == "semantic":
+            return bedrock.CfnDataSource.ChunkingConfigurationProperty(
+                chunking_strategy="SEMANTIC",
+                semantic_chunking_configuration=bedrock.CfnDataSource.SemanticChunkingConfigurationProperty(
+                    max_tokens=chunking_parameters["max_tokens"],
+                    buffer_size=chunking_parameters["buffer_size"],
+                    breakpoint_percentile_threshold=chunking_parameters["breakpoint_percentile_threshold"]
+                )
+            )
+        return bedrock.CfnDataSource.ChunkingConfigurationProperty(chunking_strategy="NONE")
     
     def create_eventbridge_rule_for_kb_sync(self,
                                     knowledgebase_id: str,
@@ -225,6 +264,10 @@ class KnowledgeBase(Construct):
                 detail={
                     "bucket": {
                         "name": [datasource_bucket.bucket_name]
+                    },
+                    # metadata sidecars are uploaded before their documents and ingested with them
+                    "object": {
+                        "key": [{"anything-but": {"suffix": ".metadata.json"}}]
                     }
                 }
             )
@@ -0,0 +1,141 @@
+"""
+Parameters of the knowledge bases in the knowledge_bases context of cdk.json, validated and with defaults.
+The stack and the knowledge base benchmarks read them the same way, this module does not depend on CDK.
+"""
+
+# Output dimensions supported by the embedding models, and the models that can return binary embeddings
+EMBEDDING_MODEL_DIMENSIONS = {
+    "amazon.titan-embed-text-v1": (1536,),
+    "amazon.titan-embed-text-v2:0": (256, 512, 1024),
+    "cohere.embed-english-v3": (1024,),
+    "cohere.embed-multilingual-v3": (1024,),
+}
+BINARY_EMBEDDING_MODELS = ("amazon.titan-embed-text-v2:0", "cohere.embed-english-v3", "cohere.embed-multilingual-v3")
+FLOAT_SPACE_TYPES = ("l2", "innerproduct")
+
+def get_vector_index_configuration(knowledgebase_parameters: dict) -> dict:
+    """
+    The engine parameters of the vector index from vector_store_index_params, with defaults of the index
+    created before they were configurable. The same configuration sets the embedding dimensions and data type
+    of the knowledge base, so the embeddings always fit the index.
+
+    quantization is none (32-bit floats), fp16 (the faiss scalar quantizer, half the memory) or binary (binary
+    embeddings compared with the hamming distance, 1/32 of the memory). Titan Text Embeddings v2 vectors are
+    normalized, so the innerproduct space type ranks them like cosine similarity.
+    """
+    index_parameters = knowledgebase_parameters['vector_store_index_params']
+    embedding_model_id = knowledgebase_parameters['embedding_model_id']
+    configuration = {
+        "dimension": int(index_parameters.get("dimension", 1024)),
+        "space_type": index_parameters.get("space_type", "l2"),
+        "m": int(index_parameters.get("m", 16)),
+        "ef_construction": int(index_parameters.get("ef_construction", 512)),
+        "ef_search": int(index_parameters.get("ef_search", 512)),
+        "quantization": index_parameters.get("quantization", "none")
+    }
+    supported_dimensions = EMBEDDING_MODEL_DIMENSIONS.get(embedding_model_id)
+    if supported_dimensions and configuration["dimension"] not in supported_dimensions:
+        raise ValueError(f"{embedding_model_id} supports the dimensions {supported_dimensions}, "
+                         f"not {configuration['dimension']}")
+    if configuration["quantization"] == "binary":
+        if embedding_model_id not in BINARY_EMBEDDING_MODELS:
+            raise ValueError(f"{embedding_model_id} does not return binary embeddings")
+        if configuration["space_type"] != "hamming":
+            raise ValueError("Binary quantization needs the hamming space type")
+    elif configuration["quantization"] in ("none", "fp16"):
+        if configuration["space_type"] not in FLOAT_SPACE_TYPES:
+            raise ValueError(f"The space type of float vectors must be one of {FLOAT_SPACE_TYPES}")
+    elif configuration["quantization"] == "byte":
+        # Knowledge bases embed documents as floats or bits, never as the signed bytes of a byte vector
+        raise ValueError("Byte vectors cannot hold knowledge base embeddings, use fp16 or binary quantization")
+    else:
+        raise ValueError(f"Unknown quantization {configuration['quantization']}, use none, fp16 or binary")
+    if configuration["m"] < 2 or configuration["ef_construction"] < 1 or configuration["ef_search"] < 1:
+        raise ValueError("m must be at least 2, ef_construction and ef_search at least 1")
+    return configuration
+
+def get_knowledge_base_index_name(knowledgebase_parameters: dict) -> str:
+    """
+    The index name of the knowledge base storage configuration: the index_alias of vector_store_index_params
+    when it is set, so reindex_vector_index.py can move the knowledge base to a rebuilt index without
+    replacing it, otherwise the index_name.
+    """
+    index_parameters = knowledgebase_parameters['vector_store_index_params']
+    index_alias = index_parameters.get("index_alias")
+    if index_alias and index_alias == index_parameters["index_name"]:
+        raise ValueError("index_alias must differ from index_name, an alias cannot have the name of an index")
+    return index_alias or index_parameters["index_name"]
+
+
+CHUNKING_STRATEGIES = ("fixed", "hierarchical", "semantic", "none")
+# Bedrock limits of the chunk sizes, the largest input of the embedding models
+MAX_CHUNK_TOKENS = 8192
+
+def get_chunking_parameters(knowledgebase_parameters: dict) -> dict:
+    """
+    The chunking of the data source from chunking_configuration, sizes are in tokens:
+
+    fixed           chunks of chunk_size tokens, consecutive chunks share overlap tokens
+    hierarchical    child chunks of chunk_size tokens in parent chunks of parent_chunk_size tokens, chunks of
+                    a level share overlap tokens. Searches match child chunks and return their parent chunks.
+    semantic        chunks of related sentences of at most chunk_size tokens, a chunk ends where the distance
+                    between the embeddings of consecutive sentences (with buffer_size sentences around them) is
+                    above the breakpoint_percentile_threshold percentile
+    none            every document is one chunk
+    """
+    chunking = knowledgebase_parameters['datasource_parameters']['chunking_configuration']
+    strategy = chunking.get("chunking_strategy", "fixed")
+    if strategy == "none":
+        return {"strategy": "none"}
+    chunk_size = int(chunking.get("chunk_size", 300))
+    if not 1 <= chunk_size <= MAX_CHUNK_TOKENS:
+        raise ValueError(f"chunk_size must be between 1 and {MAX_CHUNK_TOKENS} tokens: {chunk_size}")
+    if strategy == "fixed":
+        overlap_percentage = round(int(chunking.get("overlap", chunk_size // 5)) * 100 / chunk_size)
+        if not 1 <= overlap_percentage <= 99:
+            raise ValueError(f"overlap must be between 1% and 99% of chunk_size: {overlap_percentage}%")
+        return {"strategy": "fixed", "max_tokens": chunk_size, "overlap_percentage": overlap_percentage}
+    if strategy == "hierarchical":
+        parent_chunk_size = int(chunking.get("parent_chunk_size", chunk_size * 5))
+        overlap = int(chunking.get("overlap", chunk_size // 5))
+        if not chunk_size < parent_chunk_size <= MAX_CHUNK_TOKENS:
+            raise ValueError(f"parent_chunk_size must be above chunk_size and at most {MAX_CHUNK_TOKENS} tokens")
+        if not 0 <= overlap < chunk_size:
+            raise ValueError("overlap must be below chunk_size")
+        return {"strategy": "hierarchical", "parent_max_tokens": parent_chunk_size, "child_max_tokens": chunk_size,
+                "overlap_tokens": overlap}
+    if strategy == "semantic":
+        buffer_size = int(chunking.get("buffer_size", 0))
+        threshold = int(chunking.get("breakpoint_percentile_threshold", 95))
+        if buffer_size not in (0, 1):
+            raise ValueError("buffer_size must be 0 or 1")
+        if not 50 <= threshold <= 99:
+            raise ValueError("breakpoint_percentile_threshold must be between 50 and 99")
+        return {"strategy": "semantic", "max_tokens": chunk_size, "buffer_size": buffer_size,
+                "breakpoint_percentile_threshold": threshold}
+    raise ValueError(f"Unknown chunking_strategy {strategy}, use one of {CHUNKING_STRATEGIES}")
+
+
+METADATA_FIELD_TYPES = ("keyword", "date", "integer", "long", "float", "boolean")
+
+def get_metadata_fields(knowledgebase_parameters: dict) -> dict:
+    """
+    The filterable metadata fields of the vector index from metadata_fields of vector_store_index_params,
+    {field name: OpenSearch field type}. Ingestion fills them from the metadataAttributes of the
+    <document>.metadata.json sidecar objects next to the documents in the data source bucket.
+    """
+    metadata_fields = knowledgebase_parameters['vector_store_index_params'].get("metadata_fields", {})
+    for name, field_type in metadata_fields.items():
+        if field_type not in METADATA_FIELD_TYPES:
+            raise ValueError(f"Metadata field {name} must have one of the types {METADATA_FIELD_TYPES}: {field_type}")
+    return metadata_fields
+
+def get_plan_filter_field(knowledgebase_parameters: dict):
+    """
+    The keyword metadata field that holds the plan name of the documents, retrievals of a claim review are
+    filtered on the plan of the claim. None when the knowledge base is not filtered by plan.
+    """
+    field = knowledgebase_parameters.get("plan_filter_field")
+    if field and get_metadata_fields(knowledgebase_parameters).get(field) != "keyword":
+        raise ValueError(f"plan_filter_field {field} must be a keyword field of metadata_fields")
+    return field
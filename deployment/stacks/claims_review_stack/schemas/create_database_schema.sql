@@ -1,50 +1,74 @@
-
-CREATE TABLE INSURED_PERSON (
-    insured_id SERIAL PRIMARY KEY,
-    insured_name VARCHAR(100) NOT NULL,
-    insured_group_number VARCHAR(100) NOT NULL,
-    insured_plan_name VARCHAR(100) NOT NULL,
-    insured_birth_date DATE NOT NULL,
-    insured_policy_number VARCHAR(100) NOT NULL UNIQUE,
-    phone_number VARCHAR(15),
-    address TEXT
-);
-
-CREATE TABLE PATIENT (
-    patient_id SERIAL PRIMARY KEY,
-    insured_id INT NOT NULL,
-    patient_firstname VARCHAR(100) NOT NULL,
-    patient_lastname VARCHAR(100) NOT NULL,
-    patient_birth_date DATE NOT NULL,
-    relationship_to_insured VARCHAR(100) NOT NULL,
-    phone_number VARCHAR(15),
-    sex VARCHAR(5),
-    address TEXT,    
-    FOREIGN KEY (insured_id) REFERENCES INSURED_PERSON(insured_id)
-);
-
-CREATE TABLE CLAIM (
-    claim_id SERIAL PRIMARY KEY,
-    patient_id INT NOT NULL,
-    claim_date DATE NOT NULL,
-    diagnosis_1 VARCHAR(50),
-    diagnosis_2 VARCHAR(50),
-    diagnosis_3 VARCHAR(50),
-    diagnosis_4 VARCHAR(50),
-    balanceDue DECIMAL(10, 2),
-    amountPaid DECIMAL(10, 2),
-    total_charges DECIMAL(10, 2) NOT NULL,
-    claim_status VARCHAR(50) NOT NULL,
-    FOREIGN KEY (patient_id) REFERENCES PATIENT(patient_id)
-);
-
-CREATE TABLE SERVICE (
-    service_id SERIAL PRIMARY KEY,
-    claim_id INT NOT NULL,
-    date_of_service DATE,
-    place_of_service VARCHAR(10),
-    type_of_service VARCHAR(10),
-    procedure_code INT,
-    charge_amount DECIMAL(10, 2),
-    FOREIGN KEY (claim_id) REFERENCES CLAIM(claim_id)
-);
+
+CREATE TABLE INSURED_PERSON (
+    insured_id SERIAL PRIMARY KEY,
+    insured_name VARCHAR(100) NOT NULL,
+    insured_group_number VARCHAR(100) NOT NULL,
+    insured_plan_name VARCHAR(100) NOT NULL,
+    insured_birth_date DATE NOT NULL,
+    insured_policy_number VARCHAR(100) NOT NULL UNIQUE,
+    phone_number VARCHAR(15),
+    address TEXT
+);
+
+CREATE TABLE PATIENT (
+    patient_id SERIAL PRIMARY KEY,
+    insured_id INT NOT NULL,
+    patient_firstname VARCHAR(100) NOT NULL,
+    patient_lastname VARCHAR(100) NOT NULL,
+    patient_birth_date DATE NOT NULL,
+    relationship_to_insured VARCHAR(100) NOT NULL,
+    phone_number VARCHAR(15),
+    sex VARCHAR(5),
+    address TEXT,    
+    FOREIGN KEY (insured_id) REFERENCES INSURED_PERSON(insured_id)
+);
+
+-- CLAIM and SERVICE are range partitioned by claim date, monthly partitions are created by the manage
+-- schema function. SERVICE carries the claim date of its claim so both are in the same month's partition.
+CREATE TABLE CLAIM (
+    claim_id SERIAL,
+    claim_reference_id VARCHAR(100),
+    patient_id INT NOT NULL,
+    claim_date DATE NOT NULL,
+    diagnosis_1 VARCHAR(50),
+    diagnosis_2 VARCHAR(50),
+    diagnosis_3 VARCHAR(50),
+    diagnosis_4 VARCHAR(50),
+    balanceDue DECIMAL(10, 2),
+    amountPaid DECIMAL(10, 2),
+    total_charges DECIMAL(10, 2) NOT NULL,
+    claim_status VARCHAR(50) NOT NULL,
+    CONSTRAINT claim_pkey PRIMARY KEY (claim_id, claim_date),
+    CONSTRAINT claim_claim_reference_id_key UNIQUE (claim_reference_id, claim_date),
+    FOREIGN KEY (patient_id) REFERENCES PATIENT(patient_id)
+) PARTITION BY RANGE (claim_date);
+
+CREATE TABLE CLAIM_DEFAULT PARTITION OF CLAIM DEFAULT;
+
+-- Claim history of a patient, newest first
+CREATE INDEX claim_patient_id_claim_date_idx ON CLAIM (patient_id, claim_date DESC);
+
+CREATE TABLE SERVICE (
+    service_id SERIAL,
+    claim_id INT NOT NULL,
+    claim_date DATE NOT NULL,
+    line_number INT NOT NULL,
+    date_of_service DATE,
+    place_of_service VARCHAR(10),
+    type_of_service VARCHAR(10),
+    procedure_code VARCHAR(10),
+    charge_amount DECIMAL(10, 2),
+    CONSTRAINT service_pkey PRIMARY KEY (service_id, claim_date),
+    CONSTRAINT service_claim_id_line_number_key UNIQUE (claim_id, claim_date, line_number),
+    FOREIGN KEY (claim_id, claim_date) REFERENCES CLAIM(claim_id, claim_date)
+) PARTITION BY RANGE (claim_date);
+
+CREATE TABLE SERVICE_DEFAULT PARTITION OF SERVICE DEFAULT;
+
+-- Fuzzy matching of OCR'd patient last names
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX patient_lastname_trgm_idx ON PATIENT USING GIN (lower(patient_lastname) gin_trgm_ops);
+CREATE INDEX patient_insured_id_idx ON PATIENT (insured_id);
+
+-- Roster loads upsert patients on their insured member, name and birth date
+CREATE UNIQUE INDEX patient_member_key ON PATIENT (insured_id, patient_lastname, patient_firstname, patient_birth_date);
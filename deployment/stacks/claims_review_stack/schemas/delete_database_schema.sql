@@ -4,3 +4,4 @@ DROP TABLE IF EXISTS CLAIM;
 DROP TABLE IF EXISTS PATIENT;
 DROP TABLE IF EXISTS INSURED_PERSON;
 
+DROP TABLE IF EXISTS SCHEMA_MIGRATIONS;
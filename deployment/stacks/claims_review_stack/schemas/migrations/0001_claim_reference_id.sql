@@ -0,0 +1,5 @@
+-- Claims are written idempotently, keyed by the claim reference id.
+-- Migrations up to 0005 also run once on databases that applied them before the ledger existed, and
+-- on partitioned CLAIM and SERVICE tables, where the named indexes exist already and are skipped.
+ALTER TABLE CLAIM ADD COLUMN IF NOT EXISTS claim_reference_id VARCHAR(100);
+CREATE UNIQUE INDEX IF NOT EXISTS claim_claim_reference_id_key ON CLAIM (claim_reference_id);
@@ -0,0 +1,7 @@
+-- Service lines are upserted on claim id and line number
+ALTER TABLE SERVICE ADD COLUMN IF NOT EXISTS line_number INT;
+UPDATE SERVICE s SET line_number = n.line_number FROM (
+    SELECT service_id, ROW_NUMBER() OVER (PARTITION BY claim_id ORDER BY service_id) AS line_number FROM SERVICE
+) n WHERE s.service_id = n.service_id AND s.line_number IS NULL;
+ALTER TABLE SERVICE ALTER COLUMN line_number SET NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS service_claim_id_line_number_key ON SERVICE (claim_id, line_number);
@@ -0,0 +1,2 @@
+-- CPT/HCPCS procedure codes are alphanumeric
+ALTER TABLE SERVICE ALTER COLUMN procedure_code TYPE VARCHAR(10);
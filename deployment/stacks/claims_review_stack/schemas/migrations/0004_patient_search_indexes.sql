@@ -0,0 +1,5 @@
+-- migration: no-transaction
+-- Fuzzy matching of OCR'd patient last names. The indexes are built without blocking roster loads.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS patient_lastname_trgm_idx ON PATIENT USING GIN (lower(patient_lastname) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS patient_insured_id_idx ON PATIENT (insured_id);
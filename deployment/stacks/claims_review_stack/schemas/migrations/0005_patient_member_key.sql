@@ -0,0 +1,3 @@
+-- migration: no-transaction
+-- Roster loads upsert patients on their insured member, name and birth date
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS patient_member_key ON PATIENT (insured_id, patient_lastname, patient_firstname, patient_birth_date);
@@ -13,6 +13,7 @@ class VectorStore(Construct):
                  kb_service_role_arn:str,
                  vector_store_collection_name:str,
                  vector_store_collection_description:str,
+                 data_access_principal_arns:list = None,
             **kwargs) -> None:
 
         super().__init__(scope, construct_id, **kwargs)
@@ -22,7 +23,8 @@ class VectorStore(Construct):
         aoss_data_access_policy, aoss_network_access_policy, aoss_encryption_policy = self.create_aoss_policies(
             create_vector_index_lambda_function=create_vector_index_lambda_function,
             vector_store_collection_name=vector_store_collection_name,
-            kb_service_role_arn=kb_service_role_arn
+            kb_service_role_arn=kb_service_role_arn,
+            data_access_principal_arns=data_access_principal_arns or []
         )
 
         #Create the AOSS Collection
@@ -46,7 +48,8 @@ class VectorStore(Construct):
     def create_aoss_policies(self,
             create_vector_index_lambda_function:_lambda.Function,
             vector_store_collection_name:str,
-            kb_service_role_arn:str
+            kb_service_role_arn:str,
+            data_access_principal_arns:list
     ):
                 #Create the neccessary network policy, encryption policy and data access policy for the OpenSearch serverless collection
         network_policy  = json.dumps([{
@@ -104,7 +107,9 @@ class VectorStore(Construct):
             }],
             "Principal": [
                 create_vector_index_lambda_function.role.role_arn,
-                kb_service_role_arn
+                kb_service_role_arn,
+                # roles or users that run the reindex script
+                *data_access_principal_arns
             ]
         }], indent=2)
 
@@ -160,10 +165,25 @@ class VectorStore(Construct):
         )
         vector_store_index_creation_function.node.add_dependency(layer)
 
+        # Polls the readiness of the new index, with the role of the creation function so the data access
+        # policy of the collection covers both
+        vector_store_index_ready_function = _lambda.Function(
+            self, 'vector_index_ready',
+            runtime=_lambda.Runtime.PYTHON_3_10,
+            code=_lambda.Code.from_asset('lambda/claims_review/create_vector_index'),
+            handler='index.is_complete',
+            timeout=Duration.seconds(90),
+            layers=[layer],
+            role=vector_store_index_creation_function.role
+        )
+
         #Create the Custom Resource Provider backed by Lambda Function
         self.vector_store_index_creation_provider = custom_resources.Provider(
             self, 'vector_store_index_creation_provider',
             on_event_handler=vector_store_index_creation_function,
+            is_complete_handler=vector_store_index_ready_function,
+            query_interval=Duration.seconds(10),
+            total_timeout=Duration.minutes(20),
             provider_function_name="vector-store-index-creation-provider"
         )
 
@@ -0,0 +1,140 @@
+"""
+Compares the chunking strategies of the EOC knowledge base data source offline. The sample EOC documents are
+chunked with each strategy, embedded and searched with the EOC sample questions and with sentences quoted from
+the documents. Reports per strategy:
+
+    Chunks              chunks written to the vector index
+    Embedding calls     calls to the embedding model during ingestion, semantic chunking also embeds sentences
+    Embedded tokens     tokens sent to the embedding model for the chunks, overlap is the share of them that
+                        repeats text of other chunks
+    Index MB            estimated size of the vector index: vectors, HNSW graph and stored text
+    Retrieved tokens    tokens of the top --k results of a query, the passages a review adds to the prompt.
+                        Hierarchical chunking returns the parent chunks of the matching child chunks.
+    Quote hit rate      share of the quoted sentences found in the retrieved passages
+
+Usage:
+    python source/claims_review_app/benchmarks/chunking_benchmark.py [--embedder hashing] [--k 5]
+        [--queries 200] [--strategies deployed,fixed-1024-30,fixed-300-20,hierarchical-1500-300,semantic-300,none]
+        [path ...]
+
+Strategies are the data source chunking_configuration of deployment/cdk.json (deployed) and the presets of
+STRATEGIES, in the same format. The index size uses the dimension, quantization and m of the deployed
+vector_store_index_params. See eoc_corpus.py for the embedders.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from prettytable import PrettyTable
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from eoc_corpus import (  # noqa: E402
+    chunk_documents,
+    count_tokens,
+    deployed_knowledgebase_parameters,
+    load_embedder,
+    sample_queries,
+    SAMPLE_QUESTIONS,
+)
+from stacks.claims_review_stack.knowledge_base_parameters import (  # noqa: E402
+    get_chunking_parameters,
+    get_vector_index_configuration,
+)
+
+STRATEGIES = {
+    "fixed-1024-30": {"chunking_strategy": "fixed", "chunk_size": 1024, "overlap": 307},
+    "fixed-300-20": {"chunking_strategy": "fixed", "chunk_size": 300, "overlap": 60},
+    "hierarchical-1500-300": {"chunking_strategy": "hierarchical", "parent_chunk_size": 1500, "chunk_size": 300,
+                              "overlap": 60},
+    "semantic-300": {"chunking_strategy": "semantic", "chunk_size": 300, "buffer_size": 0,
+                     "breakpoint_percentile_threshold": 95},
+    "none": {"chunking_strategy": "none"},
+}
+
+VECTOR_BYTES_PER_DIMENSION = {"none": 4, "fp16": 2, "binary": 1 / 8}
+
+
+def normalized(text: str) -> str:
+    return " ".join(text.split())
+
+
+def index_size_bytes(chunks: list, vector_index_configuration: dict) -> float:
+    """Vectors, level 0 HNSW links (2 * m neighbors of 4 bytes) and the stored text of the chunks"""
+    vector_bytes = vector_index_configuration["dimension"] * VECTOR_BYTES_PER_DIMENSION[
+        vector_index_configuration["quantization"]]
+    graph_bytes = 2 * vector_index_configuration["m"] * 4
+    text_bytes = sum(len(chunk["text"].encode("utf-8")) for chunk in chunks)
+    # hierarchical chunks also store the text of their parent chunk
+    text_bytes += sum(len(chunk["retrieved_text"].encode("utf-8")) for chunk in chunks
+                      if chunk["retrieved_text"] is not chunk["text"])
+    return len(chunks) * (vector_bytes + graph_bytes) + text_bytes
+
+
+def retrieve(chunks: list, vectors: np.ndarray, query_vector: np.ndarray, k: int) -> list:
+    """Texts of the top k chunks, a parent chunk is returned once for all of its matching children"""
+    top = np.argsort(-(vectors @ query_vector))[:k]
+    passages = []
+    for index in top:
+        if chunks[index]["retrieved_text"] not in passages:
+            passages.append(chunks[index]["retrieved_text"])
+    return passages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EOC chunking strategy benchmark")
+    parser.add_argument("paths", nargs="*", help="EOC documents or directories, the sample EOC documents by default")
+    parser.add_argument("--embedder", default="hashing", help="hashing, bedrock[:<model id>] or <module>:<attribute>")
+    parser.add_argument("--k", type=int, default=5, help="Results per query, the knowledge base default is 5")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--strategies", default=",".join(["deployed"] + list(STRATEGIES)))
+    args = parser.parse_args()
+
+    knowledgebase_parameters = deployed_knowledgebase_parameters()
+    vector_index_configuration = get_vector_index_configuration(knowledgebase_parameters)
+    dimension = vector_index_configuration["dimension"]
+    embedder = load_embedder(args.embedder)
+
+    documents, _ = chunk_documents(args.paths, {"strategy": "none"})
+    document_tokens = sum(count_tokens(document["text"]) for document in documents)
+    queries = sample_queries(documents, args.queries)
+    quotes = [normalized(query) for query in queries[len(SAMPLE_QUESTIONS):]]
+    query_vectors = embedder.embed(queries, dimension)
+    print(f"Read {len(documents)} documents of {document_tokens:,} tokens, searching with {len(queries)} queries")
+
+    table = PrettyTable()
+    table.field_names = ["Strategy", "Chunks", "Embedding calls", "Embedded tokens", "Overlap", "Index MB",
+                         f"Retrieved tokens (k={args.k})", "Quote hit rate"]
+    for name in args.strategies.split(","):
+        if name == "deployed":
+            chunking_configuration = knowledgebase_parameters["datasource_parameters"]["chunking_configuration"]
+        else:
+            chunking_configuration = STRATEGIES[name]
+        chunking_parameters = get_chunking_parameters({"datasource_parameters": {
+            "chunking_configuration": chunking_configuration}})
+        chunks, embedding_calls = chunk_documents(args.paths, chunking_parameters, embedder, dimension)
+        embedded_tokens = sum(count_tokens(chunk["text"]) for chunk in chunks)
+        vectors = embedder.embed([chunk["text"] for chunk in chunks], dimension)
+
+        retrieved_tokens, hits = [], 0
+        for position, query_vector in enumerate(query_vectors):
+            passages = retrieve(chunks, vectors, query_vector, args.k)
+            retrieved_tokens.append(sum(count_tokens(passage) for passage in passages))
+            if position >= len(SAMPLE_QUESTIONS):
+                quote = quotes[position - len(SAMPLE_QUESTIONS)]
+                hits += any(quote in normalized(passage) for passage in passages)
+
+        table.add_row([
+            f"{name} ({chunking_parameters['strategy']})" if name == "deployed" else name,
+            f"{len(chunks):,}", f"{embedding_calls:,}", f"{embedded_tokens:,}",
+            f"{embedded_tokens / document_tokens - 1:.0%}",
+            f"{index_size_bytes(chunks, vector_index_configuration) / 1024 / 1024:.2f}",
+            f"{np.mean(retrieved_tokens):,.0f}",
+            f"{hits / len(quotes):.0%}" if quotes else "-"
+        ])
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
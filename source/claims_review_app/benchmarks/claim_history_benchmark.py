@@ -0,0 +1,262 @@
+"""
+Seeds a local PostgreSQL with a claims history of the given size and measures the latency of the claim
+history query of the agent actions (listClaimsForInsured) on the monthly partitioned CLAIM table, against
+the same claims in a single unpartitioned table with the same (patient_id, claim_date) index.
+
+Usage:
+    python source/claims_review_app/benchmarks/claim_history_benchmark.py [--claims 50000000] [--patients 2000000]
+        [--months 36] [--history-months 12] [--iterations 200] [--skip-seed]
+        [--postgres-host localhost] [--postgres-port 5432] [--database claimsdatabase]
+        [--user postgres] [--password postgres]
+
+Each layout is seeded in its own schema (claims_partitioned, claims_unpartitioned) of the database, rows are
+generated by the server in batches of --batch-size claims. Seeding 50 million claims per layout takes a while
+and around 10 GB of disk per layout, use --skip-seed to measure again on the seeded schemas.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from datetime import date
+
+from prettytable import PrettyTable
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+CLAIMS_REVIEW_STACK_PATH = os.path.join(REPO_ROOT, "deployment", "stacks", "claims_review_stack")
+sys.path.insert(0, os.path.join(REPO_ROOT, "deployment", "lambda", "claims_review", "layer", "python"))
+sys.path.insert(0, os.path.join(REPO_ROOT, "deployment", "lambda", "claims_review", "manage_schema"))
+sys.path.insert(0, os.path.join(REPO_ROOT, "deployment", "lambda", "claims_review", "claims_review_agent_actions"))
+
+from postgres_client import PostgresClient  # noqa: E402
+from claim_partitions import add_months, month_start, create_month_partitions  # noqa: E402
+from sql_script import split_statements  # noqa: E402
+from claims_queries import CLAIM_HISTORY_QUERY  # noqa: E402
+
+SCAN_NODE = re.compile(r"Scan .*\bon (claim(?:_\w+)?)\b")
+
+PARTITIONED_SCHEMA = "claims_partitioned"
+UNPARTITIONED_SCHEMA = "claims_unpartitioned"
+
+# The claims tables before partitioning, with the history index added so only the table layout differs
+UNPARTITIONED_CLAIM_STATEMENTS = [
+    """
+    CREATE TABLE INSURED_PERSON (
+        insured_id SERIAL PRIMARY KEY,
+        insured_name VARCHAR(100) NOT NULL,
+        insured_group_number VARCHAR(100) NOT NULL,
+        insured_plan_name VARCHAR(100) NOT NULL,
+        insured_birth_date DATE NOT NULL,
+        insured_policy_number VARCHAR(100) NOT NULL UNIQUE,
+        phone_number VARCHAR(15),
+        address TEXT
+    )
+    """,
+    """
+    CREATE TABLE PATIENT (
+        patient_id SERIAL PRIMARY KEY,
+        insured_id INT NOT NULL REFERENCES INSURED_PERSON(insured_id),
+        patient_firstname VARCHAR(100) NOT NULL,
+        patient_lastname VARCHAR(100) NOT NULL,
+        patient_birth_date DATE NOT NULL,
+        relationship_to_insured VARCHAR(100) NOT NULL,
+        phone_number VARCHAR(15),
+        sex VARCHAR(5),
+        address TEXT
+    )
+    """,
+    "CREATE INDEX patient_insured_id_idx ON PATIENT (insured_id)",
+    """
+    CREATE TABLE CLAIM (
+        claim_id SERIAL PRIMARY KEY,
+        claim_reference_id VARCHAR(100) UNIQUE,
+        patient_id INT NOT NULL REFERENCES PATIENT(patient_id),
+        claim_date DATE NOT NULL,
+        diagnosis_1 VARCHAR(50),
+        diagnosis_2 VARCHAR(50),
+        diagnosis_3 VARCHAR(50),
+        diagnosis_4 VARCHAR(50),
+        balanceDue DECIMAL(10, 2),
+        amountPaid DECIMAL(10, 2),
+        total_charges DECIMAL(10, 2) NOT NULL,
+        claim_status VARCHAR(50) NOT NULL
+    )
+    """,
+    "CREATE INDEX claim_patient_id_claim_date_idx ON CLAIM (patient_id, claim_date DESC)",
+]
+
+SEED_INSURED_STATEMENT = """
+    INSERT INTO INSURED_PERSON (insured_name, insured_group_number, insured_plan_name, insured_birth_date, insured_policy_number)
+    SELECT 'Member ' || g, 'G' || (g % 1000), 'AnyHealth Plus', DATE '1950-01-01' + (g % 20000), 'BM-' || g
+    FROM generate_series(1, CAST(:insured_count AS INT)) g
+"""
+
+SEED_PATIENTS_STATEMENT = """
+    INSERT INTO PATIENT (insured_id, patient_firstname, patient_lastname, patient_birth_date, relationship_to_insured)
+    SELECT (g - 1) % :insured_count + 1, 'Patient', 'Name' || g, DATE '1950-01-01' + (g % 25000), 'Self'
+    FROM generate_series(1, CAST(:patient_count AS INT)) g
+"""
+
+# Claims of random patients on random days from start_date, deterministic for a claim number
+SEED_CLAIMS_STATEMENT = """
+    INSERT INTO CLAIM (claim_reference_id, patient_id, claim_date, diagnosis_1, total_charges, balanceDue, amountPaid, claim_status)
+    SELECT 'bench-' || g, (hashint4(g) & 2147483647) % :patient_count + 1,
+    CAST(:start_date AS DATE) + (hashint4(-g) & 2147483647) % CAST(:day_count AS INT),
+    'J45.909', 100 + g % 900, 0, 100 + g % 900, 'CLOSED'
+    FROM generate_series(CAST(:first_claim AS INT), CAST(:last_claim AS INT)) g
+"""
+
+TABLE_SIZE_QUERY = """
+    SELECT COALESCE(SUM(pg_table_size(c.oid)), 0) AS table_bytes, COALESCE(SUM(pg_indexes_size(c.oid)), 0) AS index_bytes
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = :schema_name AND c.relkind = 'r' AND (c.relname = 'claim' OR c.relname LIKE 'claim\\_%')
+"""
+
+
+def param(name, value):
+    if isinstance(value, str):
+        return {"name": name, "value": {"stringValue": value}}
+    return {"name": name, "value": {"longValue": value}}
+
+
+def create_client(args, schema_name):
+    client = PostgresClient(
+        host=args.postgres_host,
+        port=args.postgres_port,
+        database=args.database,
+        credentials={"username": args.user, "password": args.password},
+        use_tls=False,
+        # seeding statements run for minutes
+        connect_timeout_seconds=3600
+    )
+    client.execute_statement(f"CREATE SCHEMA IF NOT EXISTS {schema_name}")
+    client.execute_statement(f"SET search_path TO {schema_name}, public")
+    return client
+
+
+def create_partitioned_layout(client, first_month, last_month):
+    with open(os.path.join(CLAIMS_REVIEW_STACK_PATH, "schemas", "create_database_schema.sql")) as f:
+        for statement in split_statements(f.read()):
+            client.execute_statement(statement)
+    month = first_month
+    while month <= last_month:
+        create_month_partitions(client, month)
+        month = add_months(month, 1)
+
+
+def create_unpartitioned_layout(client):
+    for statement in UNPARTITIONED_CLAIM_STATEMENTS:
+        client.execute_statement(statement)
+
+
+def seed(client, args, start_date, day_count):
+    insured_count = max(1, args.patients // args.patients_per_policy)
+    client.execute_statement(SEED_INSURED_STATEMENT, [param("insured_count", insured_count)])
+    client.execute_statement(SEED_PATIENTS_STATEMENT, [
+        param("insured_count", insured_count), param("patient_count", args.patients)
+    ])
+    started_at = time.perf_counter()
+    for first_claim in range(1, args.claims + 1, args.batch_size):
+        last_claim = min(args.claims, first_claim + args.batch_size - 1)
+        client.execute_statement(SEED_CLAIMS_STATEMENT, [
+            param("patient_count", args.patients),
+            param("start_date", start_date.isoformat()),
+            param("day_count", day_count),
+            param("first_claim", first_claim),
+            param("last_claim", last_claim),
+        ])
+        elapsed = time.perf_counter() - started_at
+        print(f"  {last_claim:,} claims seeded, {last_claim / elapsed:,.0f} claims/s")
+    client.execute_statement("VACUUM ANALYZE")
+    return insured_count
+
+
+def scanned_claim_tables(plan_lines: list) -> set:
+    """CLAIM tables and partitions in the scan nodes of an EXPLAIN ANALYZE plan, pruned partitions are left out"""
+    return {match.group(1) for line in plan_lines for match in [SCAN_NODE.search(line)] if match}
+
+
+def history_parameters(policy_number, history_months):
+    return [
+        param("insured_policy_number", policy_number),
+        param("months", history_months),
+        param("max_results", 100),
+    ]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(client, args, insured_count):
+    random.seed(42)
+    policy_numbers = [f"BM-{random.randint(1, insured_count)}" for _ in range(args.iterations + args.warm_up)]
+    for policy_number in policy_numbers[:args.warm_up]:
+        client.execute_statement(CLAIM_HISTORY_QUERY, history_parameters(policy_number, args.history_months))
+    latencies = []
+    rows = 0
+    for policy_number in policy_numbers[args.warm_up:]:
+        started_at = time.perf_counter()
+        result = client.execute_statement(CLAIM_HISTORY_QUERY, history_parameters(policy_number, args.history_months))
+        latencies.append((time.perf_counter() - started_at) * 1000)
+        rows += len(result["records"])
+
+    explain = client.execute_statement(
+        "EXPLAIN ANALYZE " + CLAIM_HISTORY_QUERY, history_parameters(policy_numbers[0], args.history_months)
+    )
+    plan_lines = [record[0]["stringValue"] for record in explain["records"]]
+    return latencies, rows / len(latencies), len(scanned_claim_tables(plan_lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Claim history query benchmark on partitioned and unpartitioned claims")
+    parser.add_argument("--claims", type=int, default=50_000_000)
+    parser.add_argument("--patients", type=int, default=2_000_000)
+    parser.add_argument("--patients-per-policy", type=int, default=2)
+    parser.add_argument("--months", type=int, default=36, help="Months of claims to seed, up to the current month")
+    parser.add_argument("--history-months", type=int, default=12, help="months parameter of the history query")
+    parser.add_argument("--batch-size", type=int, default=1_000_000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warm-up", type=int, default=20)
+    parser.add_argument("--skip-seed", action="store_true", help="Measure on the schemas seeded by an earlier run")
+    parser.add_argument("--postgres-host", default="localhost")
+    parser.add_argument("--postgres-port", type=int, default=5432)
+    parser.add_argument("--database", default="claimsdatabase")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="postgres")
+    args = parser.parse_args()
+
+    last_month = month_start(date.today())
+    first_month = add_months(last_month, 1 - args.months)
+    day_count = (date.today() - first_month).days + 1
+    layouts = {
+        "partitioned (monthly)": (PARTITIONED_SCHEMA, lambda client: create_partitioned_layout(client, first_month, last_month)),
+        "unpartitioned": (UNPARTITIONED_SCHEMA, create_unpartitioned_layout),
+    }
+
+    table = PrettyTable()
+    table.field_names = ["Layout", "Claims", "CLAIM tables scanned", "Rows per query", "p50 (ms)", "p99 (ms)",
+                         "Mean (ms)", "Table size (MB)", "Index size (MB)"]
+    for layout, (schema_name, create_layout) in layouts.items():
+        client = create_client(args, schema_name)
+        insured_count = max(1, args.patients // args.patients_per_policy)
+        if not args.skip_seed:
+            print(f"Seeding {args.claims:,} claims from {first_month} into {schema_name}")
+            client.execute_statement(f"DROP SCHEMA {schema_name} CASCADE")
+            client.execute_statement(f"CREATE SCHEMA {schema_name}")
+            create_layout(client)
+            insured_count = seed(client, args, first_month, day_count)
+        latencies, rows_per_query, tables_scanned = measure(client, args, insured_count)
+        sizes = client.execute_statement(TABLE_SIZE_QUERY, [param("schema_name", schema_name)])["records"][0]
+        table.add_row([layout, f"{args.claims:,}", tables_scanned, f"{rows_per_query:.1f}",
+                       f"{percentile(latencies, 0.5):.2f}", f"{percentile(latencies, 0.99):.2f}",
+                       f"{sum(latencies) / len(latencies):.2f}",
+                       f"{int(sizes[0]['stringValue']) / 2 ** 20:,.0f}", f"{int(sizes[1]['stringValue']) / 2 ** 20:,.0f}"])
+        client.close()
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
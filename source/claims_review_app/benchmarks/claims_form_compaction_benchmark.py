@@ -0,0 +1,137 @@
+"""
+Reports the size of the claim form data returned to the claims review agent before and after compaction.
+
+Usage:
+    python source/claims_review_app/benchmarks/claims_form_compaction_benchmark.py [--token-budget N] [path ...]
+
+Each path is an extracted claim form (the <claim reference id>/<claim form>.json written to the claims
+review bucket) or a directory of them. Without paths, forms modelled on the CMS-1500 blueprint and the
+sample claims in assets/data/claims_review/cms_1500 are used.
+"""
+import argparse
+import json
+import os
+import sys
+
+from prettytable import PrettyTable
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+BLUEPRINT_SCHEMA_PATH = os.path.join(REPO_ROOT, "deployment", "stacks", "claims_review_stack", "schemas", "blueprint_schema.json")
+sys.path.insert(0, os.path.join(REPO_ROOT, "deployment", "lambda", "claims_review", "layer", "python"))
+
+from claims_form_compaction import compact_claims_form, estimate_tokens  # noqa: E402
+
+SAMPLE_VALUES = [
+    {
+        "insurance_program": "Group Health Plan",
+        "insured_id_number": "11-2234-10190",
+        "patient_name": "Doe, John",
+        "patient_date_of_birth": "1960-10-10",
+        "insured_name": "Doe, Jane",
+        "patient_address": "123 Any Street, Any City, CA 92127",
+        "patient_relationship_to_insured": "Spouse",
+        "insured_address": "123 Any Street, Any City, CA 92127",
+        "insured_phone_number": "858 555 0100",
+        "patient_sex": "M",
+        "insured_insurance_plan_name": "AnyHealth Plus",
+        "another_health_benefit_plan_indicator": False,
+        "diagnosis_1": "J45.909",
+        "diagnosis_2": "R05.9",
+        "total_charges": 425.0,
+        "amount_paid": 0.0,
+    },
+    {
+        "insurance_program": "Group Health Plan",
+        "insured_id_number": "12-1134-90110",
+        "patient_name": "Silva, Ana",
+        "patient_date_of_birth": "1992-06-15",
+        "insured_name": "Silva, Ana Carolina",
+        "patient_relationship_to_insured": "Self",
+        "patient_sex": "F",
+        "insured_insurance_plan_name": "AnyHealth Premium",
+        "diagnosis_1": "M54.5",
+        "total_charges": 980.0,
+        "amount_paid": 100.0,
+    },
+    {
+        "insurance_program": "Group Health Plan",
+        "insured_id_number": "90-1234-11012",
+        "patient_name": "Jackson, Mateo",
+        "patient_date_of_birth": "1985-11-03",
+        "insured_name": "Jackson, Mateo",
+        "patient_address": "404 Anywhere Street, Nowhere Town, USA",
+        "patient_relationship_to_insured": "Self",
+        "insured_address": "404 Anywhere Street, Nowhere Town, USA",
+        "patient_sex": "M",
+        "insured_insurance_plan_name": "AnyHealth Standard",
+        "diagnosis_1": "S93.401A",
+        "diagnosis_2": "W10.9XXA",
+        "diagnosis_3": "Y93.01",
+        "total_charges": 1840.0,
+        "amount_paid": 0.0,
+    },
+]
+SAMPLE_SERVICE_LINES = [2, 4, 6]
+
+
+def sample_forms():
+    """Forms shaped like a BDA inference_result: every blueprint field present, empty when not on the form"""
+    with open(BLUEPRINT_SCHEMA_PATH) as f:
+        blueprint_schema = json.load(f)
+    service_line_fields = blueprint_schema["definitions"]["Procedure_Service_Supplies"]["properties"]
+    forms = {}
+    for number, (values, service_lines) in enumerate(zip(SAMPLE_VALUES, SAMPLE_SERVICE_LINES), start=1):
+        form = {field: values.get(field, "") for field in blueprint_schema["properties"]}
+        form["medical_procedures"] = [
+            {
+                **{field: "" for field in service_line_fields},
+                "service_start_date": f"2024-12-{line + 1:02d}",
+                "service_end_date": f"2024-12-{line + 1:02d}",
+                "place_of_service": "11",
+                "procedure_code": str(99212 + line % 4),
+                "diagnosis_code": "A",
+                "charge_amount": 75.0 + 25 * line,
+            }
+            for line in range(service_lines)
+        ]
+        forms[f"sample{number}_cms-1500-P (synthetic)"] = form
+    return forms
+
+
+def load_forms(paths):
+    forms = {}
+    for path in paths:
+        file_paths = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".json")] \
+            if os.path.isdir(path) else [path]
+        for file_path in file_paths:
+            with open(file_path) as f:
+                forms[os.path.basename(file_path)] = json.load(f)
+    return forms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Claim form compaction benchmark")
+    parser.add_argument("paths", nargs="*", help="Extracted claim form JSON files or directories")
+    parser.add_argument("--token-budget", type=int, default=0, help="Token budget to apply, 0 for none")
+    args = parser.parse_args()
+
+    forms = load_forms(args.paths) if args.paths else sample_forms()
+    table = PrettyTable()
+    table.field_names = ["Claim Form", "Fields Before", "Fields After", "Tokens Before", "Tokens After", "Reduction", "Omitted Fields"]
+    total_before = total_after = 0
+    for name, form in forms.items():
+        compacted, omitted_fields = compact_claims_form(form, token_budget=args.token_budget)
+        tokens_before = estimate_tokens({"claims_form_data": form})
+        tokens_after = estimate_tokens({"claims_form_data": compacted})
+        total_before += tokens_before
+        total_after += tokens_after
+        table.add_row([name, len(form), len(compacted), tokens_before, tokens_after,
+                       f"{(1 - tokens_after / tokens_before) * 100:.1f}%", len(omitted_fields)])
+    print(table)
+    if total_before:
+        print(f"Total: {total_before} -> {total_after} tokens per get_claims_form_data response "
+              f"({(1 - total_after / total_before) * 100:.1f}% fewer input tokens on every later orchestration turn)")
+
+
+if __name__ == "__main__":
+    main()
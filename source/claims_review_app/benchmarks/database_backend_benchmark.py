@@ -0,0 +1,187 @@
+"""
+Compares the per query latency of the claims database backends of the agent actions Lambda: the RDS
+Data API (DATA_API) and a pg8000 connection held across invocations (POSTGRES).
+
+Usage:
+    python source/claims_review_app/benchmarks/database_backend_benchmark.py [--iterations N] [--create-schema]
+        [--postgres-host localhost] [--postgres-port 5432] [--database claimsdatabase]
+        [--user postgres] [--password postgres]
+        [--data-api-endpoint-url http://localhost:8080]
+
+Runs against a local PostgreSQL. The Data API backend needs a Data API emulator in front of the same
+database, such as local-data-api (https://github.com/koxudaxi/local-data-api), and is skipped without
+--data-api-endpoint-url. --create-schema loads the claims schema and initial data into an empty database.
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+import boto3
+from prettytable import PrettyTable
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+CLAIMS_REVIEW_STACK_PATH = os.path.join(REPO_ROOT, "deployment", "stacks", "claims_review_stack")
+sys.path.insert(0, os.path.join(REPO_ROOT, "deployment", "lambda", "claims_review", "layer", "python"))
+sys.path.insert(0, os.path.join(REPO_ROOT, "deployment", "lambda", "claims_review", "manage_schema"))
+sys.path.insert(0, os.path.join(REPO_ROOT, "deployment", "lambda", "claims_review", "claims_review_agent_actions"))
+
+from data_api_client import DataApiClient  # noqa: E402
+from postgres_client import PostgresClient  # noqa: E402
+from sql_script import split_statements  # noqa: E402
+from claims_queries import (  # noqa: E402
+    MEMBER_DETAILS_QUERY,
+    PATIENT_DETAILS_QUERY,
+    MEMBER_AND_PATIENT_DETAILS_QUERY,
+    CREATE_CLAIM_QUERY,
+    DELETE_CLAIM_WITH_OTHER_DATE_QUERY,
+    CREATE_SERVICE_QUERY,
+    DELETE_EXTRA_SERVICES_QUERY,
+)
+
+# ARNs accepted by local-data-api
+DUMMY_CLUSTER_ARN = "arn:aws:rds:us-east-1:123456789012:cluster:dummy"
+DUMMY_SECRET_ARN = "arn:aws:secretsmanager:us-east-1:123456789012:secret:dummy"
+
+
+def param(name, value):
+    if isinstance(value, str):
+        return {"name": name, "value": {"stringValue": value}}
+    if isinstance(value, int):
+        return {"name": name, "value": {"longValue": value}}
+    return {"name": name, "value": {"doubleValue": value}}
+
+
+LOOKUP_PARAMETERS = [
+    param("insured_policy_number", "11-2234-10190"),
+    param("patient_lastname", "Doe"),
+    param("patient_birth_date", "1960-10-10"),
+]
+
+
+def write_claim(client, claim_reference_id):
+    """The createClaim write: the claim and three service lines in one transaction"""
+    def work(transaction_id):
+        client.execute_statement(DELETE_CLAIM_WITH_OTHER_DATE_QUERY, parameters=[
+            param("claim_reference_id", claim_reference_id), param("claim_date", "2024-12-02")
+        ], transaction_id=transaction_id)
+        result = client.execute_statement(CREATE_CLAIM_QUERY, parameters=[
+            param("claim_reference_id", claim_reference_id),
+            param("patient_id", 1),
+            param("claim_date", "2024-12-02"),
+            param("diagnosis_1", "J45.909"),
+            param("diagnosis_2", ""),
+            param("diagnosis_3", ""),
+            param("diagnosis_4", ""),
+            param("total_charges", 425.0),
+            param("amountPaid", 0.0),
+            param("balanceDue", 425.0),
+            param("claim_status", "NEW"),
+        ], transaction_id=transaction_id)
+        claim_id = result["records"][0][0]["longValue"]
+        client.batch_execute_statement(CREATE_SERVICE_QUERY, [
+            [
+                param("claim_id", claim_id),
+                param("claim_date", "2024-12-02"),
+                param("line_number", line_number),
+                param("date_of_service", "2024-12-02"),
+                param("place_of_service", "11"),
+                param("type_of_service", ""),
+                param("procedure_code", "99213"),
+                param("charge_amount", 125.0),
+            ]
+            for line_number in range(1, 4)
+        ], transaction_id=transaction_id)
+        client.execute_statement(DELETE_EXTRA_SERVICES_QUERY, parameters=[
+            param("claim_id", claim_id), param("claim_date", "2024-12-02"), param("line_count", 3)
+        ], transaction_id=transaction_id)
+    client.run_in_transaction(work)
+
+
+def benchmark_queries(run_id):
+    return {
+        "member details": lambda client, key: client.execute_statement(MEMBER_DETAILS_QUERY, LOOKUP_PARAMETERS[:1]),
+        "patient details": lambda client, key: client.execute_statement(PATIENT_DETAILS_QUERY, LOOKUP_PARAMETERS),
+        "member and patient details": lambda client, key: client.execute_statement(MEMBER_AND_PATIENT_DETAILS_QUERY, LOOKUP_PARAMETERS),
+        "create claim (transaction, 3 service lines)": lambda client, key: write_claim(client, f"benchmark-{run_id}-{key}"),
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(client, query, iterations, warm_up, backend):
+    for i in range(warm_up):
+        query(client, f"{backend}-warm-up-{i}")
+    latencies = []
+    for i in range(iterations):
+        started_at = time.perf_counter()
+        query(client, f"{backend}-{i}")
+        latencies.append((time.perf_counter() - started_at) * 1000)
+    return latencies
+
+
+def create_schema(client):
+    for file_name in ("schemas/create_database_schema.sql", "data/initial_data.sql"):
+        with open(os.path.join(CLAIMS_REVIEW_STACK_PATH, file_name)) as f:
+            for statement in split_statements(f.read()):
+                client.execute_statement(statement)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Claims database backend benchmark")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warm-up", type=int, default=10)
+    parser.add_argument("--postgres-host", default="localhost")
+    parser.add_argument("--postgres-port", type=int, default=5432)
+    parser.add_argument("--database", default="claimsdatabase")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="postgres")
+    parser.add_argument("--data-api-endpoint-url", help="Endpoint of a Data API emulator for the same database")
+    parser.add_argument("--create-schema", action="store_true", help="Load the claims schema and initial data first")
+    args = parser.parse_args()
+
+    backends = {
+        "POSTGRES": PostgresClient(
+            host=args.postgres_host,
+            port=args.postgres_port,
+            database=args.database,
+            credentials={"username": args.user, "password": args.password},
+            use_tls=False
+        )
+    }
+    if args.data_api_endpoint_url:
+        backends["DATA_API"] = DataApiClient(
+            DUMMY_CLUSTER_ARN,
+            DUMMY_SECRET_ARN,
+            args.database,
+            client=boto3.client(
+                "rds-data",
+                endpoint_url=args.data_api_endpoint_url,
+                region_name="us-east-1",
+                aws_access_key_id="local",
+                aws_secret_access_key="local"
+            )
+        )
+    else:
+        print("No --data-api-endpoint-url, only the POSTGRES backend is measured")
+
+    if args.create_schema:
+        create_schema(backends["POSTGRES"])
+
+    table = PrettyTable()
+    table.field_names = ["Query", "Backend", "Iterations", "p50 (ms)", "p99 (ms)", "Mean (ms)"]
+    run_id = uuid.uuid4().hex[:8]
+    for name, query in benchmark_queries(run_id).items():
+        for backend, client in backends.items():
+            latencies = measure(client, query, args.iterations, args.warm_up, backend)
+            table.add_row([name, backend, len(latencies), f"{percentile(latencies, 0.5):.2f}",
+                           f"{percentile(latencies, 0.99):.2f}", f"{sum(latencies) / len(latencies):.2f}"])
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+Evidence of Coverage corpus for the knowledge base benchmarks: reads the sample EOC documents, splits them into
+chunks like the chunking strategies of knowledge base data sources (fixed size, hierarchical, semantic or
+none), and embeds text with a pluggable embedder.
+
+Embedders:
+    hashing                 offline stand-in, hashed words and word pairs with a random projection
+    bedrock[:<model id>]    a Bedrock embedding model, amazon.titan-embed-text-v2:0 by default
+    <module>:<attribute>    any object or class with embed(texts, dimension) returning normalized float32 rows
+
+The hashing embedder needs no network access and ranks text by shared vocabulary, which is enough to compare
+index settings against exact search. Use a Bedrock model to measure with the embeddings the knowledge base uses.
+
+PDF documents are read with pypdf, text documents (.txt, .md) as they are.
+"""
+import hashlib
+import importlib
+import json
+import os
+import random
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+EOC_DIRECTORY = os.path.join(REPO_ROOT, "assets", "data", "claims_review", "eoc")
+sys.path.insert(0, os.path.join(REPO_ROOT, "deployment"))
+
+from stacks.claims_review_stack.knowledge_base_parameters import get_chunking_parameters  # noqa: E402
+
+TOKEN = re.compile(r"\w+|[^\w\s]")
+WORD = re.compile(r"[a-z0-9]+")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+SAMPLE_QUESTIONS = [
+    "What is the copay for a primary care visit?",
+    "What is the copay for a specialist office visit?",
+    "Is emergency room care covered outside the network?",
+    "What is the annual deductible?",
+    "What is the maximum out-of-pocket amount?",
+    "Are preventive care services covered at no cost?",
+    "Does the plan cover physical therapy?",
+    "Is prior authorization required for an MRI?",
+    "What is the coinsurance for inpatient hospital stays?",
+    "Are prescription drugs covered and what tiers apply?",
+    "Is ambulance transportation covered?",
+    "Does the plan cover mental health outpatient services?",
+    "What is covered for urgent care?",
+    "Are lab tests and x-rays covered?",
+    "Is durable medical equipment covered?",
+    "What services are excluded from coverage?",
+    "How do I file an appeal for a denied claim?",
+    "Is skilled nursing facility care covered?",
+    "Does the plan cover routine eye exams?",
+    "Are dental services included in the plan?",
+]
+
+
+def deployed_knowledgebase_parameters(knowledge_base_name: str = None) -> dict:
+    """Parameters of a knowledge base in the knowledge_bases context of deployment/cdk.json, the first by default"""
+    with open(os.path.join(REPO_ROOT, "deployment", "cdk.json")) as f:
+        knowledge_bases = json.load(f)["context"]["knowledge_bases"]
+    return knowledge_bases[knowledge_base_name] if knowledge_base_name else next(iter(knowledge_bases.values()))
+
+
+def deployed_chunking_parameters() -> dict:
+    return get_chunking_parameters(deployed_knowledgebase_parameters())
+
+
+def document_paths(paths: list) -> list:
+    """The PDF and text documents of the paths, files or directories, the sample EOC documents by default"""
+    found = []
+    for path in paths or [EOC_DIRECTORY]:
+        if os.path.isdir(path):
+            found += [os.path.join(path, name) for name in sorted(os.listdir(path))
+                      if name.lower().endswith((".pdf", ".txt", ".md"))]
+        else:
+            found.append(path)
+    return found
+
+
+def read_document(path: str) -> str:
+    if path.lower().endswith(".pdf"):
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise RuntimeError("Reading PDF documents needs pypdf: pip install pypdf")
+        return "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def count_tokens(text: str) -> int:
+    """Approximates the tokens of the embedding model with words and punctuation marks"""
+    return sum(1 for _ in TOKEN.finditer(text))
+
+
+def token_windows(text: str, max_tokens: int, overlap_tokens: int = 0) -> list:
+    """Consecutive parts of at most max_tokens tokens of the text, sharing overlap_tokens tokens"""
+    spans = [match.span() for match in TOKEN.finditer(text)]
+    step = max(1, max_tokens - overlap_tokens)
+    windows = []
+    for start in range(0, len(spans), step):
+        window = spans[start:start + max_tokens]
+        windows.append(text[window[0][0]:window[-1][1]])
+        if start + max_tokens >= len(spans):
+            break
+    return windows
+
+
+def fixed_size_chunks(text: str, max_tokens: int, overlap_percentage: int) -> list:
+    """Chunks of at most max_tokens tokens, consecutive chunks share overlap_percentage of their tokens"""
+    return token_windows(text, max_tokens, max_tokens * overlap_percentage // 100)
+
+
+def hierarchical_chunks(text: str, parent_max_tokens: int, child_max_tokens: int, overlap_tokens: int) -> list:
+    """Child chunks as {"text", "parent"} dicts, the parent chunk is the text a search returns for the child"""
+    return [{"text": child, "parent": parent}
+            for parent in token_windows(text, parent_max_tokens, overlap_tokens)
+            for child in token_windows(parent, child_max_tokens, overlap_tokens)]
+
+
+def semantic_chunks(text: str, embedder, dimension: int, max_tokens: int, buffer_size: int = 0,
+                    breakpoint_percentile_threshold: int = 95) -> tuple:
+    """
+    Chunks of consecutive sentences, split where the embeddings of neighbouring sentences (each with
+    buffer_size sentences around it) are further apart than the breakpoint percentile of the distances, and
+    split again at max_tokens. Returns the chunks and the number of sentence groups that were embedded.
+    """
+    parts = sentences(text, min_words=1)
+    if len(parts) < 2:
+        return token_windows(text, max_tokens) if parts else [], len(parts)
+    groups = [" ".join(parts[max(0, i - buffer_size):i + buffer_size + 1]) for i in range(len(parts))]
+    vectors = embedder.embed(groups, dimension)
+    distances = 1 - np.sum(vectors[:-1] * vectors[1:], axis=1)
+    threshold = np.percentile(distances, breakpoint_percentile_threshold)
+    chunks, current = [], [parts[0]]
+    for sentence, distance in zip(parts[1:], distances):
+        if distance > threshold:
+            chunks.append(" ".join(current))
+            current = []
+        current.append(sentence)
+    chunks.append(" ".join(current))
+    return [window for chunk in chunks for window in token_windows(chunk, max_tokens)], len(groups)
+
+
+def chunk_documents(paths: list, chunking_parameters: dict, embedder=None, dimension: int = 1024) -> tuple:
+    """
+    Chunks of the documents as {"document", "text", "retrieved_text"} dicts for the chunking parameters of
+    knowledge_base_parameters.get_chunking_parameters, and the number of embedding calls of the ingestion,
+    which for semantic chunking include the sentences. Semantic chunking needs the embedder.
+    """
+    chunks, embedding_calls = [], 0
+    strategy = chunking_parameters["strategy"]
+    for path in document_paths(paths):
+        text = read_document(path)
+        document = os.path.basename(path)
+        if strategy == "fixed":
+            parts = [{"text": chunk, "parent": chunk} for chunk in fixed_size_chunks(
+                text, chunking_parameters["max_tokens"], chunking_parameters["overlap_percentage"])]
+        elif strategy == "hierarchical":
+            parts = hierarchical_chunks(text, chunking_parameters["parent_max_tokens"],
+                                        chunking_parameters["child_max_tokens"], chunking_parameters["overlap_tokens"])
+        elif strategy == "semantic":
+            semantic, sentence_calls = semantic_chunks(
+                text, embedder, dimension, chunking_parameters["max_tokens"], chunking_parameters["buffer_size"],
+                chunking_parameters["breakpoint_percentile_threshold"])
+            embedding_calls += sentence_calls
+            parts = [{"text": chunk, "parent": chunk} for chunk in semantic]
+        else:
+            parts = [{"text": text, "parent": text}]
+        embedding_calls += len(parts)
+        chunks += [{"document": document, "text": part["text"], "retrieved_text": part["parent"]} for part in parts]
+    return chunks, embedding_calls
+
+
+def sentences(text: str, min_words: int = 6) -> list:
+    return [sentence.strip() for sentence in SENTENCE_END.split(" ".join(text.split()))
+            if len(sentence.split()) >= min_words]
+
+
+def expand_corpus(chunks: list, size: int, seed: int = 7) -> list:
+    """
+    Grows the corpus to size chunks with synthetic chunks of sentences drawn from the real ones, to measure
+    indexes at the size of a corpus with many plans. Synthetic chunks are about as long as the real ones.
+    """
+    if len(chunks) >= size:
+        return chunks
+    generator = random.Random(seed)
+    pool = [sentence for chunk in chunks for sentence in sentences(chunk["text"])]
+    average_tokens = sum(count_tokens(chunk["text"]) for chunk in chunks) / len(chunks)
+    expanded = list(chunks)
+    while len(expanded) < size:
+        parts, tokens = [], 0
+        while tokens < average_tokens:
+            sentence = generator.choice(pool)
+            parts.append(sentence)
+            tokens += count_tokens(sentence)
+        expanded.append({"document": "synthetic", "text": " ".join(parts)})
+    return expanded
+
+
+def sample_queries(chunks: list, count: int, seed: int = 11) -> list:
+    """The sample questions followed by sentences of the chunks, like questions quoting the EOC"""
+    generator = random.Random(seed)
+    queries = list(SAMPLE_QUESTIONS[:count])
+    pool = [sentence for chunk in chunks for sentence in sentences(chunk["text"], min_words=8)]
+    while len(queries) < count and pool:
+        queries.append(generator.choice(pool))
+    return queries
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+
+class HashingEmbedder:
+    """
+    Offline embedding stand-in: words and word pairs are hashed into hashed_features signed counts, which a
+    fixed random projection turns into dense vectors of the dimension, like the dense vectors of an embedding
+    model. The sign of a projected value keeps the angle between vectors, so binary vectors behave like
+    binary embeddings.
+    """
+
+    name = "hashing"
+    hashed_features = 8192
+
+    def __init__(self, seed: int = 5):
+        self.seed = seed
+        self.projections = {}
+
+    def projection(self, dimension: int) -> np.ndarray:
+        if dimension not in self.projections:
+            generator = np.random.default_rng(self.seed)
+            self.projections[dimension] = generator.standard_normal(
+                (self.hashed_features, dimension), dtype=np.float32)
+        return self.projections[dimension]
+
+    def features(self, text: str):
+        words = WORD.findall(text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            yield digest % self.hashed_features, 1.0 if digest >> 63 else -1.0
+
+    def embed(self, texts: list, dimension: int) -> np.ndarray:
+        counts = np.zeros((len(texts), self.hashed_features), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for column, sign in self.features(text):
+                counts[row, column] += sign
+        # dampens frequent words like a sublinear term frequency
+        counts = np.sign(counts) * np.log1p(np.abs(counts))
+        return normalize(counts @ self.projection(dimension))
+
+
+class BedrockEmbedder:
+    """Embeddings of a Bedrock embedding model with the output dimension of the index"""
+
+    def __init__(self, model_id: str = "amazon.titan-embed-text-v2:0", workers: int = 8):
+        import boto3
+        self.name = model_id
+        self.model_id = model_id
+        self.workers = workers
+        self.client = boto3.client("bedrock-runtime")
+
+    def embed_text(self, text: str, dimension: int) -> list:
+        body = {"inputText": text}
+        if self.model_id.startswith("amazon.titan-embed-text-v2"):
+            body.update({"dimensions": dimension, "normalize": True})
+        response = self.client.invoke_model(modelId=self.model_id, body=json.dumps(body))
+        return json.loads(response["body"].read())["embedding"]
+
+    def embed(self, texts: list, dimension: int) -> np.ndarray:
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            vectors = list(executor.map(lambda text: self.embed_text(text, dimension), texts))
+        return normalize(np.array(vectors, dtype=np.float32))
+
+
+def load_embedder(spec: str):
+    if spec == "hashing":
+        return HashingEmbedder()
+    if spec == "bedrock" or spec.startswith("bedrock:"):
+        return BedrockEmbedder(*spec.split(":", 1)[1:])
+    module_name, _, attribute = spec.partition(":")
+    if not attribute:
+        raise ValueError(f"Unknown embedder {spec}, use hashing, bedrock[:<model id>] or <module>:<attribute>")
+    embedder = getattr(importlib.import_module(module_name), attribute)
+    return embedder() if isinstance(embedder, type) else embedder
+
+
+class EmbeddingCache:
+    """Embeds every text once per dimension"""
+
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.vectors = {}
+
+    def embed(self, key: str, texts: list, dimension: int) -> np.ndarray:
+        if (key, dimension) not in self.vectors:
+            self.vectors[(key, dimension)] = self.embedder.embed(texts, dimension)
+        return self.vectors[(key, dimension)]
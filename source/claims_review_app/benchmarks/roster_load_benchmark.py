@@ -0,0 +1,157 @@
+"""
+Measures the member roster loader of the manage schema function: a generated CSV roster is loaded with
+batch_execute_statement batches in transactions at several degrees of parallelism, against the previous
+approach of one auto-committed statement per row.
+
+Usage:
+    python source/claims_review_app/benchmarks/roster_load_benchmark.py [--members 1000000] [--patients-per-member 2]
+        [--batch-size 500] [--parallelism 1,4,8] [--baseline-rows 10000] [--create-schema]
+        [--postgres-host localhost] [--postgres-port 5432] [--database claimsdatabase]
+        [--user postgres] [--password postgres]
+        [--data-api-endpoint-url http://localhost:8080]
+
+Runs against a local PostgreSQL, with one pg8000 connection per worker. With --data-api-endpoint-url the
+loads go through a Data API emulator in front of the same database instead, such as local-data-api
+(https://github.com/koxudaxi/local-data-api), shared by all workers like in the Lambda function.
+The INSURED_PERSON and PATIENT tables are truncated before every run, with the claims that reference them.
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+
+import boto3
+from prettytable import PrettyTable
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+CLAIMS_REVIEW_STACK_PATH = os.path.join(REPO_ROOT, "deployment", "stacks", "claims_review_stack")
+sys.path.insert(0, os.path.join(REPO_ROOT, "deployment", "lambda", "claims_review", "layer", "python"))
+sys.path.insert(0, os.path.join(REPO_ROOT, "deployment", "lambda", "claims_review", "manage_schema"))
+
+from data_api_client import DataApiClient  # noqa: E402
+from postgres_client import PostgresClient  # noqa: E402
+from sql_script import split_statements  # noqa: E402
+from roster_loader import (  # noqa: E402
+    ROSTER_COLUMNS,
+    INSURED_COLUMNS,
+    PATIENT_COLUMNS,
+    UPSERT_INSURED_STATEMENT,
+    UPSERT_PATIENT_STATEMENT,
+    RosterLoader,
+    csv_rows,
+    row_parameters,
+)
+
+# ARNs accepted by local-data-api
+DUMMY_CLUSTER_ARN = "arn:aws:rds:us-east-1:123456789012:cluster:dummy"
+DUMMY_SECRET_ARN = "arn:aws:secretsmanager:us-east-1:123456789012:secret:dummy"
+
+RELATIONSHIPS = ("Self", "Spouse", "Child", "Child")
+
+
+def write_roster(path, members, patients_per_member):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(ROSTER_COLUMNS)
+        for member in range(1, members + 1):
+            for patient in range(patients_per_member):
+                writer.writerow([
+                    f"RB-{member:09d}", f"Member {member}", f"G{member % 1000:04d}", "AnyHealth Plus",
+                    f"{1950 + member % 50}-{1 + member % 12:02d}-{1 + member % 28:02d}",
+                    "555 555 0100", f"{member} Any Street, Any City",
+                    f"First{patient}", f"Last{member}",
+                    f"{1950 + (member + patient * 7) % 70}-{1 + patient % 12:02d}-{1 + member % 28:02d}",
+                    RELATIONSHIPS[patient % len(RELATIONSHIPS)],
+                    "555 555 0101", "F" if patient % 2 else "M", f"{member} Any Street, Any City",
+                ])
+
+
+def load_row_by_row(client, rows, row_count):
+    """The previous approach: one auto-committed statement per row"""
+    loaded = 0
+    for row in rows:
+        if loaded == row_count:
+            break
+        client.execute_statement(UPSERT_INSURED_STATEMENT, row_parameters(row, INSURED_COLUMNS))
+        client.execute_statement(UPSERT_PATIENT_STATEMENT, row_parameters(row, PATIENT_COLUMNS))
+        loaded += 1
+    return loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Member roster load benchmark")
+    parser.add_argument("--members", type=int, default=1_000_000)
+    parser.add_argument("--patients-per-member", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--parallelism", default="1,4,8", help="Comma separated numbers of workers to measure")
+    parser.add_argument("--baseline-rows", type=int, default=10000, help="Rows loaded one statement at a time, 0 skips it")
+    parser.add_argument("--postgres-host", default="localhost")
+    parser.add_argument("--postgres-port", type=int, default=5432)
+    parser.add_argument("--database", default="claimsdatabase")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="postgres")
+    parser.add_argument("--data-api-endpoint-url", help="Load through a Data API emulator for the same database")
+    parser.add_argument("--create-schema", action="store_true", help="Load the claims schema first")
+    args = parser.parse_args()
+
+    def postgres_client():
+        return PostgresClient(
+            host=args.postgres_host,
+            port=args.postgres_port,
+            database=args.database,
+            credentials={"username": args.user, "password": args.password},
+            use_tls=False,
+            connect_timeout_seconds=300
+        )
+
+    data_api = DataApiClient(
+        DUMMY_CLUSTER_ARN,
+        DUMMY_SECRET_ARN,
+        args.database,
+        client=boto3.client(
+            "rds-data",
+            endpoint_url=args.data_api_endpoint_url,
+            region_name="us-east-1",
+            aws_access_key_id="local",
+            aws_secret_access_key="local"
+        )
+    ) if args.data_api_endpoint_url else None
+
+    def clients(parallelism):
+        return [data_api] * parallelism if data_api else [postgres_client() for _ in range(parallelism)]
+
+    admin = postgres_client()
+    if args.create_schema:
+        with open(os.path.join(CLAIMS_REVIEW_STACK_PATH, "schemas", "create_database_schema.sql")) as f:
+            for statement in split_statements(f.read()):
+                admin.execute_statement(statement)
+
+    backend = "DATA_API" if data_api else "POSTGRES"
+    table = PrettyTable()
+    table.field_names = ["Loader", "Backend", "Workers", "Rows", "Seconds", "Rows/s"]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "roster.csv")
+        write_roster(path, args.members, args.patients_per_member)
+        print(f"Generated a roster of {args.members * args.patients_per_member:,} rows")
+
+        if args.baseline_rows:
+            admin.execute_statement("TRUNCATE INSURED_PERSON, PATIENT CASCADE")
+            with open(path, newline="") as f:
+                started_at = time.perf_counter()
+                rows = load_row_by_row(clients(1)[0], csv_rows(f), args.baseline_rows)
+                elapsed = time.perf_counter() - started_at
+            table.add_row(["statement per row", backend, 1, f"{rows:,}", f"{elapsed:.1f}", f"{rows / elapsed:,.0f}"])
+
+        for parallelism in (int(value) for value in args.parallelism.split(",")):
+            admin.execute_statement("TRUNCATE INSURED_PERSON, PATIENT CASCADE")
+            with open(path, newline="") as f:
+                totals = RosterLoader(clients(parallelism), batch_size=args.batch_size).load(csv_rows(f))
+            table.add_row([f"batches of {args.batch_size}", backend, parallelism, f"{totals['rows']:,}",
+                           f"{totals['seconds']:.1f}", f"{totals['rows_per_second']:,}"])
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
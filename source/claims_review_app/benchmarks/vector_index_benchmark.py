@@ -0,0 +1,221 @@
+"""
+Compares settings of the EOC vector index offline: the sample EOC documents are chunked like the knowledge
+base data source, embedded, and indexed for every combination of dimension, quantization and HNSW
+parameters. Reports recall@k against exact search on float vectors of the largest dimension, the query
+latency, the build time and the memory of each index.
+
+Usage:
+    python source/claims_review_app/benchmarks/vector_index_benchmark.py [--embedder hashing]
+        [--corpus-size 20000] [--queries 200] [--k 10] [--space-type l2]
+        [--dimensions 256,512,1024] [--quantizations none,fp16,binary]
+        [--m 8,16,32] [--ef-construction 128,512] [--ef-search 64,128,512]
+        [--chunk-max-tokens 1024] [--chunk-overlap-percentage 20] [path ...]
+
+The indexes are built with faiss (pip install faiss-cpu), which implements the faiss engine of OpenSearch
+Serverless: HNSW on float vectors, HNSW with the fp16 scalar quantizer, and HNSW on binary vectors. Without
+faiss every dimension and quantization is measured with an exact NumPy search instead, which shows the
+effect of the dimension and quantization without the HNSW parameters.
+
+The sample EOC documents make a few hundred chunks, --corpus-size adds synthetic chunks of their sentences
+to measure at the size of a larger corpus. See eoc_corpus.py for the embedders, the values of the
+deployed index are in vector_store_index_params of deployment/cdk.json.
+"""
+import argparse
+import os
+import sys
+import time
+from itertools import product
+
+import numpy as np
+from prettytable import PrettyTable
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from eoc_corpus import (  # noqa: E402
+    EmbeddingCache,
+    chunk_documents,
+    deployed_chunking_parameters,
+    deployed_knowledgebase_parameters,
+    expand_corpus,
+    load_embedder,
+    sample_queries,
+)
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Set bits of every byte value, to count the hamming distance of packed binary vectors
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.int32)
+
+
+def integers(value: str) -> list:
+    return [int(item) for item in value.split(",")]
+
+
+def exact_neighbors(vectors: np.ndarray, queries: np.ndarray, k: int, space_type: str) -> np.ndarray:
+    if space_type == "innerproduct":
+        scores = queries @ vectors.T
+    else:
+        scores = -(np.sum(vectors ** 2, axis=1)[None, :] - 2 * queries @ vectors.T)
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def recall_at_k(found: np.ndarray, expected: np.ndarray) -> float:
+    k = expected.shape[1]
+    return sum(len(set(row) & set(reference)) for row, reference in zip(found, expected)) / (k * len(expected))
+
+
+def timed_search(search, queries: np.ndarray) -> tuple:
+    """Neighbors of the queries searched one at a time like OpenSearch queries, and the latencies in ms"""
+    neighbors, latencies = [], []
+    for query in queries:
+        started_at = time.perf_counter()
+        neighbors.append(search(query[None, :]))
+        latencies.append((time.perf_counter() - started_at) * 1000)
+    return np.vstack(neighbors), latencies
+
+
+def binary_vectors(vectors: np.ndarray) -> np.ndarray:
+    """One bit per dimension, set for positive values, like binary embeddings of the embedding model"""
+    return np.packbits(vectors > 0, axis=1)
+
+
+class FaissIndex:
+
+    def __init__(self, dimension: int, quantization: str, space_type: str, m: int, ef_construction: int):
+        self.quantization = quantization
+        if quantization == "binary":
+            self.index = faiss.IndexBinaryHNSW(dimension, m)
+        else:
+            metric = faiss.METRIC_INNER_PRODUCT if space_type == "innerproduct" else faiss.METRIC_L2
+            if quantization == "fp16":
+                self.index = faiss.IndexHNSWSQ(dimension, faiss.ScalarQuantizer.QT_fp16, m, metric)
+            else:
+                self.index = faiss.IndexHNSWFlat(dimension, m, metric)
+        self.index.hnsw.efConstruction = ef_construction
+
+    def build(self, vectors: np.ndarray):
+        if self.quantization == "binary":
+            self.index.add(binary_vectors(vectors))
+        else:
+            if not self.index.is_trained:
+                self.index.train(vectors)
+            self.index.add(vectors)
+
+    def search(self, queries: np.ndarray, k: int, ef_search: int) -> tuple:
+        self.index.hnsw.efSearch = ef_search
+        if self.quantization == "binary":
+            queries = binary_vectors(queries)
+        return timed_search(lambda query: self.index.search(query, k)[1][0], queries)
+
+    def memory_bytes(self) -> int:
+        if self.quantization == "binary":
+            return faiss.serialize_index_binary(self.index).nbytes
+        return faiss.serialize_index(self.index).nbytes
+
+
+class NumpyIndex:
+    """Exact search on the stored vectors, the HNSW parameters do not apply"""
+
+    def __init__(self, dimension: int, quantization: str, space_type: str):
+        self.quantization = quantization
+        self.space_type = space_type
+
+    def build(self, vectors: np.ndarray):
+        if self.quantization == "binary":
+            self.vectors = binary_vectors(vectors)
+        else:
+            self.vectors = vectors.astype(np.float16 if self.quantization == "fp16" else np.float32)
+            self.squared_norms = np.sum(self.vectors.astype(np.float32) ** 2, axis=1)
+
+    def search_one(self, query: np.ndarray, k: int) -> np.ndarray:
+        if self.quantization == "binary":
+            scores = -POPCOUNT[np.bitwise_xor(self.vectors, binary_vectors(query))].sum(axis=1)
+        else:
+            products = self.vectors.astype(np.float32) @ query[0]
+            scores = products if self.space_type == "innerproduct" else 2 * products - self.squared_norms
+        top = np.argpartition(-scores, k)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def search(self, queries: np.ndarray, k: int, ef_search: int) -> tuple:
+        return timed_search(lambda query: self.search_one(query, k), queries)
+
+    def memory_bytes(self) -> int:
+        return self.vectors.nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EOC vector index parameter benchmark")
+    parser.add_argument("paths", nargs="*", help="EOC documents or directories, the sample EOC documents by default")
+    parser.add_argument("--embedder", default="hashing", help="hashing, bedrock[:<model id>] or <module>:<attribute>")
+    parser.add_argument("--corpus-size", type=int, default=20000, help="Chunks to index, with synthetic chunks")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--space-type", choices=["l2", "innerproduct"], default="l2")
+    parser.add_argument("--dimensions", type=integers, default=[256, 512, 1024])
+    parser.add_argument("--quantizations", default="none,fp16,binary")
+    parser.add_argument("--m", type=integers, default=[8, 16, 32])
+    parser.add_argument("--ef-construction", type=integers, default=[128, 512])
+    parser.add_argument("--ef-search", type=integers, default=[64, 128, 512])
+    parser.add_argument("--chunk-max-tokens", type=int, help="Fixed size chunks instead of the deployed chunking")
+    parser.add_argument("--chunk-overlap-percentage", type=int, default=20)
+    args = parser.parse_args()
+    quantizations = args.quantizations.split(",")
+
+    embeddings = EmbeddingCache(load_embedder(args.embedder))
+    if args.chunk_max_tokens:
+        chunking_parameters = {"strategy": "fixed", "max_tokens": args.chunk_max_tokens,
+                               "overlap_percentage": args.chunk_overlap_percentage}
+    else:
+        chunking_parameters = deployed_chunking_parameters()
+    chunks, _ = chunk_documents(args.paths, chunking_parameters, embeddings.embedder, max(args.dimensions))
+    print(f"Read {len(chunks)} chunks from the EOC documents with {chunking_parameters}")
+    chunks = expand_corpus(chunks, args.corpus_size)
+    texts = [chunk["text"] for chunk in chunks]
+    queries = sample_queries(chunks, args.queries)
+
+    reference_dimension = max(args.dimensions)
+    started_at = time.perf_counter()
+    expected = exact_neighbors(embeddings.embed("corpus", texts, reference_dimension),
+                               embeddings.embed("queries", queries, reference_dimension), args.k, args.space_type)
+    print(f"Embedded {len(texts):,} chunks and {len(queries)} queries with {embeddings.embedder.name} "
+          f"in {time.perf_counter() - started_at:.1f} seconds")
+    if faiss is None:
+        print("faiss is not installed, measuring exact NumPy search without the HNSW parameters")
+
+    table = PrettyTable()
+    table.field_names = ["Index", "Dimension", "Quantization", "m", "ef_construction", "ef_search",
+                         f"Recall@{args.k}", "p50 ms", "p95 ms", "Build s", "Memory MB"]
+    for dimension, quantization in product(args.dimensions, quantizations):
+        vectors = embeddings.embed("corpus", texts, dimension)
+        query_vectors = embeddings.embed("queries", queries, dimension)
+        if faiss is None:
+            builds = [("numpy flat", "-", "-", [None], lambda: NumpyIndex(dimension, quantization, args.space_type))]
+        else:
+            builds = [("faiss hnsw", m, ef_construction, args.ef_search,
+                       lambda m=m, ef_construction=ef_construction: FaissIndex(
+                           dimension, quantization, args.space_type, m, ef_construction))
+                      for m, ef_construction in product(args.m, args.ef_construction)]
+        for name, m, ef_construction, ef_searches, create in builds:
+            index = create()
+            started_at = time.perf_counter()
+            index.build(vectors)
+            build_seconds = time.perf_counter() - started_at
+            memory_mb = index.memory_bytes() / 1024 / 1024
+            for ef_search in ef_searches:
+                found, latencies = index.search(query_vectors, args.k, ef_search)
+                table.add_row([
+                    name, dimension, quantization, m, ef_construction, "-" if ef_search is None else ef_search,
+                    f"{recall_at_k(found, expected):.3f}",
+                    f"{np.percentile(latencies, 50):.3f}", f"{np.percentile(latencies, 95):.3f}",
+                    f"{build_seconds:.2f}", f"{memory_mb:.1f}"
+                ])
+    print(table)
+    print(f"Recall is measured against exact {args.space_type} search on float vectors of dimension "
+          f"{reference_dimension}. Deployed index: {deployed_knowledgebase_parameters()['vector_store_index_params']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Builds the medical code index of the validateCodes action from code set release files, and uploads it to the
+claims review bucket at code_index/code_index.snap. Enable code_index in deployment/cdk.json and deploy to add
+the validateCodes action to the agent.
+
+    --icd10cm     ICD-10-CM order file of the CMS release, icd10cm_order_<year>.txt, with the billable flag
+                  of every code and category. The codes file, icd10cm_codes_<year>.txt, lists billable codes only.
+    --hcpcs       HCPCS Level II codes, a CSV export of the CMS HCPCS release with the HCPC and LONG DESCRIPTION
+                  columns, or any CSV with code and description columns
+    --cpt         CPT codes, a CSV with code and description columns. CPT is licensed by the AMA and is not
+                  part of the CMS releases, use the data file of your license
+    --modifiers   procedure modifiers, a CSV with code and description columns
+
+Every file is optional, codes of a system that is not indexed are reported as unknown by validateCodes.
+
+Usage:
+    python source/claims_review_app/build_code_index.py --icd10cm icd10cm_order_2025.txt --hcpcs hcpcs_2025.csv
+        [--cpt cpt.csv] [--modifiers modifiers.csv] [--version 2025] [--output code_index.snap] [--upload]
+
+Containers of the agent actions function keep the index they loaded, new containers load the uploaded one.
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+import boto3
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(REPO_ROOT, "deployment", "lambda", "claims_review", "layer", "python"))
+
+from code_index import (  # noqa: E402
+    CODE_INDEX_KEY,
+    CPT,
+    CPT_FORMAT,
+    HCPCS,
+    HCPCS_FORMAT,
+    ICD10CM,
+    ICD10CM_FORMAT,
+    MODIFIER,
+    MODIFIER_FORMAT,
+    CodeIndex,
+    normalize_code,
+    write_code_index,
+)
+from sorted_snapshot import SortedSnapshot  # noqa: E402
+
+STACK_NAME = "claims-review"
+CODE_COLUMNS = ("code", "hcpc", "hcpcs", "cpt code", "cpt", "modifier")
+DESCRIPTION_COLUMNS = ("description", "long description", "long_description", "short description")
+FORMATS = {ICD10CM: ICD10CM_FORMAT, CPT: CPT_FORMAT, HCPCS: HCPCS_FORMAT, MODIFIER: MODIFIER_FORMAT}
+
+
+class CodeIndexBuildError(Exception):
+    """Raised when a release file cannot be read"""
+    pass
+
+
+def read_icd10cm(path: str):
+    """
+    Reads the fixed width order file: order number (5), code (7), billable flag (1), short description (60)
+    and long description, separated by a space. Lines of the codes file hold a code and its description.
+    """
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                continue
+            if line[:5].isdigit() and line[5:6] == " ":
+                code, billable, description = line[6:13].strip(), line[14:15] == "1", line[77:].strip()
+            else:
+                code, _, description = line.partition(" ")
+                billable = True
+            if not ICD10CM_FORMAT.match(normalize_code(code)):
+                raise CodeIndexBuildError(f"{path}:{line_number} is not an ICD-10-CM code: {code}")
+            yield ICD10CM, code, {"description": " ".join(description.split()), "billable": billable}
+
+
+def read_csv(path: str, system: str):
+    """Reads the code and description columns of a CSV file, rows with codes of another format are skipped"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        columns = {name.strip().lower(): name for name in reader.fieldnames or []}
+        code_column = next((columns[name] for name in CODE_COLUMNS if name in columns), None)
+        description_column = next((columns[name] for name in DESCRIPTION_COLUMNS if name in columns), None)
+        if code_column is None or description_column is None:
+            raise CodeIndexBuildError(f"{path} has no code and description columns: {reader.fieldnames}")
+        skipped = 0
+        for row in reader:
+            code = normalize_code(row[code_column] or "")
+            if not FORMATS[system].match(code):
+                skipped += 1
+                continue
+            yield system, code, {"description": " ".join((row[description_column] or "").split())}
+        if skipped:
+            print(f"Skipped {skipped} rows of {path} without a {system} code")
+
+
+def records(args):
+    if args.icd10cm:
+        if args.icd10cm.lower().endswith(".csv"):
+            yield from ((system, code, {**entry, "billable": True}) for system, code, entry in read_csv(args.icd10cm, ICD10CM))
+        else:
+            yield from read_icd10cm(args.icd10cm)
+    for system, path in ((CPT, args.cpt), (HCPCS, args.hcpcs), (MODIFIER, args.modifiers)):
+        if path:
+            yield from read_csv(path, system)
+
+
+def measure_lookups(path: str, lookups: int = 10000):
+    """Microseconds per lookup of random indexed codes, like the lookups of validateCodes"""
+    code_index = CodeIndex(SortedSnapshot(path))
+    snapshot = code_index.snapshot
+    if not len(snapshot):
+        return None
+    keys = [snapshot.key_at(random.randrange(len(snapshot))) for _ in range(lookups)]
+    started_at = time.perf_counter()
+    for key in keys:
+        snapshot.get(key)
+    elapsed = time.perf_counter() - started_at
+    snapshot.close()
+    return elapsed / lookups * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the ICD-10-CM, CPT and HCPCS code index")
+    parser.add_argument("--icd10cm", help="ICD-10-CM order or codes file, or a CSV")
+    parser.add_argument("--hcpcs", help="HCPCS Level II CSV")
+    parser.add_argument("--cpt", help="CPT CSV")
+    parser.add_argument("--modifiers", help="Procedure modifier CSV")
+    parser.add_argument("--version", default=datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ"))
+    parser.add_argument("--output", default="code_index.snap")
+    parser.add_argument("--upload", action="store_true", help="Upload the index to the claims review bucket")
+    args = parser.parse_args()
+    if not any((args.icd10cm, args.hcpcs, args.cpt, args.modifiers)):
+        parser.error("at least one of --icd10cm, --hcpcs, --cpt and --modifiers is required")
+
+    counts = {}
+
+    def counted(items):
+        for system, code, entry in items:
+            counts[system] = counts.get(system, 0) + 1
+            yield system, code, entry
+
+    try:
+        metadata = {
+            "version": args.version,
+            "sources": {system: os.path.basename(path) for system, path in
+                        ((ICD10CM, args.icd10cm), (CPT, args.cpt), (HCPCS, args.hcpcs), (MODIFIER, args.modifiers)) if path}
+        }
+        written = write_code_index(args.output, counted(records(args)), metadata)
+    except (CodeIndexBuildError, OSError) as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+    print(f"Wrote {written:,} codes to {args.output} ({os.path.getsize(args.output) / 1024 / 1024:.1f} MB): "
+          + ", ".join(f"{count:,} {system}" for system, count in counts.items()))
+    microseconds = measure_lookups(args.output)
+    if microseconds is not None:
+        print(f"Lookups take {microseconds:.1f} microseconds on average")
+
+    if args.upload:
+        outputs = boto3.client("cloudformation").describe_stacks(StackName=STACK_NAME)["Stacks"][0]["Outputs"]
+        bucket = next((item["OutputValue"] for item in outputs if item.get("ExportName") == "claims-review-bucket"), None)
+        if bucket is None:
+            print(f"Error: Output with Export Name 'claims-review-bucket' not found in stack {STACK_NAME}")
+            sys.exit(1)
+        boto3.client("s3").upload_file(args.output, bucket, CODE_INDEX_KEY)
+        print(f"Uploaded code index version {args.version} to s3://{bucket}/{CODE_INDEX_KEY}")
+
+
+if __name__ == "__main__":
+    main()
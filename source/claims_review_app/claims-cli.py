@@ -9,6 +9,7 @@ from datetime import datetime, timezone
 import dateutil.parser
 import json
 import botocore
+from botocore.config import Config
 from botocore.exceptions import CredentialRetrievalError, NoRegionError
 from typing import Union, Optional
 
@@ -18,6 +19,11 @@ class ClaimsCLI:
             self.cf_client = boto3.client('cloudformation')
             self.s3_client = boto3.client('s3')
             self.bedrock_agent_client = boto3.client('bedrock-agent')
+            # batch reviews run synchronously for up to the 15 minute Lambda timeout
+            self.lambda_client = boto3.client('lambda', config=Config(
+                read_timeout=910,
+                retries={'max_attempts': 0}
+            ))
             self.stack_name = 'claims-review'  # Replace with your actual stack name
         except CredentialRetrievalError as cre:
             print("""Oops! It looks like we couldn't find your AWS credentials. Please make sure you've set up your AWS access key and secret key correctly. Need help? Check out the AWS documentation on credential configuration!
@@ -144,6 +150,9 @@ class ClaimsCLI:
     def get_eoc_bucket_name(self)->str:
         return self.get_stack_output(export_name = 'claims-eoc-kb-datasource-bucket') # type: ignore
 
+    def get_batch_review_function_name(self)->str:
+        return self.get_stack_output(export_name = 'claims-batch-review-function') # type: ignore
+
     def submit_claim(self, claim_form_path, bucket_name):
         if not os.path.exists(claim_form_path):
             print(f"Error: File '{claim_form_path}' does not exist.")
@@ -161,15 +170,44 @@ class ClaimsCLI:
     def print_job_status(self, ingestion_job_id):
             print(f"\n\033[1m Ingestion Job with Id {ingestion_job_id} {self.get_ingestion_job_status(ingestion_job_id)}\033[0m\n")
 
-    def add_eoc_document(self, eoc_document_path:str, bucket_name:str):
+    def eoc_document_metadata(self, eoc_document_path:str, plan_name:Optional[str]=None,
+                              plan_year:Optional[int]=None, document_type:Optional[str]=None) -> dict:
+        # Metadata of the <document>.metadata.json sidecar next to the document, overridden by the given values.
+        # Claim reviews filter the knowledge base on plan_name, stored lower case with single spaces.
+        metadata_path = f"{eoc_document_path}.metadata.json"
+        metadata = {"metadataAttributes": {}}
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+        attributes = metadata.setdefault("metadataAttributes", {})
+        if plan_name:
+            attributes["plan_name"] = plan_name
+        if plan_year:
+            attributes["plan_year"] = plan_year
+        if document_type:
+            attributes["document_type"] = document_type
+        attributes.setdefault("document_type", "evidence_of_coverage")
+        if "plan_name" not in attributes:
+            print(f"Warning: no plan name for '{eoc_document_path}', use --plan-name. "
+                  f"Claim reviews only search the documents of the plan of the claim.")
+        else:
+            attributes["plan_name"] = " ".join(str(attributes["plan_name"]).lower().split())
+        return metadata
+
+    def add_eoc_document(self, eoc_document_path:str, bucket_name:str, plan_name:Optional[str]=None,
+                         plan_year:Optional[int]=None, document_type:Optional[str]=None):
         if not os.path.exists(eoc_document_path):
             print(f"Error: File '{eoc_document_path}' does not exist.")
             return
 
         try:
             key = os.path.basename(eoc_document_path)
+            metadata = self.eoc_document_metadata(eoc_document_path, plan_name, plan_year, document_type)
             #get current timestamp
             timestamp = datetime.now(timezone.utc)
+            # The sidecar is uploaded first, the ingestion started by the document upload reads it
+            self.s3_client.put_object(Bucket=bucket_name, Key=f"{key}.metadata.json", Body=json.dumps(metadata))
+            print(f"Document metadata: {metadata['metadataAttributes']}")
             self.s3_client.upload_file(eoc_document_path, bucket_name, key)
             print(f"\n\033[1mUploaded document.... Running Datasource Sync\033[0m\n")
             ingestion_job_id = self.wait_for_start(bucket_name, key, timestamp)
@@ -223,6 +261,99 @@ class ClaimsCLI:
         claim_output = json.loads(claim_output_s3_object['Body'].read().decode('utf-8'))
         print(claim_output)
         print("\n")
+        try:
+            review_provenance_s3_object = self.s3_client.get_object(
+                Bucket=self.get_claims_review_bucket_name(),
+                Key=f"{claim_reference_id}/review_provenance.json")
+        except self.s3_client.exceptions.NoSuchKey:
+            return
+        review_provenance = json.loads(review_provenance_s3_object['Body'].read().decode('utf-8'))
+        if review_provenance['source'] == 'review_cache':
+            print(f"Decision reused from the review of claim {review_provenance['source_claim_reference_id']}, "
+                  f"the claim form, member records, knowledge bases and agent version are unchanged "
+                  f"(cache key {review_provenance['cache_key']})")
+            print("\n")
+
+    def profile_claim(self, claim_reference_id:str):
+        try:
+            claim_profile_s3_object = self.s3_client.get_object(
+                Bucket=self.get_claims_review_bucket_name(),
+                Key=f"{claim_reference_id}/claim_profile.json")
+        except self.s3_client.exceptions.NoSuchKey:
+            print(f"Error: Claim profile not found for claim reference ID: {claim_reference_id}. Please try again later.")
+            return
+
+        claim_profile = json.loads(claim_profile_s3_object['Body'].read().decode('utf-8'))
+        totals = claim_profile['totals']
+        print(f"\n\033[1mClaim Review Profile: {claim_reference_id}\033[0m")
+        table = PrettyTable()
+        table.field_names = ["Total Duration (ms)", "Steps", "Model Invocations", "Model Latency (ms)", "Input Tokens",
+                             "Output Tokens", "Action Group Calls", "KB Lookups", "Retrieved References", "Tool Call Duration (ms)"]
+        table.add_row([claim_profile['total_duration_ms'], totals['steps'], totals['model_invocations'], totals['model_latency_ms'],
+                       totals['input_tokens'], totals['output_tokens'], totals['action_group_calls'],
+                       totals['knowledge_base_lookups'], totals['retrieved_references'], totals['tool_call_duration_ms']])
+        print(table)
+
+        table = PrettyTable()
+        table.field_names = ["Step", "Phase", "Duration (ms)", "Model Latency (ms)", "Input Tokens", "Output Tokens", "Tool Calls"]
+        table.align["Tool Calls"] = "l"
+        for number, step in enumerate(claim_profile['steps'], start=1):
+            tool_calls = "\n".join(
+                f"{call['name']}: {call['duration_ms']} ms" +
+                (f", {call['retrieved_references']} references" if 'retrieved_references' in call else "")
+                for call in step['tool_calls'])
+            table.add_row([number, step['phase'], step['duration_ms'], step['model_latency_ms'],
+                           step['input_tokens'], step['output_tokens'], tool_calls])
+        print(table)
+        for failure in claim_profile['failures']:
+            print(f"Failure: {failure}")
+        print("\n")
+
+    def batch_review(self, claim_reference_ids:Optional[list]=None, prefix:Optional[str]=None,
+                     batch_id:Optional[str]=None, concurrency:Optional[int]=None, rate_per_second:Optional[float]=None,
+                     max_retries:int=2):
+        payload = {
+            "batch_id": batch_id or str(uuid.uuid4()),
+            **({'claim_reference_ids': claim_reference_ids} if claim_reference_ids else {}),
+            **({'prefix': prefix} if prefix is not None else {}),
+            **({'concurrency': concurrency} if concurrency is not None else {}),
+            **({'rate_per_second': rate_per_second} if rate_per_second is not None else {})
+        }
+        function_name = self.get_batch_review_function_name()
+        print(f"\n\033[1mStarting batch review {payload['batch_id']}\033[0m\n")
+        retries = 0
+        while True:
+            response = self.lambda_client.invoke(
+                FunctionName=function_name,
+                InvocationType='RequestResponse',
+                Payload=json.dumps(payload)
+            )
+            report = json.loads(response['Payload'].read().decode('utf-8'))
+            if 'FunctionError' in response:
+                print(f"Error running batch review: {report}")
+                return
+            print(f"Reviewed {report['completed']} of {report['total']} claims ({report['failed']} failed)")
+            # the function checkpoints and returns before its timeout, invoke it again to resume
+            if report['status'] == 'COMPLETE':
+                break
+            if report['status'] == 'PARTIAL':
+                # resuming the batch reviews the failed claims again
+                if retries == max_retries:
+                    print(f"{report['failed']} claims failed after {max_retries} retries, resume with --batch-id {report['batch_id']}")
+                    break
+                retries += 1
+                print(f"Retrying {report['failed']} failed claims (retry {retries} of {max_retries})")
+
+        table = PrettyTable()
+        table.field_names = ["Batch Id", "Completed", "Cached", "Failed", "Throughput (claims/min)", "Agent p50 Latency (ms)", "Agent p95 Latency (ms)"]
+        table.add_row([report['batch_id'], report['completed'], report.get('cached', 0), report['failed'],
+                       report['throughput_per_minute'],
+                       report['p50_latency_ms'], report['p95_latency_ms']])
+        print(table)
+        for claim_reference_id, error in report['errors'].items():
+            print(f"•\t{claim_reference_id}: {error}")
+        print(f"Checkpoint: {report['checkpoint']}\n")
+
 def main():
 
     cli = ClaimsCLI()
@@ -237,17 +368,32 @@ def main():
     # Subparser for upload-eoc-document
     parser_upload = subparsers.add_parser('upload-eoc-document', help='Upload an EOC document')
     parser_upload.add_argument('--file', required=True, help="File path for the EOC document to upload")
+    parser_upload.add_argument('--plan-name', help="Insurance plan of the document, the plan_name of <file>.metadata.json by default")
+    parser_upload.add_argument('--plan-year', type=int, help="Plan year of the document")
+    parser_upload.add_argument('--document-type', help="Document type, evidence_of_coverage by default")
 
     # Subparser for view-claim-status
     parser_view = subparsers.add_parser('view-claim-output', help='View the output of a claim')
     parser_view.add_argument('--claim-reference-id', required=True, help="Claim Reference ID of the claim to view")
 
+    parser_profile = subparsers.add_parser('profile-claim', help='View the latency and token profile of a claim review')
+    parser_profile.add_argument('--claim-reference-id', required=True, help="Claim Reference ID of the claim to profile")
+
     parser_list_ingestion_jobs = subparsers.add_parser('list-ingestion-jobs', help='View Ingestion Jobs')
 
     parser_list_claims = subparsers.add_parser('list-claims', help='List all claim reference IDs')
 
     parser_check_deployment_status = subparsers.add_parser('check-deployment-status', help='Output the claims review stack deployment status')
 
+    parser_batch_review = subparsers.add_parser('batch-review', help='Re-run the claims review for claims that were already extracted')
+    parser_batch_review_claims = parser_batch_review.add_mutually_exclusive_group(required=True)
+    parser_batch_review_claims.add_argument('--claim-reference-ids', nargs='+', help="Claim Reference IDs of the claims to review")
+    parser_batch_review_claims.add_argument('--prefix', help="Review all claims whose Claim Reference ID starts with this prefix ('' for all)")
+    parser_batch_review.add_argument('--batch-id', help="Batch ID of a previous batch review to resume")
+    parser_batch_review.add_argument('--concurrency', type=int, help="Maximum number of concurrent agent invocations")
+    parser_batch_review.add_argument('--rate-per-second', type=float, help="Maximum agent invocations started per second")
+    parser_batch_review.add_argument('--max-retries', type=int, default=2, help="Times the failed claims of the batch are reviewed again")
+
     # Parse arguments
     args = parser.parse_args()
 
@@ -270,7 +416,10 @@ def main():
         action_parser.add_argument('--file', required=True, help="File path for the EOC document")
         cli.add_eoc_document(
             eoc_document_path=args.file,
-            bucket_name=cli.get_eoc_bucket_name()
+            bucket_name=cli.get_eoc_bucket_name(),
+            plan_name=args.plan_name,
+            plan_year=args.plan_year,
+            document_type=args.document_type
         )
     elif args.action == 'list-claims':
         cli.list_claims()
@@ -282,8 +431,19 @@ def main():
         action_parser = argparse.ArgumentParser(description="View Claim Output")
         action_parser.add_argument('--claim_reference_id', required=True, help="Claim Reference Id")
         cli.view_claim_output(args.claim_reference_id)
+    elif args.action == 'profile-claim':
+        cli.profile_claim(args.claim_reference_id)
     elif args.action == 'list-ingestion-jobs':
             cli.list_ingestion_jobs()
+    elif args.action == 'batch-review':
+        cli.batch_review(
+            claim_reference_ids=args.claim_reference_ids,
+            prefix=args.prefix,
+            batch_id=args.batch_id,
+            concurrency=args.concurrency,
+            rate_per_second=args.rate_per_second,
+            max_retries=args.max_retries
+        )
     else:
         print(f"Unknown action: {args.action}")
         parser.print_help(sys.stderr)
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Rebuilds the vector index of a knowledge base with the vector_store_index_params of deployment/cdk.json,
+without a retrieval outage. The knowledge base reads and writes its index through the index_alias, and keeps
+using the current index until the alias moves:
+
+    1. creates the next version of the index, <index_name>_v<N>, with the configured mapping and settings
+    2. copies the chunks of the current index into it with batched bulk requests on --workers threads. The
+       current index is read one page of source documents at a time with search_after on the source URI,
+       vector search collections support neither the scroll API nor document ids set by the client. The
+       stored vectors are copied when the dimension and data type are unchanged, otherwise the text of the
+       chunks is embedded again with the embedding model of the knowledge base
+    3. warms the new index with kNN queries of --probes copied vectors until the p95 latency settles, and
+       checks that the probes find their own chunks, identified by source URI and chunk text
+    4. moves the alias from the current to the new index in one update_aliases request, retrievals and
+       ingestion jobs of the knowledge base switch to it at once
+
+The previous index is kept so the alias can be moved back with --swap-to, delete it with --delete-index once
+the new index is in use. Deploy the stack with the new vector_store_index_params afterwards, the deployment
+then finds the index behind the alias up to date.
+
+Usage:
+    python source/claims_review_app/reindex_vector_index.py [--knowledge-base claims-eoc-kb]
+        [--workers 4] [--batch-size 200] [--page-size 500] [--probes 100] [--min-probe-recall 0.95]
+    python source/claims_review_app/reindex_vector_index.py --swap-to claims_eoc_index
+    python source/claims_review_app/reindex_vector_index.py --delete-index claims_eoc_index
+
+Needs opensearch-py, and the data access of the vector store collection: add the role or user that runs the
+script to data_access_principal_arns of the vector_store context and deploy. Ingestion jobs write to the
+current index while its chunks are copied, so the script stops if one runs before the alias moves.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+import boto3
+from opensearchpy.exceptions import OpenSearchException
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(REPO_ROOT, "deployment"))
+
+from stacks.claims_review_stack.knowledge_base_parameters import (  # noqa: E402
+    get_metadata_fields,
+    get_vector_index_configuration,
+)
+
+# The index creation function of the stack, so the new index gets the mapping of a deployed one
+_spec = importlib.util.spec_from_file_location("create_vector_index", os.path.join(
+    REPO_ROOT, "deployment", "lambda", "claims_review", "create_vector_index", "index.py"))
+vector_index = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(vector_index)
+
+STACK_NAME = "claims-review"
+ACTIVE_INGESTION_JOB_STATUSES = ("STARTING", "IN_PROGRESS", "STOPPING")
+BULK_MAX_RETRIES = 5
+PROBE_K = 5
+MAX_WARMUP_ROUNDS = 10
+# Warm-up stops once the p95 latency of a round is within this share of the previous round
+WARMUP_TOLERANCE = 0.1
+COUNT_TIMEOUT_SECONDS = 300
+SOURCE_URI_FIELD = "x-amz-bedrock-kb-source-uri"
+# Chunks of one source document are read with one search, up to the default max_result_window
+MAX_CHUNKS_PER_DOCUMENT = 10000
+
+
+class ReindexError(Exception):
+    pass
+
+
+def read_context() -> dict:
+    with open(os.path.join(REPO_ROOT, "deployment", "cdk.json")) as f:
+        return json.load(f)["context"]
+
+
+def get_stack_output(export_name: str) -> str:
+    outputs = boto3.client("cloudformation").describe_stacks(StackName=STACK_NAME)["Stacks"][0]["Outputs"]
+    output = next((item["OutputValue"] for item in outputs if item.get("ExportName") == export_name), None)
+    if output is None:
+        raise ReindexError(f"Output with Export Name '{export_name}' not found in stack {STACK_NAME}")
+    return output
+
+
+def get_collection_endpoint(collection_name: str) -> str:
+    collections = boto3.client("opensearchserverless").batch_get_collection(
+        names=[collection_name])["collectionDetails"]
+    if not collections:
+        raise ReindexError(f"Collection {collection_name} not found, deploy the stack first")
+    return collections[0]["collectionEndpoint"]
+
+
+def percentile(values: list, share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def pack_bits(bits: list) -> list:
+    """Binary embeddings as the signed bytes of a binary knn_vector field, 8 dimensions per byte"""
+    packed = []
+    for start in range(0, len(bits), 8):
+        value = 0
+        for bit in bits[start:start + 8]:
+            value = (value << 1) | (1 if bit else 0)
+        packed.append(value - 256 if value > 127 else value)
+    return packed
+
+
+class Embedder:
+    """Embeds chunk text like the knowledge base, for a new index with another dimension or data type"""
+
+    def __init__(self, model_id: str, configuration: dict):
+        if not model_id.startswith("amazon.titan-embed-text-v2"):
+            raise ReindexError(f"Embedding chunks again is only implemented for Titan Text Embeddings v2, "
+                               f"not {model_id}. Keep the dimension and quantization to copy the vectors.")
+        self.model_id = model_id
+        self.binary = configuration["quantization"] == "binary"
+        self.dimension = configuration["dimension"]
+        self.client = boto3.client("bedrock-runtime")
+
+    def embed(self, text: str) -> list:
+        response = self.client.invoke_model(modelId=self.model_id, body=json.dumps({
+            "inputText": text,
+            "dimensions": self.dimension,
+            "normalize": True,
+            "embeddingTypes": ["binary" if self.binary else "float"]
+        }))
+        embeddings = json.loads(response["body"].read())["embeddingsByType"]
+        return pack_bits(embeddings["binary"]) if self.binary else embeddings["float"]
+
+
+class Reindexer:
+
+    def __init__(self, aos_client, knowledgebase_parameters: dict, workers: int, batch_size: int,
+                 page_size: int):
+        self.client = aos_client
+        self.parameters = knowledgebase_parameters
+        index_parameters = knowledgebase_parameters["vector_store_index_params"]
+        self.index_name = index_parameters["index_name"]
+        self.index_alias = index_parameters.get("index_alias")
+        if not self.index_alias:
+            raise ReindexError("Set index_alias in vector_store_index_params and deploy, the knowledge base "
+                               "must use the alias before its index can be rebuilt")
+        self.vector_field = index_parameters["vector_field"]
+        self.text_field = index_parameters["text_field"]
+        self.configuration = get_vector_index_configuration(knowledgebase_parameters)
+        self.metadata_fields = vector_index.get_metadata_field_mappings(
+            {"MetadataFields": get_metadata_fields(knowledgebase_parameters)})
+        self.workers = workers
+        self.batch_size = batch_size
+        self.page_size = page_size
+
+    def current_index(self) -> str:
+        index_name = vector_index.get_alias_index_name(self.index_alias, self.client)
+        if not index_name:
+            raise ReindexError(f"Alias {self.index_alias} does not exist, deploy the stack with index_alias first")
+        return index_name
+
+    def next_index(self, current: str) -> str:
+        match = re.fullmatch(rf"{re.escape(self.index_name)}_v(\d+)", current)
+        version = int(match.group(1)) + 1 if match else 2
+        while self.client.indices.exists(index=f"{self.index_name}_v{version}"):
+            version += 1
+        return f"{self.index_name}_v{version}"
+
+    def vectors_compatible(self, source: str) -> bool:
+        """Whether the stored vectors of the source index fit the vector field of the new index"""
+        mapping = self.client.indices.get_mapping(index=source)
+        vector_field = mapping[source]["mappings"]["properties"][self.vector_field]
+        expected = vector_index.get_vector_field_mapping(self.configuration)
+        return (vector_field.get("dimension") == expected["dimension"]
+                and vector_field.get("data_type", "float") == expected.get("data_type", "float"))
+
+    def create_index(self, target: str):
+        vector_index.create_aoss_index(index_name=target, aos_client=self.client, configuration=self.configuration,
+                                       metadata_fields=self.metadata_fields)
+        started_at = time.monotonic()
+        while True:
+            try:
+                vector_index.check_index_ready(target, self.client)
+                return
+            except (vector_index.IndexNotReadyError, OpenSearchException) as e:
+                if time.monotonic() - started_at > COUNT_TIMEOUT_SECONDS:
+                    raise ReindexError(f"Index {target} is not ready after {COUNT_TIMEOUT_SECONDS} seconds: {e}")
+                time.sleep(5)
+
+    def bulk(self, target: str, documents: list, embedder) -> int:
+        """
+        Indexes a batch of chunk sources, retrying the ones rejected with 429 with backoff. The collection
+        assigns the document ids.
+        """
+        if embedder:
+            for source in documents:
+                source[self.vector_field] = embedder.embed(source[self.text_field])
+        pending = documents
+        for attempt in range(BULK_MAX_RETRIES + 1):
+            body = []
+            for source in pending:
+                body.append({"index": {"_index": target}})
+                body.append(source)
+            response = self.client.bulk(body=body)
+            if not response.get("errors"):
+                return len(documents)
+            throttled, failed = [], []
+            for document, item in zip(pending, response["items"]):
+                status = item["index"].get("status", 200)
+                if status == 429:
+                    throttled.append(document)
+                elif status >= 300:
+                    failed.append((document.get(SOURCE_URI_FIELD), item["index"].get("error")))
+            if failed:
+                raise ReindexError(f"Bulk indexing into {target} failed for {len(failed)} documents: {failed[:3]}")
+            if not throttled:
+                return len(documents)
+            pending = throttled
+            time.sleep(random.uniform(0, min(30, 2 ** attempt)))
+        raise ReindexError(f"Bulk indexing into {target} was throttled {BULK_MAX_RETRIES} times")
+
+    def source_uris(self, source: str):
+        """
+        Source URIs of the chunks of the source index in order, paged with search_after on the keyword source
+        URI field. A page ends within the chunks of a document, the next page starts after its URI.
+        """
+        search_after = None
+        while True:
+            body = {
+                "size": self.page_size,
+                "_source": False,
+                "query": {"match_all": {}},
+                "sort": [{SOURCE_URI_FIELD: "asc"}]
+            }
+            if search_after is not None:
+                body["search_after"] = [search_after]
+            hits = self.client.search(index=source, body=body)["hits"]["hits"]
+            uris = list(dict.fromkeys(hit["sort"][0] for hit in hits if hit["sort"][0] is not None))
+            if not uris:
+                return
+            yield from uris
+            search_after = uris[-1]
+
+    def chunks(self, source: str, source_uri: str) -> list:
+        response = self.client.search(index=source, body={
+            "size": MAX_CHUNKS_PER_DOCUMENT,
+            "track_total_hits": True,
+            "query": {"term": {SOURCE_URI_FIELD: source_uri}}
+        })
+        total = response["hits"]["total"]["value"]
+        if total > MAX_CHUNKS_PER_DOCUMENT:
+            raise ReindexError(f"{source_uri} has {total:,} chunks, more than the {MAX_CHUNKS_PER_DOCUMENT:,} "
+                               f"that are read per document")
+        return [hit["_source"] for hit in response["hits"]["hits"]]
+
+    def chunk_key(self, source: dict) -> tuple:
+        """Chunks are identified by source URI and text, the document ids of the new index are new"""
+        return source.get(SOURCE_URI_FIELD), source.get(self.text_field)
+
+    def copy(self, source: str, target: str, probes: int, embedder) -> tuple:
+        """
+        Copies every chunk of the source index into the target index with up to --workers bulk requests in
+        flight. Returns the number of copied chunks and a random sample of (chunk key, vector) probes of them.
+        """
+        copied, seen, reservoir = 0, 0, []
+        started_at = time.perf_counter()
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            in_flight = set()
+
+            def submit(documents):
+                nonlocal copied, in_flight
+                while len(in_flight) >= 2 * self.workers:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    copied += sum(future.result() for future in done)
+                in_flight.add(executor.submit(self.bulk, target, documents, embedder))
+
+            for source_uri in self.source_uris(source):
+                for chunk in self.chunks(source, source_uri):
+                    batch.append(chunk)
+                    seen += 1
+                    if len(reservoir) < probes:
+                        reservoir.append(chunk)
+                    elif random.randrange(seen) < probes:
+                        reservoir[random.randrange(probes)] = chunk
+                    if len(batch) == self.batch_size:
+                        submit(batch)
+                        batch = []
+                        print(f"Copied {copied:,} chunks to {target}, "
+                              f"{copied / (time.perf_counter() - started_at):,.0f} chunks per second")
+            if batch:
+                submit(batch)
+            copied += sum(future.result() for future in wait(in_flight).done)
+
+        # embedding again replaces the vectors of the sampled sources in place, the probes use the new vectors
+        return copied, [(self.chunk_key(chunk), chunk[self.vector_field]) for chunk in reservoir]
+
+    def wait_for_count(self, index_name: str, expected: int):
+        """New documents become searchable after a delay, waits until the index counts all of them"""
+        started_at = time.monotonic()
+        while True:
+            count = self.client.count(index=index_name)["count"]
+            if count >= expected:
+                return
+            if time.monotonic() - started_at > COUNT_TIMEOUT_SECONDS:
+                raise ReindexError(f"Index {index_name} counts {count:,} of {expected:,} copied chunks "
+                                   f"after {COUNT_TIMEOUT_SECONDS} seconds")
+            time.sleep(10)
+
+    def probe(self, index_name: str, vector: list) -> tuple:
+        started_at = time.perf_counter()
+        response = self.client.search(index=index_name, body={
+            "size": PROBE_K,
+            "_source": [SOURCE_URI_FIELD, self.text_field],
+            "query": {"knn": {self.vector_field: {"vector": vector, "k": PROBE_K}}}
+        })
+        return ([self.chunk_key(hit["_source"]) for hit in response["hits"]["hits"]],
+                (time.perf_counter() - started_at) * 1000)
+
+    def warm(self, index_name: str, probes: list) -> float:
+        """
+        Runs rounds of the probe queries until the p95 latency of a round settles, the first queries of a new
+        index load its graph into memory. Returns the share of probes that found their own chunk.
+        """
+        previous_p95 = None
+        for round_number in range(1, MAX_WARMUP_ROUNDS + 1):
+            found, latencies = 0, []
+            for chunk_key, vector in probes:
+                keys, latency = self.probe(index_name, vector)
+                found += chunk_key in keys
+                latencies.append(latency)
+            p95 = percentile(latencies, 0.95)
+            print(f"Warm-up round {round_number}: p50 {percentile(latencies, 0.5):.1f} ms, p95 {p95:.1f} ms, "
+                  f"{found} of {len(probes)} probes found their chunk")
+            if previous_p95 is not None and abs(p95 - previous_p95) <= WARMUP_TOLERANCE * previous_p95:
+                break
+            previous_p95 = p95
+        return found / len(probes)
+
+    def swap(self, current: str, target: str):
+        """Moves the alias in one request, searches and writes never see the alias on both or neither index"""
+        self.client.indices.update_aliases(body={"actions": [
+            {"remove": {"index": current, "alias": self.index_alias}},
+            {"add": {"index": target, "alias": self.index_alias}}
+        ]})
+        print(f"Moved alias {self.index_alias} from {current} to {target}")
+
+
+def check_no_ingestion_job(knowledge_base_id: str, data_source_id: str, since=None):
+    """Raises ReindexError if an ingestion job is running, or completed after since"""
+    jobs = boto3.client("bedrock-agent").list_ingestion_jobs(
+        knowledgeBaseId=knowledge_base_id, dataSourceId=data_source_id,
+        sortBy={"attribute": "STARTED_AT", "order": "DESCENDING"}, maxResults=10)["ingestionJobSummaries"]
+    for job in jobs:
+        if job["status"] in ACTIVE_INGESTION_JOB_STATUSES or (since and job["updatedAt"] > since):
+            raise ReindexError(f"Ingestion job {job['ingestionJobId']} is {job['status']}, it writes to the "
+                               f"current index only. Run the reindex again once it completed.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the vector index of a knowledge base behind its alias")
+    parser.add_argument("--knowledge-base", help="Name in the knowledge_bases context of cdk.json, the first by default")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent bulk requests")
+    parser.add_argument("--batch-size", type=int, default=200, help="Chunks per bulk request")
+    parser.add_argument("--page-size", type=int, default=500, help="Chunks per page of the search for the source documents of the current index")
+    parser.add_argument("--probes", type=int, default=100, help="Copied chunks queried to warm the new index")
+    parser.add_argument("--min-probe-recall", type=float, default=0.95,
+                        help="Share of probes that must find their own chunk before the alias moves")
+    parser.add_argument("--no-swap", action="store_true", help="Build and warm the new index without moving the alias")
+    parser.add_argument("--swap-to", help="Move the alias to an existing index, to roll back a reindex")
+    parser.add_argument("--delete-index", help="Delete a previous index that the alias no longer points to")
+    args = parser.parse_args()
+
+    context = read_context()
+    knowledge_bases = context["knowledge_bases"]
+    knowledge_base_name = args.knowledge_base or next(iter(knowledge_bases))
+    knowledgebase_parameters = knowledge_bases[knowledge_base_name]
+    aos_client = vector_index.get_aoss_client(vector_index.removeHttpsPrefix(
+        get_collection_endpoint(context["vector_store"]["collection_name"])))
+    reindexer = Reindexer(aos_client, knowledgebase_parameters, args.workers, args.batch_size, args.page_size)
+    current = reindexer.current_index()
+
+    if args.swap_to:
+        if not aos_client.indices.exists(index=args.swap_to):
+            raise ReindexError(f"Index {args.swap_to} does not exist")
+        reindexer.swap(current, args.swap_to)
+        return
+    if args.delete_index:
+        if args.delete_index == current:
+            raise ReindexError(f"Alias {reindexer.index_alias} points to {current}, move it with --swap-to first")
+        aos_client.indices.delete(index=args.delete_index)
+        print(f"Deleted index {args.delete_index}")
+        return
+
+    knowledge_base_id = get_stack_output(f"{knowledgebase_parameters['knowledge_base_name']}-id")
+    data_source_id = get_stack_output(f"{knowledgebase_parameters['knowledge_base_name']}-datsource-id")
+    check_no_ingestion_job(knowledge_base_id, data_source_id)
+    started_at = datetime.now(timezone.utc)
+    source_count = aos_client.count(index=current)["count"]
+
+    target = reindexer.next_index(current)
+    embedder = None
+    if not reindexer.vectors_compatible(current):
+        embedder = Embedder(knowledgebase_parameters["embedding_model_id"], reindexer.configuration)
+        print(f"The vectors of {current} do not fit the new vector field, embedding the chunks again "
+              f"with {embedder.model_id}")
+    print(f"Rebuilding {current} ({source_count:,} chunks) as {target} with {reindexer.configuration}")
+    reindexer.create_index(target)
+    copied, probes = reindexer.copy(current, target, args.probes, embedder)
+    if copied != source_count:
+        raise ReindexError(f"Copied {copied:,} of the {source_count:,} chunks of {current}, chunks without a "
+                           f"{SOURCE_URI_FIELD} are not copied. The alias still points to {current}.")
+    reindexer.wait_for_count(target, copied)
+    print(f"Copied {copied:,} chunks in {(datetime.now(timezone.utc) - started_at).total_seconds():.0f} seconds")
+
+    probe_recall = reindexer.warm(target, probes) if probes else 1.0
+    if probe_recall < args.min_probe_recall:
+        raise ReindexError(f"Only {probe_recall:.0%} of the probes found their chunk in {target}, the alias still "
+                           f"points to {current}. Check the parameters, or raise ef_search.")
+    check_no_ingestion_job(knowledge_base_id, data_source_id, since=started_at)
+    if aos_client.count(index=current)["count"] != source_count:
+        raise ReindexError(f"The chunk count of {current} changed during the copy, run the reindex again")
+    if args.no_swap:
+        print(f"Built {target}, move the alias to it with --swap-to {target}")
+        return
+    reindexer.swap(current, target)
+    print(f"Roll back with --swap-to {current}, delete the previous index with --delete-index {current}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except ReindexError as e:
+        print(f"Error: {e}")
+        sys.exit(1)